@@ -0,0 +1,217 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from build_dataset import HAZARD_COLUMNS, HAZARD_STATUSES, validate_columns
+from shelter_search import DISTANCE_COLUMN, vincenty_km
+
+# 出力する順位の列名と、避難所側の列に付ける接頭辞
+RANK_COLUMN = '順位'
+SHELTER_PREFIX = '避難所_'
+
+# 1回にまとめて処理する出発地点の数
+DEFAULT_CHUNK_SIZE = 10000
+
+
+# 出発地点ごとに上位 top_n 件の避難所の行位置と距離(km)を求める関数。
+# 戻り値は (出発地点の位置, 順位, 避難所の行位置, 距離) の配列で、出発地点・順位の順に並ぶ。
+def nearest_positions_batch(dataset, lats, lons, top_n=5, filter_column=None, filter_value=None):
+    index, mask = dataset.search_index(filter_column, filter_value)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+
+    # 候補の絞り込みは空間インデックスで地点ごとに行い、距離の計算はまとめて行う
+    origin_parts = []
+    candidate_parts = []
+    for i in np.flatnonzero(np.isfinite(lats) & np.isfinite(lons)):
+        candidates = index.nearest_candidates(lats[i], lons[i], top_n, mask=mask)
+        origin_parts.append(np.full(len(candidates), i, dtype=np.intp))
+        candidate_parts.append(candidates)
+
+    if not origin_parts:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty, empty, np.empty(0, dtype=float)
+
+    origins = np.concatenate(origin_parts)
+    candidates = np.concatenate(candidate_parts)
+    shelter_lats = np.asarray(dataset.store['緯度'], dtype=float)
+    shelter_lons = np.asarray(dataset.store['経度'], dtype=float)
+    distances = vincenty_km(lats[origins], lons[origins], shelter_lats[candidates], shelter_lons[candidates])
+
+    # 出発地点ごとに距離の近い順（同じ距離なら行位置順）に並べ、上位 top_n 件を残す
+    order = np.lexsort((candidates, distances, origins))
+    origins, candidates, distances = origins[order], candidates[order], distances[order]
+    group_starts = np.flatnonzero(np.r_[True, origins[1:] != origins[:-1]])
+    ranks = np.arange(len(origins)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(origins)]))
+    keep = ranks < top_n
+    return origins[keep], ranks[keep] + 1, candidates[keep], distances[keep]
+
+
+# 1チャンク分の検索結果（避難所側の列・順位・距離）を DataFrame にする関数
+def _nearest_chunk(dataset, lats, lons, top_n, filter_column, filter_value):
+    with metrics.span("batch_chunk", origins=len(lats)):
+        return _nearest_chunk_frame(dataset, lats, lons, top_n, filter_column, filter_value)
+
+
+def _nearest_chunk_frame(dataset, lats, lons, top_n, filter_column, filter_value):
+    origins, ranks, positions, distances = nearest_positions_batch(
+        dataset, lats, lons, top_n=top_n, filter_column=filter_column, filter_value=filter_value
+    )
+    shelters = dataset.store.take(positions).add_prefix(SHELTER_PREFIX).reset_index(drop=True)
+    # 避難所が見つからない地点の行では順位を欠損にするため、欠損を持てる整数型にする
+    shelters.insert(0, RANK_COLUMN, pd.array(ranks, dtype="Int64"))
+    shelters[DISTANCE_COLUMN] = distances
+
+    # 緯度・経度が欠損・数値でない地点や、条件に合う避難所がない地点も、避難所の列を空にした1行として残す
+    missing = np.setdiff1d(np.arange(len(lats)), origins)
+    if len(missing):
+        rows = np.concatenate([origins, missing])
+        order = np.argsort(rows, kind='stable')
+        shelters = shelters.reindex(range(len(rows))).iloc[order].reset_index(drop=True)
+        origins = rows[order]
+    return origins, shelters
+
+
+# プロセスプールの各ワーカーが使うデータセット
+_worker_dataset = None
+
+
+def _init_worker(dataset):
+    global _worker_dataset
+    _worker_dataset = dataset
+
+
+def _worker_chunk(args):
+    return _nearest_chunk(_worker_dataset, *args)
+
+
+# 出発地点を chunk_size 件ずつ検索し、チャンクごとの結果を順に返すジェネレータ。
+# 結果は出発地点の列に続けて、順位・避難所の列（接頭辞「避難所_」）・距離(km)を並べた縦持ちの表。
+# 避難所が見つからない地点（緯度・経度が欠損・数値でない地点を含む）は、順位・避難所の列を空にした1行になる。
+# workers を2以上にすると、チャンクをプロセスプールで並列に処理する。
+def iter_nearest_batch(dataset, origins, top_n=5, filter_column=None, filter_value=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    validate_columns(origins, ['緯度', '経度'], "出発地点のデータ")
+    lats = pd.to_numeric(origins['緯度'], errors='coerce').to_numpy(dtype=float)
+    lons = pd.to_numeric(origins['経度'], errors='coerce').to_numpy(dtype=float)
+
+    starts = range(0, len(origins), chunk_size)
+    tasks = [
+        (lats[start:start + chunk_size], lons[start:start + chunk_size], top_n, filter_column, filter_value)
+        for start in starts
+    ]
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(dataset,))
+        results = executor.map(_worker_chunk, tasks)
+    else:
+        executor = None
+        results = (_nearest_chunk(dataset, *task) for task in tasks)
+
+    try:
+        for start, (chunk_origins, shelters) in zip(starts, results):
+            origin_rows = origins.iloc[start + chunk_origins].reset_index(drop=True)
+            yield pd.concat([origin_rows, shelters], axis=1)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+# 出発地点ごとに上位 top_n 件の避難所をまとめて返す関数
+def find_nearest_batch(dataset, origins, top_n=5, filter_column=None, filter_value=None,
+                       chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    chunks = list(iter_nearest_batch(
+        dataset, origins, top_n=top_n, filter_column=filter_column, filter_value=filter_value,
+        chunk_size=chunk_size, workers=workers,
+    ))
+    if not chunks:
+        columns = list(origins.columns) + [RANK_COLUMN]
+        columns += [SHELTER_PREFIX + column for column in dataset.store.columns] + [DISTANCE_COLUMN]
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+# 検索結果をチャンクごとにファイルへ書き出す関数（拡張子が .parquet なら Parquet、それ以外は CSV）。
+# 全件をメモリに載せないため、大量の出発地点でも使用メモリはチャンクの大きさで決まる。
+def write_nearest_batch(dataset, origins, output_path, top_n=5, filter_column=None, filter_value=None,
+                        chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    chunks = iter_nearest_batch(
+        dataset, origins, top_n=top_n, filter_column=filter_column, filter_value=filter_value,
+        chunk_size=chunk_size, workers=workers,
+    )
+    rows = 0
+
+    if output_path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                if writer is None:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                else:
+                    table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
+
+    # Excel でも文字化けしないよう BOM 付き UTF-8 で書き出す
+    with open(output_path, "w", encoding="utf-8-sig", newline="") as f:
+        for chunk in chunks:
+            chunk.to_csv(f, header=rows == 0, index=False)
+            rows += len(chunk)
+    return rows
+
+
+def main(argv=None):
+    from build_dataset import DEFAULT_HAZARD_PATH, DEFAULT_OUTPUT_PATH, DEFAULT_SHELTER_PATH, ensure_merged_dataset
+    from shelter_dataset import ShelterDataset
+
+    parser = argparse.ArgumentParser(description="複数の出発地点について、最も近い避難所を一括で検索します。")
+    parser.add_argument("origins", help="出発地点のCSV（緯度・経度の列が必要）")
+    parser.add_argument("output", help="検索結果の出力先（.csv または .parquet）")
+    parser.add_argument("--top-n", type=int, default=5, help="出発地点ごとの避難所の件数")
+    parser.add_argument("--hazard", choices=[column[len('df2_'):] for column in HAZARD_COLUMNS],
+                        help="対応災害で絞り込む（例: 津波）")
+    parser.add_argument("--status", choices=HAZARD_STATUSES, default="O", help="絞込みに使う対応状況")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="一度に処理する出発地点の数")
+    parser.add_argument("--workers", type=int, default=1, help="並列に処理するプロセス数")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="災害別対応状況のCSV (DF2)")
+    parser.add_argument("--dataset", default=DEFAULT_OUTPUT_PATH, help="結合済みデータセットの Parquet ファイル")
+    args = parser.parse_args(argv)
+
+    filter_column = f"df2_{args.hazard}" if args.hazard else None
+    filter_value = args.status if args.hazard else None
+
+    try:
+        dataset = ShelterDataset.from_frame(
+            ensure_merged_dataset(args.shelters, args.hazards, args.dataset),
+            partition_columns=[filter_column] if filter_column else (),
+            partition_values=[filter_value] if filter_value else (),
+        )
+        origins = pd.read_csv(args.origins)
+        rows = write_nearest_batch(
+            dataset, origins, args.output, top_n=args.top_n, filter_column=filter_column,
+            filter_value=filter_value, chunk_size=args.chunk_size, workers=args.workers,
+        )
+    except (OSError, ValueError) as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{len(origins)} 地点の検索結果 {rows} 行を {os.path.abspath(args.output)} に書き出しました。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
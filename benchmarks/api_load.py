@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from urllib.parse import quote
+
+import numpy as np
+
+from benchmarks.synthetic import LAT_RANGE, LON_RANGE
+
+DEFAULT_SHELTERS = 10_000
+DEFAULT_CONNECTIONS = 64
+DEFAULT_DURATION = 10.0
+
+# 同じ地点の検索が集中する状況（避難指示の直後など）を想定し、
+# 要求のうちこの割合を少数の「よく検索される地点」から選ぶ
+DEFAULT_HOT_RATIO = 0.5
+HOT_POINTS = 20
+
+# よく検索される地点からの要求は、この範囲(度)でばらつかせる（同じ駅・避難区域の周辺にいる利用者を想定）
+HOT_JITTER_DEG = 0.001
+
+# 検索条件（なし・種別・対応災害）を順に使う
+QUERY_FILTERS = ["", "&type=" + quote("指定避難所"), "&disaster=" + quote("津波") + "&status=O"]
+
+# サーバーの読み込みを待つ最長の時間(秒)
+STARTUP_TIMEOUT_SECONDS = 120.0
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# 1つの要求を送り、(ステータス, 本文) を返す関数（接続は keep-alive で使い回す）
+async def _request(reader, writer, host, method, path, body=b""):
+    head = f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n"
+    if body:
+        head += "Content-Type: application/json\r\n"
+    writer.write((head + "\r\n").encode("utf-8") + body)
+    await writer.drain()
+
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def _get_json(host, port, path):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        status, body = await _request(reader, writer, host, "GET", path)
+        return status, json.loads(body)
+    finally:
+        writer.close()
+
+
+# サーバーがデータセットを読み込み終えるまで待つ関数。
+# 同じポートの複数のプロセスには接続ごとに振り分けられるため、
+# 続けて confirmations 回準備済みと返ってきたら、すべてのプロセスの準備が終わったとみなす
+async def wait_until_ready(host, port, timeout=STARTUP_TIMEOUT_SECONDS, confirmations=1):
+    deadline = time.monotonic() + timeout
+    ready = 0
+    while time.monotonic() < deadline:
+        try:
+            status, health = await _get_json(host, port, "/health")
+            ready = ready + 1 if status == 200 and health["status"] == "ok" else 0
+            if ready >= confirmations:
+                return health
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            ready = 0
+        if not ready:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{timeout:.0f} 秒以内にサーバーの準備が終わりませんでした")
+
+
+# 要求する地点（よく検索される地点と、ランダムな地点）を作る関数
+def make_paths(n, hot_ratio, batch_size, seed=1):
+    rng = np.random.default_rng(seed)
+    hot = np.column_stack([rng.uniform(*LAT_RANGE, HOT_POINTS), rng.uniform(*LON_RANGE, HOT_POINTS)])
+    paths = []
+    for i in range(n):
+        if batch_size:
+            points = np.column_stack([rng.uniform(*LAT_RANGE, batch_size), rng.uniform(*LON_RANGE, batch_size)])
+            paths.append(("POST", "/nearest/batch", json.dumps({"points": points.round(6).tolist()}).encode("utf-8")))
+            continue
+        if rng.random() < hot_ratio:
+            lat, lon = hot[rng.integers(HOT_POINTS)] + rng.uniform(-HOT_JITTER_DEG, HOT_JITTER_DEG, 2)
+        else:
+            lat, lon = rng.uniform(*LAT_RANGE), rng.uniform(*LON_RANGE)
+        paths.append(("GET", f"/nearest?lat={lat:.6f}&lon={lon:.6f}&top_n=5{QUERY_FILTERS[i % len(QUERY_FILTERS)]}", b""))
+    return paths
+
+
+# 1つの接続で、終了時刻まで要求を繰り返す関数
+async def _client(host, port, paths, offset, step, deadline, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        i = offset
+        while time.perf_counter() < deadline:
+            method, path, body = paths[i % len(paths)]
+            start = time.perf_counter()
+            status, _ = await _request(reader, writer, host, method, path, body)
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+            i += step
+    finally:
+        writer.close()
+
+
+# 指定した接続数・時間で負荷をかけ、(要求数/秒, 応答時間の分位点, ステータスごとの件数) を返す関数
+async def run_load(host, port, paths, connections, duration):
+    latencies = []
+    statuses = Counter()
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*[
+        _client(host, port, paths, offset, connections, deadline, latencies, statuses)
+        for offset in range(connections)
+    ])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    quantiles = {q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] for q in (0.5, 0.95, 0.99)} \
+        if latencies else {}
+    return len(latencies) / elapsed, quantiles, statuses
+
+
+# 合成データの CSV を書き出し、サーバーを起動する関数（起動したプロセスのリストを返す）
+def start_servers(size, directory, port, processes, workers, cell_deg=0):
+    from benchmarks.synthetic import make_source_frames
+
+    df1, df2 = make_source_frames(size)
+    shelter_path = os.path.join(directory, "shelters.csv")
+    hazard_path = os.path.join(directory, "hazards.csv")
+    df1.to_csv(shelter_path, index=False)
+    df2.to_csv(hazard_path, index=False)
+
+    command = [
+        sys.executable, "-m", "shelter_api", "--port", str(port), "--workers", str(workers),
+        "--cell-deg", str(cell_deg), "--shelters", shelter_path, "--hazards", hazard_path, "--dataset", os.path.join(directory, "merged.parquet"),
+    ]
+    if processes > 1:
+        # 複数のプロセスは同じポートで待ち受け、データセットは共有メモリで1つだけ持つ
+        command += ["--reuse-port", "--shared-dir", os.path.join(directory, "shared")]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return [
+        subprocess.Popen(command, cwd=root, stdout=subprocess.DEVNULL)
+        for _ in range(processes)
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="避難所検索の HTTP サーバー(shelter_api)に負荷をかけ、処理できる要求数を測定します。")
+    parser.add_argument("--url", help="測定するサーバー（例: http://127.0.0.1:8080）。省略時は合成データでサーバーを起動する")
+    parser.add_argument("--shelters", type=int, default=DEFAULT_SHELTERS, help="起動するサーバーの避難所の件数")
+    parser.add_argument("--processes", type=int, default=1, help="起動するサーバーのプロセス数")
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1), help="サーバー1つあたりの検索スレッド数")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="同時に接続するクライアントの数")
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="負荷をかける時間(秒)")
+    parser.add_argument("--hot-ratio", type=float, default=DEFAULT_HOT_RATIO,
+                        help="よく検索される地点を要求する割合（キャッシュ・同時検索のまとめの効果を見る）")
+    parser.add_argument("--cell-deg", type=float, default=0, help="起動するサーバーでセルごとの候補のキャッシュを使う場合のセルの大きさ(度)")
+    parser.add_argument("--batch-size", type=int, default=0, help="1以上なら、この地点数の一括検索(/nearest/batch)で測定する")
+    args = parser.parse_args(argv)
+
+    paths = make_paths(10_000, args.hot_ratio, args.batch_size)
+    with tempfile.TemporaryDirectory() as directory:
+        servers = []
+        try:
+            if args.url:
+                host, _, port = args.url.split("//")[-1].rstrip("/").partition(":")
+                port = int(port or 80)
+            else:
+                host, port = "127.0.0.1", _free_port()
+                servers = start_servers(args.shelters, directory, port, args.processes, args.workers, args.cell_deg)
+            health = asyncio.run(wait_until_ready(host, port, confirmations=8 * len(servers) or 1))
+            print(f"避難所 {health['rows']} 件, 接続 {args.connections}, {args.duration:.0f} 秒"
+                  + (f", 一括検索 {args.batch_size} 地点" if args.batch_size else f", 集中する地点の割合 {args.hot_ratio}"))
+
+            qps, quantiles, statuses = asyncio.run(run_load(host, port, paths, args.connections, args.duration))
+            print(f"{qps:.0f} 要求/秒" + (f" ({qps * args.batch_size:.0f} 地点/秒)" if args.batch_size else ""))
+            print("応答時間(ms): " + ", ".join(f"p{int(q * 100)} {seconds * 1000:.1f}" for q, seconds in quantiles.items()))
+            print("ステータス: " + ", ".join(f"{status}: {n}" for status, n in sorted(statuses.items())))
+
+            _, health = asyncio.run(_get_json(host, port, "/health"))
+            print(f"検索キャッシュ: ヒット {health['cache']['hits']}, ミス {health['cache']['misses']}, "
+                  f"同時検索のまとめ {health['coalesced']}")
+            if "cell_cache" in health:
+                cell = health["cell_cache"]
+                print(f"セルごとの候補: セル {cell['cells']} 件, ヒット {cell['hits']}, ミス {cell['misses']}"
+                      + (f", ヒット率 {cell['hit_rate']:.1%}" if cell["hit_rate"] is not None else ""))
+        except (OSError, TimeoutError) as e:
+            print(f"エラーが発生しました: {e}", file=sys.stderr)
+            return 1
+        finally:
+            for server in servers:
+                server.terminate()
+                server.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from batch_search import write_nearest_batch
+from benchmarks.synthetic import LAT_RANGE, LON_RANGE, make_merged_dataset
+from build_dataset import HAZARD_COLUMNS, HAZARD_STATUSES
+from shelter_dataset import ShelterDataset
+
+DEFAULT_ORIGINS = [10_000, 100_000]
+DEFAULT_SHELTERS = 10_000
+
+
+# 出発地点（住所や施設を想定）をランダムに作る関数
+def make_origins(n, seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        '地点ID': np.arange(n),
+        '緯度': rng.uniform(*LAT_RANGE, n),
+        '経度': rng.uniform(*LON_RANGE, n),
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="一括検索(batch_search)の処理速度を測定します。")
+    parser.add_argument("--origins", type=int, nargs="+", default=DEFAULT_ORIGINS, help="出発地点の数")
+    parser.add_argument("--shelters", type=int, default=DEFAULT_SHELTERS, help="避難所の件数")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1], help="並列プロセス数")
+    parser.add_argument("--top-n", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    dataset = ShelterDataset.from_frame(
+        make_merged_dataset(args.shelters), partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES
+    )
+
+    print(f"避難所 {args.shelters} 件, 上位 {args.top_n} 件")
+    print(f"{'出発地点':>10} {'絞込み':>10} {'プロセス':>8} {'秒':>8} {'地点/秒':>10}")
+    with tempfile.TemporaryDirectory() as directory:
+        output_path = os.path.join(directory, "result.parquet")
+        for n in args.origins:
+            origins = make_origins(n)
+            for filter_column, filter_value in [(None, None), ('df2_津波', 'O')]:
+                for workers in sorted(set(args.workers)):
+                    start = time.perf_counter()
+                    write_nearest_batch(dataset, origins, output_path, top_n=args.top_n,
+                                        filter_column=filter_column, filter_value=filter_value, workers=workers)
+                    elapsed = time.perf_counter() - start
+                    label = f"{filter_column}={filter_value}" if filter_column else "なし"
+                    print(f"{n:>10} {label:>10} {workers:>8} {elapsed:>8.2f} {n / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
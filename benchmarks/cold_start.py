@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+# 起動時に読み込まれるモジュールを段階ごとに測る（前の段階で読み込まれたものは含まない）。
+# 「アプリ本体」がコンテナの起動直後（streamlit は読み込み済み）に毎回かかる分で、
+# それ以降は初めて使うとき（データの読み込み・検索・地図の表示）に読み込まれる分
+IMPORT_STAGES = [
+    ("streamlit", "import streamlit"),
+    ("アプリ本体", "import hinanjo_app"),
+    ("データセット読み込み", "import build_dataset, shelter_dataset, shared_dataset"),
+    ("検索(geopy)", "import geopy.distance"),
+    ("地図(folium)", "import shelter_map, streamlit_folium"),
+    ("一括検索", "import batch_search"),
+]
+
+# 段階の区切りとして標準エラー出力に書く行
+STAGE_MARKER = "@@stage"
+
+# 段階ごとに表示する、時間のかかったモジュールの数
+TOP_MODULES = 5
+
+
+# python -X importtime の出力から、段階ごとの (合計秒, [(モジュール, 秒), ...]) を返す関数。
+# 段階の合計は、その段階で最上位として読み込まれたモジュールの累積時間の和
+def parse_importtime(stderr):
+    stages = [[]]
+    for line in stderr.splitlines():
+        if line == STAGE_MARKER:
+            stages.append([])
+            continue
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|", 2)
+        name = name[1:]
+        if name.startswith(" "):
+            continue
+        stages[-1].append((name, int(cumulative) / 1e6))
+    return [
+        (sum(seconds for _, seconds in modules), sorted(modules, key=lambda item: -item[1])[:TOP_MODULES])
+        for modules in stages
+    ]
+
+
+# 新しいプロセスで各段階のモジュールを読み込み、読み込み時間を測る関数
+def measure_imports(repo_dir):
+    marker = f"import sys; sys.stderr.write({STAGE_MARKER + chr(10)!r}); sys.stderr.flush()"
+    code = f"\n{marker}\n".join(statement for _, statement in IMPORT_STAGES)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=repo_dir, capture_output=True, text=True, check=True,
+    )
+    return {
+        label: {"seconds": total, "top": [{"module": name, "seconds": seconds} for name, seconds in top]}
+        for (label, _), (total, top) in zip(IMPORT_STAGES, parse_importtime(completed.stderr))
+    }
+
+
+# データの読み込みから最初の検索までの各段階の時間(秒)を測る関数
+def measure_phases(shelter_path, hazard_path):
+    from build_dataset import load_merged_dataset, merge_shelter_data, read_hazard_csv, read_shelter_csv
+    from shelter_dataset import ShelterDataset, dataset_fingerprint
+    from shelter_index import build_index, build_partitioned_index
+    from shelter_map import OverviewData
+    from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+    from shelter_store import ShelterStore
+
+    phases = {}
+
+    def timed(name, function, *args, **kwargs):
+        start = time.perf_counter()
+        value = function(*args, **kwargs)
+        phases[name] = time.perf_counter() - start
+        return value
+
+    df1 = timed("CSV読み込み(DF1)", read_shelter_csv, shelter_path)
+    df2 = timed("CSV読み込み(DF2)", read_hazard_csv, hazard_path)
+    merged = timed("結合", merge_shelter_data, df1, df2)
+
+    with tempfile.TemporaryDirectory() as directory:
+        parquet_path = os.path.join(directory, "merged.parquet")
+        timed("Parquet書き出し", merged.to_parquet, parquet_path, index=False)
+        merged = timed("Parquet読み込み", load_merged_dataset, parquet_path)
+
+    version = timed("バージョン計算", dataset_fingerprint, merged)
+    store = timed("型付きストア", ShelterStore.from_frame, merged)
+    index = timed("空間インデックス", build_index, store)
+    partitions = timed(
+        "分割インデックス", build_partitioned_index, store, list(SHELTER_TYPE_COLUMNS) + HAZARD_COLUMNS, HAZARD_STATUSES
+    )
+    dataset = ShelterDataset(version, store, index, partitions)
+
+    lat = float(store['緯度'][0])
+    lon = float(store['経度'][0])
+    timed("最初の検索", dataset.find_nearest, lat, lon)
+    timed("全避難所の表示データ", OverviewData.from_dataset, dataset)
+    return phases, len(merged)
+
+
+def git_revision(repo_dir):
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=repo_dir, capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def main(argv=None):
+    from build_dataset import DEFAULT_HAZARD_PATH, DEFAULT_SHELTER_PATH
+
+    parser = argparse.ArgumentParser(description="アプリの起動時間（モジュールの読み込みとデータの準備）を段階ごとに測定します。")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="災害別対応状況のCSV (DF2)")
+    parser.add_argument("--synthetic", type=int, help="CSV の代わりに、この件数の合成データを使う")
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル（リリースごとの比較用）")
+    args = parser.parse_args(argv)
+
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    imports = measure_imports(repo_dir)
+
+    with tempfile.TemporaryDirectory() as directory:
+        shelter_path, hazard_path = args.shelters, args.hazards
+        if args.synthetic:
+            from benchmarks.synthetic import make_source_frames
+
+            df1, df2 = make_source_frames(args.synthetic)
+            shelter_path = os.path.join(directory, "shelters.csv")
+            hazard_path = os.path.join(directory, "hazards.csv")
+            df1.to_csv(shelter_path, index=False)
+            df2.to_csv(hazard_path, index=False)
+        phases, rows = measure_phases(shelter_path, hazard_path)
+
+    print("モジュールの読み込み")
+    for label, stage in imports.items():
+        top = ", ".join(f"{item['module']} {item['seconds']:.3f}" for item in stage["top"])
+        print(f"  {label:<20} {stage['seconds']:>7.3f} 秒  ({top})")
+
+    print(f"データの準備（{rows} 件）")
+    for name, seconds in phases.items():
+        print(f"  {name:<20} {seconds:>7.3f} 秒")
+
+    if args.json:
+        report = {
+            "revision": git_revision(repo_dir),
+            "python": platform.python_version(),
+            "rows": rows,
+            "imports": imports,
+            "phases": phases,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
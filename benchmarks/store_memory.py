@@ -0,0 +1,39 @@
+import argparse
+
+import pandas as pd
+
+from benchmarks.synthetic import make_merged_dataset
+from shelter_store import ShelterStore
+
+DEFAULT_SIZES = [10_000, 100_000]
+
+
+# 文字列・カテゴリ列を Python オブジェクトの列に戻す（ストア導入前の load_data と同じ持ち方）
+def as_object_frame(df):
+    columns = [column for column in df.columns if not pd.api.types.is_numeric_dtype(df[column].dtype)
+               or isinstance(df[column].dtype, pd.CategoricalDtype)]
+    return df.astype({column: object for column in columns})
+
+
+def measure(n, seed=0):
+    df = make_merged_dataset(n, seed=seed)
+    object_bytes = int(as_object_frame(df).memory_usage(index=True, deep=True).sum())
+    frame_bytes = int(df.memory_usage(index=True, deep=True).sum())
+    store_bytes = ShelterStore.from_frame(df).nbytes
+    return object_bytes, frame_bytes, store_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="DataFrame と ShelterStore のメモリ使用量を比較します。")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="避難所の件数")
+    args = parser.parse_args(argv)
+
+    print(f"{'件数':>10} {'object列(MB)':>14} {'読込時(MB)':>12} {'ストア(MB)':>12} {'削減率':>8}")
+    for n in args.sizes:
+        object_bytes, frame_bytes, store_bytes = measure(n)
+        print(f"{n:>10} {object_bytes / 1e6:>14.2f} {frame_bytes / 1e6:>12.2f} "
+              f"{store_bytes / 1e6:>12.2f} {object_bytes / store_bytes:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
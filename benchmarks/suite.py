@@ -0,0 +1,305 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_QUERIES = 1000
+DEFAULT_RENDERS = 20
+
+# 検索の出発地点と、測定に使う乱数の種（同じ条件なら毎回同じデータ・同じ地点で測る）
+SEED = 0
+ORIGIN_SEED = 1
+
+
+# 各測定の準備と本体。
+# 準備（setup）はデータの読み込みなど測定対象外の処理で、本体（run）は処理した件数を返す。
+# 1つの測定は別プロセスで行い、準備後からのメモリ使用量の最大値の増分を記録する
+
+def _setup_load(paths, options):
+    # モジュールの読み込み（pandas など）は測定に含めない
+    from build_dataset import read_source_csv
+
+    return read_source_csv, paths
+
+
+def _run_load(state):
+    read_source_csv, paths = state
+    return len(read_source_csv(paths["shelters"])) + len(read_source_csv(paths["hazards"]))
+
+
+# 必要な列だけをチャンクごとに読む方式（build_dataset.py が成果物を作るときの読み込み）
+def _setup_load_columns(paths, options, engine="c"):
+    from build_dataset import read_hazard_csv, read_shelter_csv
+
+    if engine == "pyarrow":
+        import pyarrow.csv  # noqa: F401
+    return read_shelter_csv, read_hazard_csv, paths, engine
+
+
+def _run_load_columns(state):
+    read_shelter_csv, read_hazard_csv, paths, engine = state
+    return len(read_shelter_csv(paths["shelters"], engine=engine)) + len(read_hazard_csv(paths["hazards"], engine=engine))
+
+
+def _setup_merge(paths, options):
+    from build_dataset import read_hazard_csv, read_shelter_csv
+
+    return read_shelter_csv(paths["shelters"]), read_hazard_csv(paths["hazards"])
+
+
+def _run_merge(frames):
+    from build_dataset import merge_shelter_data
+
+    return len(merge_shelter_data(*frames))
+
+
+def _setup_build(paths, options):
+    from build_dataset import load_merged_dataset
+    import shelter_dataset  # noqa: F401
+
+    return load_merged_dataset(paths["merged"])
+
+
+def _run_build(merged):
+    from shelter_dataset import ShelterDataset
+    from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+
+    ShelterDataset.from_frame(
+        merged, partition_columns=list(SHELTER_TYPE_COLUMNS) + HAZARD_COLUMNS, partition_values=HAZARD_STATUSES
+    )
+    return len(merged)
+
+
+def _setup_search(paths, options, filter_column=None, filter_value=None, partitioned=True):
+    from benchmarks.batch_throughput import make_origins
+    from build_dataset import load_merged_dataset
+    from shelter_dataset import ShelterDataset
+
+    merged = load_merged_dataset(paths["merged"])
+    partition_columns = [filter_column] if filter_column and partitioned else ()
+    dataset = ShelterDataset.from_frame(merged, partition_columns=partition_columns, partition_values=[filter_value])
+    origins = make_origins(options["queries"], seed=ORIGIN_SEED)
+
+    # 初回だけかかる処理（geopy の読み込みなど）を測定に含めない
+    dataset.find_nearest(float(origins['緯度'][0]), float(origins['経度'][0]), filter_column, filter_value)
+    return dataset, origins, filter_column, filter_value
+
+
+def _run_search(state):
+    dataset, origins, filter_column, filter_value = state
+    for lat, lon in zip(origins['緯度'], origins['経度']):
+        dataset.find_nearest(lat, lon, filter_column=filter_column, filter_value=filter_value, top_n=5)
+    return len(origins)
+
+
+# 複数災害の条件・重みによる順位付け（hazard_ranking.rank_shelters）
+def _setup_rank(paths, options, weights=None):
+    from benchmarks.batch_throughput import make_origins
+    from build_dataset import load_merged_dataset
+    from hazard_ranking import HazardMatrix, rank_shelters
+    from shelter_dataset import ShelterDataset
+    from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES
+
+    dataset = ShelterDataset.from_frame(
+        load_merged_dataset(paths["merged"]), partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES
+    )
+    matrix = HazardMatrix.from_dataset(dataset)
+    origins = make_origins(options["queries"], seed=ORIGIN_SEED)
+    requirements = {'df2_津波': 'O', 'df2_土砂': 'A'}
+    rank_shelters(dataset, float(origins['緯度'][0]), float(origins['経度'][0]), requirements, weights, matrix=matrix)
+    return dataset, matrix, origins, requirements, weights
+
+
+def _run_rank(state):
+    from hazard_ranking import rank_shelters
+
+    dataset, matrix, origins, requirements, weights = state
+    for lat, lon in zip(origins['緯度'], origins['経度']):
+        rank_shelters(dataset, lat, lon, requirements, weights, top_n=5, matrix=matrix)
+    return len(origins)
+
+
+def _setup_plot(paths, options, overview=False):
+    from build_dataset import load_merged_dataset
+    from shelter_dataset import ShelterDataset
+    from shelter_map import OverviewData, plot_on_map
+
+    dataset = ShelterDataset.from_frame(load_merged_dataset(paths["merged"]))
+    # 初回だけかかる処理（テンプレートの読み込みなど）を測定に含めない
+    plot_on_map(0.0, 0.0, dataset.store.take(np.empty(0, dtype=np.int64))).get_root().render()
+    lat = float(np.nanmedian(dataset.store['緯度']))
+    lon = float(np.nanmedian(dataset.store['経度']))
+    nearest = dataset.find_nearest(lat, lon)
+    overview_data = OverviewData.from_dataset(dataset, 'df2_津波') if overview else None
+    return lat, lon, nearest, overview_data, options["renders"]
+
+
+def _run_plot(state):
+    from shelter_map import plot_on_map
+
+    lat, lon, nearest, overview, renders = state
+    for _ in range(renders):
+        # st_folium と同じく、地図を HTML まで描画する
+        plot_on_map(lat, lon, nearest, overview).get_root().render()
+    return renders
+
+
+# 測定名 -> (準備, 本体, 件数の単位)
+CASES = {
+    "load_data": (_setup_load, _run_load, "行"),
+    "load_data[列指定]": (_setup_load_columns, _run_load_columns, "行"),
+    "load_data[列指定,pyarrow]": (
+        lambda paths, options: _setup_load_columns(paths, options, "pyarrow"), _run_load_columns, "行"
+    ),
+    "merge": (_setup_merge, _run_merge, "行"),
+    "build_dataset": (_setup_build, _run_build, "行"),
+    "find_nearest": (_setup_search, _run_search, "検索"),
+    "find_nearest[津波=O]": (
+        lambda paths, options: _setup_search(paths, options, 'df2_津波', 'O'), _run_search, "検索"
+    ),
+    "find_nearest[津波=O,分割なし]": (
+        lambda paths, options: _setup_search(paths, options, 'df2_津波', 'O', partitioned=False), _run_search, "検索"
+    ),
+    "rank_shelters[津波=O,土砂>=A]": (_setup_rank, _run_rank, "検索"),
+    "rank_shelters[重み付き]": (
+        lambda paths, options: _setup_rank(paths, options, {'df2_洪水': 0.5, 'df2_津波': 1.0}), _run_rank, "検索"
+    ),
+    "plot_on_map": (_setup_plot, _run_plot, "描画"),
+    "plot_on_map[全避難所]": (lambda paths, options: _setup_plot(paths, options, overview=True), _run_plot, "描画"),
+}
+
+
+# /proc/self/status の項目（VmRSS: 現在, VmHWM: 最大）をバイトで返す関数（Linux 以外は None）
+def _proc_status_bytes(field):
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# メモリ使用量(RSS)の最大値を、現在の使用量まで戻す関数（戻せた場合は True）
+def _reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes():
+    peak = _proc_status_bytes("VmHWM")
+    if peak is not None:
+        return peak
+    # ru_maxrss は Linux では KiB、macOS ではバイト。
+    # Linux では exec 前（親プロセス）の値を引き継ぐため、VmHWM を読めるときはそちらを使う
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+# 子プロセスで1つの測定を行い、(秒, 件数, 測定中のメモリ使用量の最大値, 測定開始時からの増分) を返す関数。
+# 最大値を戻せない環境では、準備中を含めたプロセス全体の最大値になる
+def _measure(case, paths, options):
+    setup, run, _ = CASES[case]
+    state = setup(paths, options)
+    _reset_peak_rss()
+    baseline = _proc_status_bytes("VmRSS") or _peak_rss_bytes()
+    start = time.perf_counter()
+    count = run(state)
+    elapsed = time.perf_counter() - start
+    peak = _peak_rss_bytes()
+    return elapsed, count, peak, max(0, peak - baseline)
+
+
+# 指定した件数の合成データを CSV と結合済みの Parquet として書き出す関数
+def write_inputs(size, directory):
+    from benchmarks.synthetic import make_source_frames
+    from build_dataset import merge_shelter_data
+
+    df1, df2 = make_source_frames(size, seed=SEED)
+    paths = {
+        "shelters": os.path.join(directory, f"shelters_{size}.csv"),
+        "hazards": os.path.join(directory, f"hazards_{size}.csv"),
+        "merged": os.path.join(directory, f"merged_{size}.parquet"),
+    }
+    df1.to_csv(paths["shelters"], index=False)
+    df2.to_csv(paths["hazards"], index=False)
+    merge_shelter_data(df1, df2).to_parquet(paths["merged"], index=False)
+    return paths
+
+
+# 実際の CSV（DF1 / DF2）を入力とし、結合済みの Parquet を書き出す関数（件数と入力を返す）
+def real_inputs(shelter_path, hazard_path, directory):
+    from build_dataset import merge_shelter_data, read_hazard_csv, read_shelter_csv
+
+    merged = merge_shelter_data(read_shelter_csv(shelter_path), read_hazard_csv(hazard_path))
+    paths = {"shelters": shelter_path, "hazards": hazard_path, "merged": os.path.join(directory, "merged_real.parquet")}
+    merged.to_parquet(paths["merged"], index=False)
+    return len(merged), paths
+
+
+def main(argv=None):
+    from build_dataset import DEFAULT_HAZARD_PATH, DEFAULT_SHELTER_PATH
+
+    parser = argparse.ArgumentParser(
+        description="読み込み・結合・検索・地図描画の処理速度とメモリ使用量を、避難所の件数ごとに測定します。"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成データの避難所の件数")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="実データの避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="実データの災害別対応状況のCSV (DF2)")
+    parser.add_argument("--no-real", action="store_true", help="実データでの測定を行わない")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES), help="測定する処理")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="検索の測定で行う検索の回数")
+    parser.add_argument("--renders", type=int, default=DEFAULT_RENDERS, help="地図の測定で描画する回数")
+    parser.add_argument("--json", help="結果を JSON で書き出すファイル（前回の結果との比較用）")
+    args = parser.parse_args(argv)
+
+    options = {"queries": args.queries, "renders": args.renders}
+    results = []
+    print(f"{'データ':<6} {'件数':>9} {'処理':<28} {'秒':>8} {'件/秒':>12} {'最大メモリ(MB)':>14} {'増分(MB)':>10}")
+
+    # 測定ごとに新しいプロセスを使い、前の測定のメモリやキャッシュの影響を受けないようにする
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        # 実データ（CSV がそろっている場合）と、指定した件数の合成データで測定する
+        inputs = []
+        if not args.no_real and os.path.exists(args.shelters) and os.path.exists(args.hazards):
+            inputs.append(("実データ",) + real_inputs(args.shelters, args.hazards, directory))
+        elif not args.no_real:
+            print(f"{args.shelters} または {args.hazards} が見つからないため、実データでの測定は行いません。")
+        for size in args.sizes:
+            inputs.append(("合成", size, write_inputs(size, directory)))
+
+        for source, size, paths in inputs:
+            for case in args.cases:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    elapsed, count, peak_bytes, delta_bytes = executor.submit(_measure, case, paths, options).result()
+                unit = CASES[case][2]
+                results.append({
+                    "source": source, "size": size, "case": case, "seconds": elapsed, "count": count, "unit": unit,
+                    "throughput": count / elapsed if elapsed else None, "peak_rss_bytes": peak_bytes, "peak_rss_delta_bytes": delta_bytes,
+                })
+                print(f"{source:<6} {size:>9} {case:<28} {elapsed:>8.3f} {count / elapsed:>10.0f}{unit} {peak_bytes / 2**20:>14.1f} {delta_bytes / 2**20:>10.1f}")
+
+    if args.json:
+        report = {"python": platform.python_version(), "machine": platform.machine(), "results": results}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
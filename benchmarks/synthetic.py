@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from build_dataset import KEY_COLUMN, merge_shelter_data, read_source_csv
+
+# 施設名・住所・対応状況の元にする実データ
+SOURCE_PATH = "ehime_hinan.csv"
+
+# 避難所を配置する範囲（愛媛県付近）と、避難所が集まる地区の広がり(度)
+LAT_RANGE = (32.9, 34.4)
+LON_RANGE = (132.0, 133.7)
+CLUSTER_SPREAD_DEG = 0.02
+
+# 1地区あたりの平均的な避難所数
+SHELTERS_PER_CLUSTER = 50
+
+
+# 避難所一覧(DF1)と災害別対応状況(DF2)の合成データを作る関数。
+# 施設名・住所・対応状況は ehime_hinan.csv から抽出し、行ごとに一意になるよう番号を付ける。
+def make_source_frames(n, seed=0, source_path=SOURCE_PATH):
+    rng = np.random.default_rng(seed)
+    source = read_source_csv(source_path)
+    picked = source.iloc[rng.integers(0, len(source), n)].reset_index(drop=True)
+    suffix = pd.Series(np.arange(n)).astype(str)
+
+    # 共通IDは14桁。最後から2文字目は 1(指定) が大半で、一部を 2(福祉) にする
+    kinds = np.where(rng.random(n) < 0.05, "2", "1")
+    ids = "S" + pd.Series(np.arange(n)).astype(str).str.zfill(11) + kinds + "1"
+
+    # 地区の中心の周りに避難所を配置する
+    centres = np.column_stack([
+        rng.uniform(*LAT_RANGE, max(1, n // SHELTERS_PER_CLUSTER)),
+        rng.uniform(*LON_RANGE, max(1, n // SHELTERS_PER_CLUSTER)),
+    ])
+    points = centres[rng.integers(0, len(centres), n)] + rng.normal(0, CLUSTER_SPREAD_DEG, (n, 2))
+
+    # 住所が空欄の行は市町村名＋地区名で補う
+    addresses = picked['df2_住所'].fillna(picked['市町村'].fillna("") + picked['df2_地区名'].fillna(""))
+
+    df1 = pd.DataFrame({
+        '施設・場所名': picked['df2_施設名'].fillna("避難所") + suffix,
+        '住所': addresses + "-" + suffix,
+        '緯度': points[:, 0],
+        '経度': points[:, 1],
+        KEY_COLUMN: ids,
+    })
+    df2 = picked.copy()
+    df2[KEY_COLUMN] = ids
+    return df1, df2
+
+
+# 結合済みの合成データセット（build_dataset.py の出力と同じ形）を作る関数
+def make_merged_dataset(n, seed=0, source_path=SOURCE_PATH):
+    return merge_shelter_data(*make_source_frames(n, seed=seed, source_path=source_path))
+
+
+# 合成の道路グラフ（road_network.RoadGraph）を作る関数。
+# spacing_deg 間隔の格子状の道路から drop_rate の割合の区間を取り除き、
+# 山や川で道が途切れ、直線距離より大きく回り道になる地形を模す。
+def make_road_graph(spacing_deg=0.005, drop_rate=0.3, seed=0):
+    from road_network import RoadGraph
+
+    rng = np.random.default_rng(seed)
+    lat_steps = np.arange(LAT_RANGE[0], LAT_RANGE[1], spacing_deg)
+    lon_steps = np.arange(LON_RANGE[0], LON_RANGE[1], spacing_deg)
+    rows, cols = len(lat_steps), len(lon_steps)
+
+    grid_lats, grid_lons = np.meshgrid(lat_steps, lon_steps, indexing='ij')
+    jitter = rng.uniform(-0.3, 0.3, (2, rows, cols)) * spacing_deg
+    lats = (grid_lats + jitter[0]).ravel()
+    lons = (grid_lons + jitter[1]).ravel()
+
+    node_ids = np.arange(rows * cols).reshape(rows, cols)
+    sources = np.concatenate([node_ids[:, :-1].ravel(), node_ids[:-1, :].ravel()])
+    targets = np.concatenate([node_ids[:, 1:].ravel(), node_ids[1:, :].ravel()])
+    keep = rng.random(len(sources)) >= drop_rate
+    return RoadGraph.from_edges(lats, lons, sources[keep], targets[keep])
@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.batch_throughput import make_origins
+from benchmarks.synthetic import make_merged_dataset, make_road_graph
+from road_network import WalkingRouter
+from shelter_dataset import ShelterDataset
+
+DEFAULT_SHELTERS = 10_000
+DEFAULT_QUERIES = 500
+
+
+# 1回ずつの検索時間(ms)を測る関数
+def measure_ms(search, origins):
+    times = []
+    for lat, lon in zip(origins['緯度'], origins['経度']):
+        start = time.perf_counter()
+        search(lat, lon)
+        times.append((time.perf_counter() - start) * 1000)
+    return np.array(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="直線距離と徒歩距離（道路グラフ）による検索の応答時間を比較します。")
+    parser.add_argument("--shelters", type=int, default=DEFAULT_SHELTERS, help="避難所の件数")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="検索の回数")
+    parser.add_argument("--spacing", type=float, nargs="+", default=[0.005, 0.002], help="道路の格子の間隔(度)")
+    parser.add_argument("--top-n", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    dataset = ShelterDataset.from_frame(make_merged_dataset(args.shelters))
+    origins = make_origins(args.queries)
+
+    print(f"避難所 {args.shelters} 件, 上位 {args.top_n} 件, {args.queries} 回")
+    print(f"{'方式':<24} {'ノード数':>10} {'準備(秒)':>9} {'p50(ms)':>9} {'p95(ms)':>9} {'p99(ms)':>9}")
+
+    def report(label, nodes, setup_seconds, times):
+        p50, p95, p99 = np.percentile(times, [50, 95, 99])
+        print(f"{label:<24} {nodes:>10} {setup_seconds:>9.2f} {p50:>9.2f} {p95:>9.2f} {p99:>9.2f}")
+
+    times = measure_ms(lambda lat, lon: dataset.find_nearest(lat, lon, top_n=args.top_n), origins)
+    report("直線距離(geodesic)", "-", 0.0, times)
+
+    for spacing in args.spacing:
+        start = time.perf_counter()
+        graph = make_road_graph(spacing_deg=spacing)
+        router = WalkingRouter(graph, dataset)
+        setup_seconds = time.perf_counter() - start
+
+        times = measure_ms(lambda lat, lon: router.find_nearest(lat, lon, top_n=args.top_n), origins)
+        report(f"徒歩距離(間隔{spacing}度)", len(graph), setup_seconds, times)
+
+
+if __name__ == "__main__":
+    main()
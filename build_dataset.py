@@ -0,0 +1,321 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from shelter_schema import (
+    ELEVATION_COLUMN, HAZARD_COLUMNS, HAZARD_STATUSES, KEY_COLUMN, SHELTER_COLUMNS, SHELTER_TYPE_COLUMNS,
+    STATUS_ALIASES,
+)
+
+# 既定の入力ファイルと出力ファイル
+DEFAULT_SHELTER_PATH = "mergeFromCity_1.csv"
+DEFAULT_HAZARD_PATH = "ehime_hinan.csv"
+DEFAULT_OUTPUT_PATH = "shelters_merged.parquet"
+
+# 成果物の形式の版（列構成などを変えたら上げる）
+ARTIFACT_FORMAT_VERSION = 5
+
+# CSV を読み込むときの1チャンクの行数と、既定の読み込み方式（"c": pandas, "pyarrow": pyarrow の CSV リーダー）
+CSV_CHUNK_ROWS = 100_000
+CSV_ENGINES = ("c", "pyarrow")
+DEFAULT_CSV_ENGINE = "c"
+
+# 避難所一覧(DF1)・災害別対応状況(DF2)から読み込む列とその型（それ以外の列は読まない）。
+# 型が None の列（座標・標高）は、pandas では型を推定させ、pyarrow では文字列として読む。
+# どちらも不正な値が混じっていることがあるため、チャンクごとに数値にする。
+# 標高の列は DF2 にある場合だけ読む（read_hazard_csv で追加する）。
+SHELTER_DTYPES = {column: None if column in ('緯度', '経度') else str for column in SHELTER_COLUMNS}
+HAZARD_DTYPES = {column: str for column in [KEY_COLUMN] + HAZARD_COLUMNS}
+
+
+# 必要な列が揃っているか確認する関数
+def validate_columns(df, required_columns, label):
+    missing_columns = [col for col in required_columns if col not in df.columns]
+    if missing_columns:
+        raise ValueError(f"{label}に次の必要な列が見つかりません: {missing_columns}")
+
+
+# 対応状況の表記ゆれ（前後の空白・全角記号）を O/A/X にそろえる関数。
+# 値ごとではなく、値の種類（カテゴリ）ごとに読み替える（すでにカテゴリ型なら並べ替えだけで済む）
+def normalize_status(series):
+    categorical = pd.Categorical(series)
+    labels = pd.Index(categorical.categories.astype(str)).str.strip()
+    labels = labels.map(lambda label: STATUS_ALIASES.get(label, label))
+    # 末尾の -1 は欠損（コード -1）の読み替え先
+    codes = np.append(pd.Index(HAZARD_STATUSES).get_indexer(labels), -1)[categorical.codes]
+    return pd.Categorical.from_codes(codes, categories=HAZARD_STATUSES)
+
+
+# 共通IDから避難所の種別の列を作る関数
+def add_shelter_type_columns(df):
+    id_digits = df[KEY_COLUMN].astype(str).str[-2]
+    for column, excluded_digit in SHELTER_TYPE_COLUMNS.items():
+        df[column] = pd.Categorical(np.where(id_digits != excluded_digit, 'O', 'X'), categories=HAZARD_STATUSES)
+    return df
+
+
+# 2つの DataFrame を共通IDで左結合する関数（列の確認と型の整理も行う）
+def merge_shelter_data(df1, df2):
+    with metrics.span("merge"):
+        return _merge_shelter_data(df1, df2)
+
+
+def _merge_shelter_data(df1, df2):
+    validate_columns(df1, SHELTER_COLUMNS, "DF1")
+    validate_columns(df2, [KEY_COLUMN] + HAZARD_COLUMNS, "DF2")
+
+    df1 = df1[SHELTER_COLUMNS].copy()
+    df2 = df2[[KEY_COLUMN] + HAZARD_COLUMNS + [column for column in [ELEVATION_COLUMN] if column in df2.columns]].copy()
+    df1[KEY_COLUMN] = df1[KEY_COLUMN].astype(str)
+    df2[KEY_COLUMN] = df2[KEY_COLUMN].astype(str)
+
+    # DF2 には同じ共通IDの行が複数あることがある（施設名・住所の異なる行に同じIDが振られているなど）。
+    # そのまま結合すると避難所の行が重複するため、共通IDごとにファイルの先頭にある行だけを使う
+    df2 = df2.drop_duplicates(subset=KEY_COLUMN, keep="first")
+
+    merged = pd.merge(df1, df2, on=KEY_COLUMN, how="left")
+    if len(merged) != len(df1):
+        raise ValueError(f"結合後の行数 ({len(merged)}) が DF1 の行数 ({len(df1)}) と一致しません")
+
+    # 座標は float64、対応状況は O/A/X のカテゴリ型にする
+    merged['緯度'] = pd.to_numeric(merged['緯度'], errors='coerce').astype('float64')
+    merged['経度'] = pd.to_numeric(merged['経度'], errors='coerce').astype('float64')
+    for column in HAZARD_COLUMNS:
+        merged[column] = normalize_status(merged[column])
+    # 標高は float64（DF2 に列がなければすべて欠損）
+    if ELEVATION_COLUMN in merged.columns:
+        merged[ELEVATION_COLUMN] = pd.to_numeric(merged[ELEVATION_COLUMN], errors='coerce').astype('float64')
+    else:
+        merged[ELEVATION_COLUMN] = np.nan
+    return add_shelter_type_columns(merged)
+
+
+# CSVファイルを読み込む関数（共通IDは文字列として読む）
+def read_source_csv(file_path):
+    with metrics.span("load_csv", file=os.path.basename(file_path)):
+        return pd.read_csv(file_path, dtype={KEY_COLUMN: str})
+
+
+# CSV から dtypes の列だけを chunk_rows 行ずつ読み、各チャンクを prepare で整えてから連結する関数。
+# 全列を読んでから絞り込むのに比べ、読み込み中のメモリ使用量の最大値が小さい。
+def read_csv_chunks(file_path, dtypes, prepare, chunk_rows=CSV_CHUNK_ROWS, engine=DEFAULT_CSV_ENGINE):
+    if engine == "pyarrow":
+        chunks = _iter_csv_arrow(file_path, dtypes, chunk_rows)
+    elif engine == "c":
+        chunks = pd.read_csv(
+            file_path, usecols=list(dtypes), chunksize=chunk_rows,
+            dtype={column: dtype for column, dtype in dtypes.items() if dtype is not None},
+        )
+    else:
+        raise ValueError(f"CSV の読み込み方式は {CSV_ENGINES} のいずれかを指定してください: {engine}")
+
+    frames = [prepare(chunk[list(dtypes)]) for chunk in chunks]
+    if not frames:
+        return prepare(pd.DataFrame({column: pd.Series(dtype=dtype or str) for column, dtype in dtypes.items()}))
+    return pd.concat(frames, ignore_index=True)
+
+
+# pyarrow の CSV リーダーで、およそ chunk_rows 行ずつの DataFrame を返すジェネレーター
+def _iter_csv_arrow(file_path, dtypes, chunk_rows):
+    import pyarrow as pa
+    from pyarrow import csv
+
+    # pyarrow はバイト数でチャンクを区切るため、1行あたりの大きさを先頭から見積もる
+    with open(file_path, "rb") as f:
+        sample = f.read(1 << 20)
+    bytes_per_row = len(sample) / max(1, sample.count(b"\n"))
+    block_size = int(min(max(bytes_per_row * chunk_rows, 1 << 16), 1 << 30))
+
+    reader = csv.open_csv(
+        file_path,
+        read_options=csv.ReadOptions(block_size=block_size),
+        convert_options=csv.ConvertOptions(
+            include_columns=list(dtypes), column_types={column: pa.string() for column in dtypes},
+            strings_can_be_null=True,  # 空欄を pandas と同じく欠損にする
+        ),
+    )
+    for batch in reader:
+        yield batch.to_pandas().astype({column: dtype or str for column, dtype in dtypes.items()})
+
+
+# 避難所一覧(DF1)のチャンクを整える関数。
+# 座標を数値にし、座標が欠損・範囲外の行（地図にも検索結果にも出ない）を除く。
+def _prepare_shelter_chunk(chunk):
+    chunk = chunk.assign(
+        緯度=pd.to_numeric(chunk['緯度'], errors='coerce').astype('float64'),
+        経度=pd.to_numeric(chunk['経度'], errors='coerce').astype('float64'),
+    )
+    return chunk[chunk['緯度'].between(-90, 90) & chunk['経度'].between(-180, 180)]
+
+
+# 災害別対応状況(DF2)のチャンクを整える関数。
+# 共通IDのない行（どの避難所にも結合されない）を除き、対応状況を O/A/X のカテゴリ型、標高を数値にする。
+def _prepare_hazard_chunk(chunk):
+    chunk = chunk[chunk[KEY_COLUMN].notna()].copy()
+    for column in HAZARD_COLUMNS:
+        chunk[column] = normalize_status(chunk[column])
+    if ELEVATION_COLUMN in chunk.columns:
+        chunk[ELEVATION_COLUMN] = pd.to_numeric(chunk[ELEVATION_COLUMN], errors='coerce').astype('float64')
+    return chunk
+
+
+# 避難所一覧(DF1)を、必要な列だけ読み込む関数
+def read_shelter_csv(file_path, chunk_rows=CSV_CHUNK_ROWS, engine=DEFAULT_CSV_ENGINE):
+    with metrics.span("load_csv", file=os.path.basename(file_path)):
+        validate_columns(pd.read_csv(file_path, nrows=0), SHELTER_COLUMNS, "DF1")
+        return read_csv_chunks(file_path, SHELTER_DTYPES, _prepare_shelter_chunk, chunk_rows, engine)
+
+
+# 災害別対応状況(DF2)を、必要な列だけ読み込む関数
+def read_hazard_csv(file_path, chunk_rows=CSV_CHUNK_ROWS, engine=DEFAULT_CSV_ENGINE):
+    with metrics.span("load_csv", file=os.path.basename(file_path)):
+        header = pd.read_csv(file_path, nrows=0)
+        validate_columns(header, [KEY_COLUMN] + HAZARD_COLUMNS, "DF2")
+        dtypes = dict(HAZARD_DTYPES)
+        if ELEVATION_COLUMN in header.columns:
+            dtypes[ELEVATION_COLUMN] = None
+        return read_csv_chunks(file_path, dtypes, _prepare_hazard_chunk, chunk_rows, engine)
+
+
+# ファイルの SHA-256 を計算する関数
+def file_sha256(file_path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# 入力ファイルの更新日時・サイズ・ハッシュを記録する関数
+def describe_source(file_path, known=None):
+    stat = os.stat(file_path)
+    source = {"path": os.path.abspath(file_path), "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+    # 更新日時とサイズが変わっていなければハッシュの計算を省く
+    if known and known.get("mtime_ns") == stat.st_mtime_ns and known.get("size") == stat.st_size:
+        source["sha256"] = known["sha256"]
+    else:
+        source["sha256"] = file_sha256(file_path)
+    return source
+
+
+# 成果物に付けるマニフェスト（入力ファイルの情報）のパス
+def manifest_path(output_path):
+    return output_path + ".json"
+
+
+def read_manifest(output_path):
+    try:
+        with open(manifest_path(output_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# 一時ファイルに書いてから置き換える（読み込み中の他プロセスが壊れたファイルを見ないように）
+def _atomic_write(output_path, write):
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# 成果物を作り直す必要があるかを判定し、入力ファイルの情報・前回のマニフェストとあわせて返す関数
+def check_sources(shelter_path, hazard_path, output_path):
+    manifest = read_manifest(output_path)
+    known = {}
+    if manifest and manifest.get("format_version") == ARTIFACT_FORMAT_VERSION:
+        known = {source["path"]: source for source in manifest.get("sources", [])}
+
+    sources = [
+        describe_source(path, known.get(os.path.abspath(path)))
+        for path in (shelter_path, hazard_path)
+    ]
+
+    stale = (
+        not os.path.exists(output_path)
+        or not known
+        or [source["sha256"] for source in sources]
+        != [known.get(source["path"], {}).get("sha256") for source in sources]
+    )
+    return stale, sources, manifest
+
+
+def _write_manifest(output_path, sources, rows):
+    manifest = {
+        "format_version": ARTIFACT_FORMAT_VERSION,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "rows": rows,
+        "sources": sources,
+    }
+
+    def write(path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    _atomic_write(manifest_path(output_path), write)
+
+
+# 結合済みデータセットを作成する関数。
+# 入力ファイルのハッシュが前回と同じなら作り直さない（戻り値は作り直したかどうか）。
+def build_merged_dataset(shelter_path=DEFAULT_SHELTER_PATH, hazard_path=DEFAULT_HAZARD_PATH,
+                         output_path=DEFAULT_OUTPUT_PATH, force=False, engine=DEFAULT_CSV_ENGINE):
+    stale, sources, manifest = check_sources(shelter_path, hazard_path, output_path)
+    if not stale and not force:
+        # 内容が同じでも更新日時が変わっていれば記録し直し、次回のハッシュ計算を省く
+        if sources != manifest["sources"]:
+            _write_manifest(output_path, sources, manifest.get("rows"))
+        return False
+
+    merged = merge_shelter_data(read_shelter_csv(shelter_path, engine=engine), read_hazard_csv(hazard_path, engine=engine))
+    _atomic_write(output_path, lambda path: merged.to_parquet(path, index=False))
+    _write_manifest(output_path, sources, len(merged))
+    return True
+
+
+# 結合済みデータセットを読み込む関数
+def load_merged_dataset(output_path=DEFAULT_OUTPUT_PATH):
+    return pd.read_parquet(output_path)
+
+
+# 必要なら作り直したうえで結合済みデータセットを読み込む関数
+def ensure_merged_dataset(shelter_path=DEFAULT_SHELTER_PATH, hazard_path=DEFAULT_HAZARD_PATH,
+                          output_path=DEFAULT_OUTPUT_PATH):
+    build_merged_dataset(shelter_path, hazard_path, output_path)
+    return load_merged_dataset(output_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="避難所データと災害別対応状況を結合し、Parquet 形式で保存します。")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="災害別対応状況のCSV (DF2)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="出力する Parquet ファイル")
+    parser.add_argument("--force", action="store_true", help="入力ファイルが変わっていなくても作り直す")
+    parser.add_argument("--engine", choices=CSV_ENGINES, default=DEFAULT_CSV_ENGINE, help="CSV の読み込み方式")
+    args = parser.parse_args(argv)
+
+    try:
+        rebuilt = build_merged_dataset(args.shelters, args.hazards, args.output, force=args.force, engine=args.engine)
+    except (OSError, ValueError) as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        return 1
+
+    if rebuilt:
+        print(f"{args.output} を作成しました（{read_manifest(args.output)['rows']} 件）。")
+    else:
+        print(f"{args.output} は最新です。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
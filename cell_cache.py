@@ -0,0 +1,87 @@
+import math
+
+import numpy as np
+
+import metrics
+from query_cache import QueryCache
+from shelter_search import HAVERSINE_REL_TOL, find_nearest_among, haversine_km
+
+# 既定のセルの大きさ(度)（緯度方向に約1.1km）
+DEFAULT_CELL_DEG = 0.01
+
+# セルごとの候補を保持する上限（件数）
+DEFAULT_MAX_CELLS = 20000
+
+# 浮動小数点の丸め誤差を見込んで、候補の半径に加える余裕(km)
+RADIUS_MARGIN_KM = 1e-6
+
+
+# 緯度経度の格子のセルごとに、セル内のどの地点から検索しても上位N件に入りうる避難所（候補）を求めておき、
+# 実際の地点からの距離の計算はその候補だけで行うキャッシュ。
+# 同じ避難所や駅の周辺など、ほぼ同じ地点からの検索が集中するときに、全体を探さずに一定の時間で答えられる。
+# 候補はセルの中心から見た上位N件目までの距離にセルの中心から角までの距離を見込んで求めるため、
+# 検索結果は shelter_dataset.ShelterDataset.find_nearest と同じになる。
+# 候補はデータセットのバージョンごとに持つため、データセットが更新されると新しいバージョンで求め直す。
+class CellCandidateCache:
+    def __init__(self, cell_deg=DEFAULT_CELL_DEG, max_cells=DEFAULT_MAX_CELLS):
+        if not cell_deg > 0:
+            raise ValueError("セルの大きさは正の値にしてください")
+        self.cell_deg = cell_deg
+        # セルのキー -> 候補の行位置（昇順）。件数と合計サイズの上限は検索キャッシュと同じ仕組みで守る
+        self.cache = QueryCache(max_entries=max_cells, ttl_seconds=math.inf)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    # セルのヒット率（まだ検索していなければ None）
+    def hit_rate(self):
+        total = self.cache.hits + self.cache.misses
+        return self.cache.hits / total if total else None
+
+    def stats(self):
+        return {"cell_deg": self.cell_deg, "cells": len(self.cache), "hits": self.cache.hits,
+                "misses": self.cache.misses, "hit_rate": self.hit_rate()}
+
+    # 地点を含むセルの (行, 列) を返す
+    def cell_of(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    # セル内のどの地点から検索しても上位 top_n 件の候補に入る避難所の行位置（昇順）を求める。
+    # セルの中心から上位 top_n 件目までの haversine 距離を k、中心から角までの距離を r とすると、
+    # セル内の地点からの top_n 件目は k + r 以内にあるため、候補の範囲（その誤差を見込んだ倍数）に
+    # r を加えた半径の内側を集めればよい。
+    def _cell_candidates(self, dataset, row, col, filter_column, filter_value, top_n):
+        index, mask = dataset.search_index(filter_column, filter_value)
+        lat = (row + 0.5) * self.cell_deg
+        lon = (col + 0.5) * self.cell_deg
+        corner_lats = np.array([row, row, row + 1, row + 1]) * self.cell_deg
+        corner_lons = np.array([col, col + 1, col, col + 1]) * self.cell_deg
+        r = float(haversine_km(lat, lon, corner_lats, corner_lons).max())
+
+        store = dataset.store
+        nearest = index.nearest_candidates(lat, lon, top_n, mask=mask)
+        dists = haversine_km(lat, lon, np.asarray(store['緯度'], dtype=float)[nearest],
+                             np.asarray(store['経度'], dtype=float)[nearest])
+        if len(nearest) < top_n:
+            # 条件に合う避難所が top_n 件に満たない場合は、そのすべてが候補になる
+            return nearest
+        kth = float(np.partition(dists, top_n - 1)[top_n - 1])
+        radius = (kth + r) * (1 + HAVERSINE_REL_TOL) / (1 - HAVERSINE_REL_TOL) + r
+        positions, _ = index.within_radius(lat, lon, radius * (1 + 1e-9) + RADIUS_MARGIN_KM, mask=mask)
+        return positions
+
+    # 最も近い避難所を上位N件返す（ShelterDataset.find_nearest と同じ結果）
+    def find_nearest(self, dataset, lat, lon, filter_column=None, filter_value=None, top_n=5):
+        row, col = self.cell_of(lat, lon)
+        key = (dataset.version, row, col, filter_column, filter_value, top_n)
+        positions = self.cache.get(key)
+        if positions is None:
+            with metrics.span("cell_candidates"):
+                positions = self._cell_candidates(dataset, row, col, filter_column, filter_value, top_n)
+            self.cache.put(key, positions)
+        return find_nearest_among(dataset.store, lat, lon, positions, top_n=top_n)
@@ -0,0 +1,102 @@
+import logging
+import os
+import threading
+
+import metrics
+
+# 更新の失敗などを書き出すロガー
+logger = logging.getLogger("shelter.refresh")
+
+# 入力ファイルの更新を確認する間隔(秒)
+REFRESH_INTERVAL_SECONDS = 10.0
+
+
+# 入力ファイルの更新日時とサイズから、作り直しが必要かを判定するための文字列を作る関数
+def source_signature(paths):
+    parts = []
+    for path in paths:
+        stat = os.stat(path)
+        parts.append(f"{os.path.abspath(path)}:{stat.st_mtime_ns}:{stat.st_size}")
+    return "|".join(parts)
+
+
+# データセットを読み込み、入力ファイルの更新を監視して最新のデータセットに差し替えるもの。
+# 読み込み・更新はバックグラウンドのスレッドで行い、差し替えは参照の置き換えだけのため、
+# 検索中のセッションは更新の完了を待たずに変更前のデータセットを使い続けられる。
+# - load(): 最初のデータセットを返す関数
+# - update(dataset): 更新後の (データセット, 変更内容) を返す関数（変更がなければ dataset をそのまま返す）
+# - on_update(変更前, 変更後, 変更内容): 差し替えの直前に呼ぶ関数（検索キャッシュの引き継ぎなど）
+# update か source_paths を指定しなければ、読み込みだけを行う。
+class DatasetRefresher:
+    def __init__(self, load, update=None, source_paths=(), on_update=None,
+                 interval_seconds=REFRESH_INTERVAL_SECONDS):
+        self._load = load
+        self._update = update
+        self.source_paths = list(source_paths)
+        self._on_update = on_update
+        self.interval_seconds = interval_seconds
+
+        self._dataset = None
+        self._error = None
+        self._ready = threading.Event()
+        self._stopped = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self.refreshes = 0
+
+        threading.Thread(target=self._run, name="shelter-dataset", daemon=True).start()
+
+    # 読み込みが終わるのを待って最新のデータセットを返す（読み込みに失敗していればその例外を送出する）
+    def result(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise TimeoutError("データセットの読み込みが終わっていません")
+        if self._error is not None:
+            raise self._error
+        return self._dataset
+
+    def stop(self):
+        self._stopped.set()
+
+    def _signature(self):
+        return source_signature(self.source_paths) if self.source_paths else None
+
+    def _run(self):
+        try:
+            # 読み込み中に更新された場合も検出できるよう、読み込む前の状態を記録する
+            signature = self._signature()
+            self._dataset = self._load()
+        except Exception as e:
+            self._error = e
+            return
+        finally:
+            self._ready.set()
+
+        if self._update is None or not self.source_paths:
+            return
+        while not self._stopped.wait(self.interval_seconds):
+            try:
+                current = self._signature()
+            except OSError:
+                # 入力ファイルの置き換え中などで一時的に見つからない場合は、次の確認まで待つ
+                continue
+            if current == signature:
+                continue
+            try:
+                self.refresh()
+            except Exception:
+                # 書きかけのファイルを読んだ場合などは、次にファイルが変わったときに再度試す
+                logger.exception("データセットの更新に失敗しました")
+            signature = current
+
+    # 入力ファイルを読み直して、データセットを差し替える（変更がなければ何もしない）
+    def refresh(self):
+        with self._refresh_lock:
+            current = self._dataset
+            with metrics.span("refresh_dataset"):
+                dataset, changes = self._update(current)
+            if dataset is current:
+                return current
+            if self._on_update is not None:
+                self._on_update(current, dataset, changes)
+            self._dataset = dataset
+            self.refreshes += 1
+            return dataset
@@ -0,0 +1,172 @@
+import numpy as np
+
+import metrics
+from shelter_schema import ELEVATION_COLUMN, HAZARD_COLUMNS, HAZARD_STATUSES
+from shelter_search import DISTANCE_COLUMN, HAVERSINE_REL_TOL, geodesic_km, haversine_km
+
+# 順位付けのスコアの列名（距離(km) から重み付きの加点を引いたもの。小さいほど上位）
+SCORE_COLUMN = 'スコア'
+
+# 対応状況の段階（大きいほど良い: O=2, A=1, X=0）と、欠損の段階
+STATUS_LEVELS = {status: len(HAZARD_STATUSES) - 1 - i for i, status in enumerate(HAZARD_STATUSES)}
+MISSING_LEVEL = -1
+
+# 標高を同じスコアの避難所の並べ替えに使う災害（高い避難所を先にする）
+ELEVATION_TIE_BREAK_COLUMNS = ['df2_津波']
+
+
+# 災害名（「津波」または「df2_津波」）を列名にする関数
+def hazard_column(name):
+    column = name if name in HAZARD_COLUMNS else 'df2_' + name
+    if column not in HAZARD_COLUMNS:
+        raise ValueError(f"対応災害は {[c[len('df2_'):] for c in HAZARD_COLUMNS]} のいずれかを指定してください: {name}")
+    return column
+
+
+# 「津波=O,土砂>=A」のような条件の文字列を {列名: 最低限の対応状況} にする関数。
+# 「=」はその対応状況以上（O は O のみ、A は O か A）を表し、「>=」と同じ意味になる
+def parse_requirements(text):
+    requirements = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, separator, status = part.replace('>=', '=').replace('≥', '=').partition('=')
+        status = status.strip()
+        if not separator or status not in STATUS_LEVELS:
+            raise ValueError(f"条件は「津波=O」「土砂>=A」の形式で、対応状況は {HAZARD_STATUSES} のいずれかにしてください: {part}")
+        requirements[hazard_column(name.strip())] = status
+    return requirements
+
+
+# 「津波:0.5,土砂:0.2」のような重みの文字列を {列名: 重み} にする関数
+def parse_weights(text):
+    weights = {}
+    for part in filter(None, (part.strip() for part in text.split(','))):
+        name, separator, weight = part.partition(':')
+        try:
+            weights[hazard_column(name.strip())] = float(weight)
+        except ValueError:
+            raise ValueError(f"重みは「津波:0.5」の形式で指定してください: {part}") from None
+    return weights
+
+
+# 全避難所の災害別の対応状況を、段階の int8 行列（行: 避難所, 列: HAZARD_COLUMNS）にまとめたもの。
+# 複数の災害の条件・重みを、行列全体への1回の演算で評価する。データセットのバージョンごとに1回だけ作る。
+class HazardMatrix:
+    def __init__(self, levels, elevations, lats, lons):
+        self.levels = levels
+        self.elevations = elevations
+        self.lats = lats
+        self.lons = lons
+
+    @classmethod
+    def from_dataset(cls, dataset):
+        store = dataset.store
+        levels = np.full((len(store), len(HAZARD_COLUMNS)), MISSING_LEVEL, dtype=np.int8)
+        for i, column in enumerate(HAZARD_COLUMNS):
+            codes = np.asarray(store[column].codes)
+            levels[:, i] = np.where(codes >= 0, len(HAZARD_STATUSES) - 1 - codes, MISSING_LEVEL)
+        if ELEVATION_COLUMN in store.columns:
+            elevations = np.asarray(store[ELEVATION_COLUMN], dtype=float)
+        else:
+            elevations = np.full(len(store), np.nan)
+        return cls(levels, elevations, np.asarray(store['緯度'], dtype=float), np.asarray(store['経度'], dtype=float))
+
+    # 条件 {列名: 最低限の対応状況} をすべて満たす行の真偽値配列を返す
+    def eligible(self, requirements):
+        minimum = np.full(len(HAZARD_COLUMNS), MISSING_LEVEL, dtype=np.int8)
+        for column, status in requirements.items():
+            minimum[HAZARD_COLUMNS.index(column)] = STATUS_LEVELS[status]
+        return (self.levels >= minimum).all(axis=1) & np.isfinite(self.lats) & np.isfinite(self.lons)
+
+    # 重み {列名: 1段階あたりの加点(km)} と標高の重み(km/m) から、行ごとの加点を返す（欠損は加点なし）
+    def bonus(self, weights, elevation_weight=0.0):
+        vector = np.zeros(len(HAZARD_COLUMNS))
+        for column, weight in weights.items():
+            vector[HAZARD_COLUMNS.index(column)] = weight
+        bonus = np.maximum(self.levels, 0) @ vector
+        if elevation_weight:
+            bonus += elevation_weight * np.nan_to_num(self.elevations)
+        return bonus
+
+
+# mask の行のうち、スコア（距離 - 加点）の上位 top_n 件に入りうる行位置を返す関数。
+# haversine 距離から geodesic 距離の範囲（HAVERSINE_REL_TOL の誤差）を見込み、
+# 上位 top_n 件目のスコアの上限より下限が小さい行をすべて候補にする。
+def _score_candidates(lat, lon, matrix, bonus, mask, top_n):
+    positions = np.flatnonzero(mask)
+    if top_n <= 0 or len(positions) <= top_n:
+        return positions
+    approx_km = haversine_km(lat, lon, matrix.lats[positions], matrix.lons[positions])
+    lower = approx_km / (1 + HAVERSINE_REL_TOL) - bonus[positions]
+    upper = approx_km / (1 - HAVERSINE_REL_TOL) - bonus[positions]
+    kth = np.partition(upper, top_n - 1)[top_n - 1]
+    return positions[lower <= kth]
+
+
+# 候補をスコア・（標高で並べ替える場合は）標高の高い順・行位置の順に並べ、上位 top_n 件の行位置を返す関数
+def _rank(positions, scores, elevations, top_n):
+    keys = [positions]
+    if elevations is not None:
+        keys.append(np.where(np.isnan(elevations), np.inf, -elevations))
+    keys.append(scores)
+    return np.lexsort(keys)[:top_n]
+
+
+# 複数の災害の条件・重みで避難所を順位付けし、(上位 top_n 件, 災害ごとの最も近い O の避難所) を返す関数。
+# - requirements: {列名: 最低限の対応状況}（例: {'df2_津波': 'O', 'df2_土砂': 'A'}）
+# - weights: {列名: 対応状況1段階あたりの加点(km)}。O と A で 0.5km までなら O を上位にする、など
+# - elevation_weight: 標高1mあたりの加点(km)
+# スコアは 距離(km) - 加点 で、津波を条件・重みに含む場合は同じスコアなら標高の高い避難所を上位にする。
+# 災害ごとの候補（alternatives）は {列名: その災害が O の避難所のうち最も近い alternatives_n 件} で、
+# 津波は同じ距離なら標高の高い避難所を先にする。
+# 条件はすべての災害の対応状況の行列に1回の比較で評価し、重みがなければ（距離だけで並べる場合は）
+# 空間インデックスで候補を絞り込む。geodesic 距離は上位に入りうる候補だけで計算する。
+def rank_shelters(dataset, lat, lon, requirements=None, weights=None, elevation_weight=0.0, top_n=5,
+                  alternatives_n=1, matrix=None):
+    requirements = requirements or {}
+    weights = {column: weight for column, weight in (weights or {}).items() if weight}
+    if matrix is None:
+        matrix = HazardMatrix.from_dataset(dataset)
+
+    with metrics.span("rank_candidates", rows=len(matrix.lats)):
+        eligible = matrix.eligible(requirements)
+        if weights or elevation_weight:
+            bonus = matrix.bonus(weights, elevation_weight)
+            ranked = _score_candidates(lat, lon, matrix, bonus, eligible, top_n)
+        else:
+            bonus = None
+            ranked = dataset.index.nearest_candidates(lat, lon, top_n, mask=eligible)
+
+        best_status = HAZARD_STATUSES[0]
+        alternatives = {}
+        for column in HAZARD_COLUMNS:
+            index, mask = dataset.search_index(column, best_status)
+            alternatives[column] = index.nearest_candidates(lat, lon, alternatives_n, mask=mask)
+
+    # geodesic 距離は、上位・災害ごとの候補の重複を除いて1回ずつ計算する
+    positions = np.unique(np.concatenate([ranked] + list(alternatives.values())))
+    with metrics.span("geodesic", candidates=len(positions)):
+        distances = geodesic_km(lat, lon, matrix.lats[positions], matrix.lons[positions])
+
+    def distances_of(candidates):
+        return distances[np.searchsorted(positions, candidates)]
+
+    tie_break = any(column in requirements or column in weights for column in ELEVATION_TIE_BREAK_COLUMNS)
+    ranked_km = distances_of(ranked)
+    scores = ranked_km if bonus is None else ranked_km - bonus[ranked]
+    order = _rank(ranked, scores, matrix.elevations[ranked] if tie_break else None, top_n)
+    parts = [(ranked[order], ranked_km[order])]
+    for column, candidates in alternatives.items():
+        candidate_km = distances_of(candidates)
+        elevations = matrix.elevations[candidates] if column in ELEVATION_TIE_BREAK_COLUMNS else None
+        alternative_order = _rank(candidates, candidate_km, elevations, alternatives_n)
+        parts.append((candidates[alternative_order], candidate_km[alternative_order]))
+
+    # 上位・災害ごとの避難所の行は、まとめて1回で取り出してから分ける
+    frame = dataset.store.take(np.concatenate([rows for rows, _ in parts]))
+    frame[DISTANCE_COLUMN] = np.concatenate([km for _, km in parts])
+    bounds = np.cumsum([0] + [len(rows) for rows, _ in parts])
+    frames = [frame.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    result = frames[0].copy()
+    result[SCORE_COLUMN] = scores[order]
+    return result, dict(zip(alternatives, frames[1:]))
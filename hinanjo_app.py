@@ -0,0 +1,442 @@
+import streamlit as st
+import os
+
+import io
+
+import metrics
+from dataset_refresh import DatasetRefresher
+from query_cache import QueryCache
+from road_network import DEFAULT_GRAPH_PATH, WALK_DISTANCE_COLUMN, RoadGraph, WalkingRouter
+from shelter_schema import ELEVATION_COLUMN, HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+
+# 起動を速くするため、pandas を使うデータセット関連のモジュールは読み込み用のスレッドで、
+# folium（地図）・一括検索のモジュールは初めて使うときに読み込む
+
+# 検索モード（指定避難所・福祉避難所は種別の列で、災害別は対応災害・対応状況で絞り込む。
+# 複数災害は複数の対応災害の条件・重みで順位付けする）
+DISASTER_MODE = "災害別"
+MULTI_HAZARD_MODE = "複数災害"
+SEARCH_MODES = list(SHELTER_TYPE_COLUMNS) + [DISASTER_MODE, MULTI_HAZARD_MODE]
+
+# 対応災害の選択肢と、絞込みに使う列
+DISASTER_COLUMNS = {column[len('df2_'):]: column for column in HAZARD_COLUMNS}
+
+# 対応状況の選択肢
+STATUS_OPTIONS = HAZARD_STATUSES
+
+# 結果の表に表示する列
+TYPE_DISPLAY_COLUMNS = ['施設・場所名', '距離(km)']
+DISASTER_DISPLAY_COLUMNS = ['施設・場所名', '距離(km)'] + HAZARD_COLUMNS + ['共通ID']
+RANKING_DISPLAY_COLUMNS = ['施設・場所名', '距離(km)', 'スコア'] + HAZARD_COLUMNS + [ELEVATION_COLUMN, '共通ID']
+ALTERNATIVE_DISPLAY_COLUMNS = ['対応災害', '施設・場所名', '距離(km)'] + HAZARD_COLUMNS + [ELEVATION_COLUMN]
+
+# 入力ファイルと、結合済みデータセット（build_dataset.py の出力）
+SHELTER_PATH = "mergeFromCity_1.csv"
+HAZARD_PATH = "ehime_hinan.csv"
+MERGED_DATASET_PATH = "shelters_merged.parquet"
+
+# 複数のワーカーでデータセットを共有するディレクトリ（環境変数で指定した場合のみ使う）
+SHARED_DATASET_DIR = os.environ.get("SHELTER_SHARED_DIR")
+
+# 地点を格子のセルにまとめて検索の候補をキャッシュする場合のセルの大きさ(度)（環境変数で指定した場合のみ使う）
+CELL_CACHE_DEG = float(os.environ["SHELTER_CELL_DEG"]) if os.environ.get("SHELTER_CELL_DEG") else None
+
+# 徒歩距離の検索に使う道路グラフ（road_network.py で作成）。ファイルがある場合のみ徒歩距離を選べる
+ROAD_GRAPH_PATH = os.environ.get("SHELTER_ROAD_GRAPH", DEFAULT_GRAPH_PATH)
+
+# データセットのバージョンごとに作るデータを保持する件数。更新の直後に古いバージョンを表示中の
+# セッションがあっても作り直しを繰り返さないよう、現在と1つ前のバージョンの分だけ残す
+DATASET_VERSIONS_KEPT = 2
+
+# 距離の基準の選択肢
+STRAIGHT_DISTANCE_MODE = "直線距離"
+WALK_DISTANCE_MODE = "徒歩距離（道路）"
+
+# 結合済みデータから、全モードで共有するデータセットを作る関数。
+# 種別・災害種別×対応状況ごとに分割した空間インデックスも作るため、
+# モードの切り替えは作り直しではなく、分割済みインデックスの選択だけで済む
+def create_shelter_dataset(file_path1, file_path2):
+    from shelter_dataset import build_shelter_dataset
+
+    return build_shelter_dataset(file_path1, file_path2, MERGED_DATASET_PATH)
+
+# データセットを開く関数。
+# SHELTER_SHARED_DIR が指定されていれば、最初の1プロセスが構築・公開したものを
+# 他のプロセスは読み取り専用のメモリマップで共有する
+def open_shelter_dataset(file_path1, file_path2):
+    if not SHARED_DATASET_DIR:
+        return create_shelter_dataset(file_path1, file_path2)
+
+    from shared_dataset import open_shared_dataset
+
+    return open_shared_dataset(
+        os.path.join(SHARED_DATASET_DIR, "merged"),
+        [file_path1, file_path2],
+        lambda: create_shelter_dataset(file_path1, file_path2)
+    )
+
+# 入力ファイルの更新後に、変わった避難所だけをデータセットに反映する関数（監視用のスレッドで呼ばれる）
+def refresh_shelter_dataset(dataset, file_path1, file_path2):
+    from build_dataset import ensure_merged_dataset
+    from shelter_dataset import update_dataset
+
+    return update_dataset(dataset, ensure_merged_dataset(file_path1, file_path2, MERGED_DATASET_PATH))
+
+# データセットの更新後、結果が変わらない検索キャッシュを新しいバージョンに引き継ぐ関数
+def carry_over_query_cache(cache, old_dataset, new_dataset, changes):
+    from shelter_dataset import carry_over_query_cache
+
+    carry_over_query_cache(cache, old_dataset, new_dataset, changes)
+
+# データセットの読み込みをバックグラウンドのスレッドで始める関数（プロセスごとに1回だけ）。
+# 画面の表示や緯度経度の入力を待たせずに、その間に読み込みを進めておく。
+# 読み込み後は入力ファイルの更新を監視し、更新されたら変わった避難所だけを反映したデータセットに差し替える
+# （共有データセットは、構築・公開（他のプロセスの公開を待つ場合も含む）を監視用のスレッドで行う）
+@st.cache_resource
+def start_loading_dataset(file_path1, file_path2):
+    load = lambda: open_shelter_dataset(file_path1, file_path2)
+    if SHARED_DATASET_DIR:
+        return DatasetRefresher(load, update=lambda dataset: (load(), None), source_paths=[file_path1, file_path2])
+
+    cache = get_query_cache()
+    return DatasetRefresher(
+        load,
+        update=lambda dataset: refresh_shelter_dataset(dataset, file_path1, file_path2),
+        source_paths=[file_path1, file_path2],
+        on_update=lambda old, new, changes: carry_over_query_cache(cache, old, new, changes)
+    )
+
+# 読み込みが終わるのを待って最新のデータセットを返す関数。
+# 読み込みに失敗した場合は、次の実行で読み込み直せるようにキャッシュを消す
+def load_shelter_dataset(file_path1, file_path2):
+    refresher = start_loading_dataset(file_path1, file_path2)
+    try:
+        dataset = refresher.result()
+    except Exception:
+        start_loading_dataset.clear()
+        raise
+
+    # 共有データセットは、新しいバージョンが公開されていればそちらに切り替える
+    # （公開中のバージョンを確認するだけで、入力ファイルの確認・構築は監視用のスレッドに任せる）
+    if SHARED_DATASET_DIR:
+        from shared_dataset import attach_current
+
+        dataset = attach_current(os.path.join(SHARED_DATASET_DIR, "merged"))
+    return dataset
+
+# 処理時間の計測を環境変数（SHELTER_METRICS など）に従って設定する（プロセスごとに1回だけ）
+@st.cache_resource
+def start_metrics():
+    return metrics.configure_from_env()
+
+# 検索結果のキャッシュ（全セッション・全モードで共有）
+@st.cache_resource
+def get_query_cache():
+    cache = QueryCache()
+    metrics.register_cache("query", cache)
+    return cache
+
+# セルごとの検索候補のキャッシュ（全セッションで共有, CELL_CACHE_DEG が未指定なら None）
+@st.cache_resource
+def get_cell_cache():
+    if not CELL_CACHE_DEG:
+        return None
+
+    from cell_cache import CellCandidateCache
+
+    cache = CellCandidateCache(CELL_CACHE_DEG)
+    metrics.register_cache("cell", cache)
+    return cache
+
+# 全避難所の表示に使うデータ（データセットのバージョン・絞込みの列ごとに1回だけ作り、全セッションで共有）
+@st.cache_resource(max_entries=DATASET_VERSIONS_KEPT * (len(SHELTER_TYPE_COLUMNS) + len(HAZARD_COLUMNS) + 1))
+def get_overview_data(dataset_version, status_column, _dataset):
+    from shelter_map import OverviewData
+
+    return OverviewData.from_dataset(_dataset, status_column)
+
+# 複数災害の順位付けに使う対応状況の行列（データセットのバージョンごとに1回だけ作り、全セッションで共有）
+@st.cache_resource(max_entries=DATASET_VERSIONS_KEPT)
+def get_hazard_matrix(dataset_version, _dataset):
+    from hazard_ranking import HazardMatrix
+
+    return HazardMatrix.from_dataset(_dataset)
+
+# 道路グラフと、各避難所の最寄りノードは、プロセスごとに1回だけ読み込み・計算する
+@st.cache_resource
+def load_road_graph(graph_path):
+    return RoadGraph.load(graph_path)
+
+@st.cache_resource(max_entries=DATASET_VERSIONS_KEPT)
+def get_walking_router(dataset_version, graph_path, _dataset):
+    return WalkingRouter(load_road_graph(graph_path), _dataset)
+
+def find_nearest_shelters(dataset, lat, lon, filter_column=None, filter_value=None, top_n=5):
+    from shelter_dataset import find_nearest_cached
+
+    return find_nearest_cached(
+        dataset,
+        get_query_cache(),
+        lat,
+        lon,
+        filter_column=filter_column,
+        filter_value=filter_value,
+        top_n=top_n,
+        cell_cache=get_cell_cache()
+    )
+
+# 複数の対応災害の条件・重みで避難所を順位付けし、(上位5件, 災害ごとの最も近い避難所の DataFrame) を返す関数
+def rank_hazard_shelters(dataset, lat, lon, ranking, top_n=5):
+    import pandas as pd
+
+    from hazard_ranking import rank_shelters
+
+    nearest_shelters, alternatives = rank_shelters(
+        dataset,
+        lat,
+        lon,
+        requirements=ranking["requirements"],
+        weights=ranking["weights"],
+        elevation_weight=ranking["elevation_weight"],
+        top_n=top_n,
+        matrix=get_hazard_matrix(dataset.version, dataset)
+    )
+    alternatives = pd.concat(
+        [frame.assign(対応災害=column[len('df2_'):]) for column, frame in alternatives.items()]
+    )
+    return nearest_shelters, alternatives
+
+# アップロードされたCSVの各地点について最も近い避難所を一括で検索する関数
+# （同じファイル・同じ条件での再実行時は結果を使い回す）
+@st.cache_data(max_entries=4)
+def find_nearest_shelters_batch(file_bytes, dataset_version, filter_column, filter_value, top_n, _dataset):
+    import pandas as pd
+
+    from batch_search import find_nearest_batch
+
+    origins = pd.read_csv(io.BytesIO(file_bytes))
+    return find_nearest_batch(
+        _dataset,
+        origins,
+        top_n=top_n,
+        filter_column=filter_column,
+        filter_value=filter_value
+    )
+
+# 複数地点の一括検索（CSVアップロード）を表示する関数
+def show_batch_search(filter_column, filter_value, top_n=5):
+    with st.expander("複数地点の一括検索（CSVアップロード）"):
+        uploaded_file = st.file_uploader("「緯度」「経度」の列を含むCSVファイルを選択してください", type="csv")
+        if uploaded_file is None:
+            return
+
+        try:
+            dataset = load_shelter_dataset(SHELTER_PATH, HAZARD_PATH)
+            results = find_nearest_shelters_batch(
+                uploaded_file.getvalue(), dataset.version, filter_column, filter_value, top_n, dataset
+            )
+        except ValueError as ve:
+            st.error(f"エラーが発生しました: {ve}")
+            return
+
+        from batch_search import RANK_COLUMN
+
+        st.write(f"検索結果: {len(results)} 行（各地点につき最大 {top_n} 件）")
+        not_found = int(results[RANK_COLUMN].isna().sum())
+        if not_found:
+            st.warning(f"{not_found} 地点は避難所が見つかりませんでした（緯度・経度が空欄・数値でない地点を含む）。"
+                       "これらの地点は避難所の列を空にしています。")
+        st.dataframe(results.head(1000))
+        st.download_button(
+            label="検索結果をCSVファイルとしてダウンロード",
+            data=results.to_csv(index=False).encode("utf-8-sig"),
+            file_name="nearest_shelters_batch.csv",
+            mime="text/csv"
+        )
+
+# 複数災害の条件・重みの入力を表示し、(地図の色分けに使う列, 条件の説明, 順位付けの条件) を返す関数
+def select_hazard_ranking():
+    selected_disasters = st.multiselect("対応災害を選択（すべての条件を満たす避難所を検索）", list(DISASTER_COLUMNS), default=["津波"])
+    requirements = {}
+    for disaster in selected_disasters:
+        status = st.selectbox(f"{disaster}の対応状況（以上）", STATUS_OPTIONS, key=f"requirement_{disaster}")
+        requirements[DISASTER_COLUMNS[disaster]] = status
+
+    weights = {}
+    elevation_weight = 0.0
+    with st.expander("重み付け（任意）: 対応状況が1段階良い・標高が高い避難所を、その分だけ遠くても上位にする"):
+        for disaster, column in DISASTER_COLUMNS.items():
+            weights[column] = st.number_input(f"{disaster}: 1段階あたり(km)", min_value=0.0, value=0.0, step=0.1,
+                                              key=f"weight_{disaster}")
+        elevation_weight = st.number_input("標高: 1mあたり(km)", min_value=0.0, value=0.0, step=0.01, format="%.3f")
+
+    condition = "、".join(f"'{disaster}' が '{requirements[DISASTER_COLUMNS[disaster]]}' 以上" for disaster in selected_disasters)
+    color_column = DISASTER_COLUMNS[selected_disasters[0]] if selected_disasters else HAZARD_COLUMNS[0]
+    ranking = {"requirements": requirements, "weights": weights, "elevation_weight": elevation_weight}
+    return color_column, condition or "条件なし", ranking
+
+# 検索モードの選択を表示し、(絞込みに使う列, 値, 条件の説明, 複数災害の順位付けの条件) を返す関数。
+# 複数災害のモードでは、絞込みに使う列は地図の色分けにだけ使う
+def select_search_filter(default_mode):
+    mode = st.radio("検索モード", SEARCH_MODES, index=SEARCH_MODES.index(default_mode), horizontal=True)
+    if mode == MULTI_HAZARD_MODE:
+        color_column, condition, ranking = select_hazard_ranking()
+        return color_column, None, condition, ranking
+    if mode != DISASTER_MODE:
+        return mode, "O", mode, None
+
+    selected_disaster = st.selectbox("対応災害を選択", list(DISASTER_COLUMNS))
+    selected_status = st.selectbox("対応状況を選択", STATUS_OPTIONS)
+    return DISASTER_COLUMNS[selected_disaster], selected_status, f"'{selected_disaster}' の '{selected_status}'", None
+
+# default_mode は最初に選択されている検索モード（near_hinanjo.py などの起動用スクリプトから指定する）
+def main(default_mode=SEARCH_MODES[0]):
+    start_metrics()
+    try:
+        with metrics.span("script_run"):
+            show_app(default_mode)
+    finally:
+        metrics.flush()
+
+def show_app(default_mode):
+    # データセットの読み込みを先に始め、画面を表示している間に進めておく
+    start_loading_dataset(SHELTER_PATH, HAZARD_PATH)
+
+    # -------------------------
+    # フォントサイズを変数管理
+    # -------------------------
+    TITLE_FONT_SIZE = "26px"       # メインタイトル
+    SUBTITLE_FONT_SIZE = "20px"    # サブ見出し
+    DESC_FONT_SIZE = "16px"        # 説明文
+    SUBTEXT_FONT_SIZE = "14px"     # さらに小さい補助テキスト
+
+    # メインタイトル (太文字にする)
+    st.markdown(f"""
+    <h1 style="font-size: {TITLE_FONT_SIZE}; font-weight: bold; margin-bottom: 10px;">
+        避難所検索アプリ
+    </h1>
+    """, unsafe_allow_html=True)
+
+    # アプリの説明
+    st.markdown(f"""
+    <div style="font-size: {DESC_FONT_SIZE}; line-height: 1.5;">
+        <!-- サブ見出しを h3 で定義し、font-size を明示的に指定 -->
+        <h3 style="font-size: {SUBTITLE_FONT_SIZE}; margin-bottom: 10px;">
+            対象地域: 愛媛県＋隣接自治体
+        </h3>
+        <p style="margin-bottom: 5px;">
+            <strong>隣接自治体名:</strong><br>
+            <span style="font-size: {SUBTEXT_FONT_SIZE};">
+                徳島県: 三好市、香川県: 観音寺市<br>
+                高知県: 宿毛市、四万十市、四万十町、本山町、土佐町、いの町、仁淀川町、津野町、梼原町
+            </span>
+        </p>
+        <p><strong>使い方:</strong></p>
+        <ol style="padding-left: 20px;">
+            <li>検索モード（指定避難所・福祉避難所・災害別・複数災害）を選択してください。</li>
+            <li>
+                Googleマップで目的地点の緯度経度を取得してください。
+                <a href="https://www.google.com/maps/" target="_blank">Googleマップを開く</a>
+            </li>
+            <li>取得した緯度経度を入力してください。</li>
+            <li>入力後、自動で最も近い避難所が検索され、地図上に表示されます。</li>
+        </ol>
+    </div>
+    """, unsafe_allow_html=True)
+
+    try:
+        filter_column, filter_value, condition, ranking = select_search_filter(default_mode)
+        disaster_mode = filter_column in HAZARD_COLUMNS
+
+        # 複数災害の順位付けは直線距離で行い、一括検索には対応しない
+        walking = False
+        if os.path.exists(ROAD_GRAPH_PATH) and ranking is None:
+            distance_mode = st.radio("距離の基準", [STRAIGHT_DISTANCE_MODE, WALK_DISTANCE_MODE], horizontal=True)
+            walking = distance_mode == WALK_DISTANCE_MODE
+
+        if ranking is None:
+            show_batch_search(filter_column, filter_value)
+
+        user_input = st.text_input("現在位置の緯度・経度を入力してください（例: 33.81167462685436, 132.77887072795122）:")
+
+        if not user_input:
+            st.info("緯度・経度を入力してください。")
+            return
+
+        user_input = user_input.strip().strip('()').replace(" ", "")
+        lat, lon = map(float, user_input.split(","))
+
+        with st.spinner("避難所データを読み込んでいます..."), metrics.span("wait_dataset"):
+            dataset = load_shelter_dataset(SHELTER_PATH, HAZARD_PATH)
+
+        alternatives = None
+        with metrics.span("search", walking=walking):
+            if ranking is not None:
+                nearest_shelters, alternatives = rank_hazard_shelters(dataset, lat, lon, ranking)
+            elif walking:
+                # 直線距離の上位候補を、道路グラフ上の道のりで並べ替える
+                router = get_walking_router(dataset.version, ROAD_GRAPH_PATH, dataset)
+                nearest_shelters = router.find_nearest(
+                    lat,
+                    lon,
+                    filter_column=filter_column,
+                    filter_value=filter_value,
+                    top_n=5
+                )
+            else:
+                nearest_shelters = find_nearest_shelters(
+                    dataset,
+                    lat,
+                    lon,
+                    filter_column=filter_column,
+                    filter_value=filter_value,
+                    top_n=5
+                )
+
+        if len(nearest_shelters) == 0:
+            st.warning(f"{condition} に一致する避難所が見つかりませんでした。")
+            return
+
+        st.subheader("最も近い避難所一覧")
+        display_columns = DISASTER_DISPLAY_COLUMNS if disaster_mode else TYPE_DISPLAY_COLUMNS
+        if ranking is not None:
+            display_columns = RANKING_DISPLAY_COLUMNS
+        if walking:
+            display_columns = display_columns[:2] + [WALK_DISTANCE_COLUMN] + display_columns[2:]
+        st.table(nearest_shelters[display_columns])
+
+        if alternatives is not None:
+            st.subheader("災害ごとの最も近い避難所（対応状況 O）")
+            st.table(alternatives[ALTERNATIVE_DISPLAY_COLUMNS])
+
+        st.subheader("地図表示")
+        overview = None
+        if disaster_mode:
+            color_note = f"{filter_column[len('df2_'):]}の対応状況で色分け"
+        else:
+            color_note = f"{filter_column}かどうかで色分け"
+        if st.checkbox(f"すべての避難所を地図に表示（{color_note}）", key="show_overview"):
+            overview = get_overview_data(dataset.version, filter_column, dataset)
+
+        from shelter_map import MAP_FILE_NAME, cached_map, map_html, session_map_cache
+        from streamlit_folium import st_folium
+
+        map_object = cached_map(session_map_cache(st.session_state), lat, lon, nearest_shelters, overview)
+
+        with metrics.span("st_folium"):
+            st_folium(map_object, width=700, height=500)
+
+        st.download_button(
+            label="地図をHTMLファイルとしてダウンロード",
+            data=lambda: map_html(lat, lon, nearest_shelters, overview),
+            file_name=MAP_FILE_NAME,
+            mime="text/html"
+        )
+
+    except ValueError as ve:
+        st.error(f"エラーが発生しました: {ve}")
+    except Exception as e:
+        st.error(f"予期せぬエラーが発生しました: {e}")
+
+if __name__ == "__main__":
+    main()
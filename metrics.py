@@ -0,0 +1,282 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+# 計測結果を書き出すロガー（1回の計測ごとに JSON 1行）
+logger = logging.getLogger("shelter.metrics")
+
+# 段階ごとに分位点の計算に使う、直近の計測結果の数
+WINDOW_SIZE = 2048
+
+# 出力する分位点
+QUANTILES = (0.5, 0.95, 0.99)
+
+# テキストファイルへの書き出しの最短間隔(秒)
+TEXTFILE_INTERVAL_SECONDS = 5.0
+
+# Prometheus 形式で出力するときのメトリクス名の接頭辞
+METRIC_PREFIX = "shelter"
+
+
+# 計測が無効なときに使う、何もしない区間
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+# 1つの区間の処理時間を計測し、終了時に登録先へ記録する
+class _Span:
+    def __init__(self, registry, stage, labels):
+        self._registry = registry
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._registry.observe(self.stage, time.perf_counter() - self._start, self.labels, error=exc_type is not None)
+        return False
+
+
+# 段階ごとの処理時間と、キャッシュのヒット・ミスの回数を集計するもの。
+# labels を指定すると、Prometheus 形式の出力のすべての系列にそのラベルを付ける（プロセスの区別など）
+class MetricsRegistry:
+    def __init__(self, window_size=WINDOW_SIZE, log=True, labels=None):
+        self.window_size = window_size
+        self.log = log
+        self.labels = dict(labels or {})
+        self._lock = threading.Lock()
+        self._samples = {}   # 段階 -> 直近の処理時間(秒)
+        self._totals = {}    # 段階 -> [回数, 合計秒, エラー回数]
+        self._counters = {}  # (名前, 結果) -> 回数
+        self._caches = {}    # 名前 -> hits / misses を持つキャッシュ（QueryCache など）
+
+    def observe(self, stage, seconds, labels=None, error=False):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window_size)
+                self._totals[stage] = [0, 0.0, 0]
+            samples.append(seconds)
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += int(error)
+
+        if self.log:
+            record = {"event": "span", "stage": stage, "ms": round(seconds * 1000, 3), "error": error}
+            if labels:
+                record.update(labels)
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+    def count(self, name, result, amount=1):
+        with self._lock:
+            self._counters[(name, result)] = self._counters.get((name, result), 0) + amount
+
+    # hits / misses 属性を持つキャッシュを登録し、出力時にその値を読む
+    def register_cache(self, name, cache):
+        with self._lock:
+            self._caches[name] = cache
+
+    # 段階ごとの {回数, 合計秒, エラー回数, 分位点} を返す
+    def stage_summary(self):
+        with self._lock:
+            snapshot = {stage: (sorted(samples), list(self._totals[stage])) for stage, samples in self._samples.items()}
+
+        summary = {}
+        for stage, (samples, (count, total, errors)) in snapshot.items():
+            quantiles = {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+            summary[stage] = {"count": count, "sum": total, "errors": errors, "quantiles": quantiles}
+        return summary
+
+    # (名前, 結果) ごとの回数を返す（登録したキャッシュのヒット・ミスを含む）
+    def counters(self):
+        with self._lock:
+            counters = dict(self._counters)
+            caches = dict(self._caches)
+        for name, cache in caches.items():
+            counters[(name, "hit")] = counters.get((name, "hit"), 0) + cache.hits
+            counters[(name, "miss")] = counters.get((name, "miss"), 0) + cache.misses
+        return counters
+
+    # 系列のラベルの文字列（{pid="1",stage="..."} など）を返す
+    def _series_labels(self, **labels):
+        return "{" + ",".join(f'{name}="{value}"' for name, value in {**self.labels, **labels}.items()) + "}"
+
+    # Prometheus のテキスト形式で出力する
+    def render_prometheus(self):
+        summaries = sorted(self.stage_summary().items())
+        series = self._series_labels
+        lines = [
+            f"# HELP {METRIC_PREFIX}_stage_seconds 段階ごとの処理時間（直近 {self.window_size} 回の分位点）",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds summary",
+        ]
+        for stage, summary in summaries:
+            for q, seconds in summary["quantiles"].items():
+                lines.append(f'{METRIC_PREFIX}_stage_seconds{series(stage=stage, quantile=q)} {seconds:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{series(stage=stage)} {summary["sum"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{series(stage=stage)} {summary["count"]}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_stage_errors_total 例外で終わった回数",
+            f"# TYPE {METRIC_PREFIX}_stage_errors_total counter",
+        ]
+        for stage, summary in summaries:
+            lines.append(f'{METRIC_PREFIX}_stage_errors_total{series(stage=stage)} {summary["errors"]}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_cache_requests_total キャッシュの参照回数（ヒット・ミス別）",
+            f"# TYPE {METRIC_PREFIX}_cache_requests_total counter",
+        ]
+        for (name, result), value in sorted(self.counters().items()):
+            lines.append(f'{METRIC_PREFIX}_cache_requests_total{series(cache=name, result=result)} {value}')
+        return "\n".join(lines) + "\n"
+
+
+# 現在の登録先（計測が無効なら None）と、出力先の設定
+_registry = None
+_textfile = None
+_last_flush = 0.0
+_server = None
+_config_lock = threading.Lock()
+
+
+# 計測を有効にする関数。
+# textfile を指定すると flush() で Prometheus 形式のファイルを書き出し（node_exporter の textfile 収集向け）、
+# port を指定すると http://127.0.0.1:port/metrics で同じ内容を返す。
+# ポートを使えない場合（同じポートを指定した別のプロセスが使用中など）は、ログに残して HTTP での出力だけを諦める。
+def configure(textfile=None, port=None, log=True, labels=None):
+    global _registry, _textfile, _server
+    with _config_lock:
+        if _registry is None:
+            _registry = MetricsRegistry(log=log, labels=labels)
+        if textfile and textfile != _textfile:
+            atexit.register(_remove_textfile, textfile)
+        _textfile = textfile
+        if log and not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+        if port and _server is None:
+            try:
+                _server = _start_http_server(port)
+            except OSError as e:
+                logging.getLogger(__name__).warning("計測結果の HTTP 出力にポート %s を使えません: %s", port, e)
+        return _registry
+
+
+# プロセスごとの出力ファイル名（拡張子の前にプロセス ID を入れる。例: shelter.prom -> shelter.1234.prom）
+def process_textfile(path, pid=None):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{os.getpid() if pid is None else pid}{ext}"
+
+
+# 環境変数から計測を設定する関数（いずれも未設定なら無効のまま）。
+# SHELTER_METRICS=1: 計測と構造化ログ, SHELTER_METRICS_FILE: 出力ファイル, SHELTER_METRICS_PORT: HTTP のポート。
+# 複数のプロセス（Streamlit のワーカーなど）が同じ設定で動くため、出力ファイルはプロセスごとに分け
+# （process_textfile）、系列には pid のラベルを付ける。
+def configure_from_env(environ=os.environ):
+    textfile = environ.get("SHELTER_METRICS_FILE")
+    port = environ.get("SHELTER_METRICS_PORT")
+    if not (environ.get("SHELTER_METRICS") or textfile or port):
+        return None
+    return configure(textfile=process_textfile(textfile) if textfile else None, port=int(port) if port else None,
+                     labels={"pid": os.getpid()})
+
+
+def disable():
+    global _registry, _textfile
+    with _config_lock:
+        _registry = None
+        _textfile = None
+
+
+def registry():
+    return _registry
+
+
+# 処理時間を計測する区間を返す（with metrics.span("段階名"): ...）。
+# 計測が無効なときは何もしない共通のオブジェクトを返すため、ほとんど負荷がかからない
+def span(stage, **labels):
+    current = _registry
+    if current is None:
+        return _NOOP_SPAN
+    return _Span(current, stage, labels)
+
+
+# キャッシュのヒット・ミスなどの回数を数える
+def count(name, result, amount=1):
+    current = _registry
+    if current is not None:
+        current.count(name, result, amount)
+
+
+def register_cache(name, cache):
+    current = _registry
+    if current is not None:
+        current.register_cache(name, cache)
+
+
+# 設定されていればテキストファイルを書き出す（TEXTFILE_INTERVAL_SECONDS より短い間隔では書かない）
+def flush(force=False):
+    global _last_flush
+    current = _registry
+    path = _textfile
+    if current is None or not path:
+        return
+    now = time.monotonic()
+    if not force and now - _last_flush < TEXTFILE_INTERVAL_SECONDS:
+        return
+    _last_flush = now
+
+    # 読み込み中の収集プロセスが書きかけのファイルを見ないよう、一時ファイルから置き換える
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(current.render_prometheus())
+    os.replace(tmp_path, path)
+
+
+# 終了時に出力ファイルを削除する（終了したプロセスの値が収集され続けないようにする）
+def _remove_textfile(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _start_http_server(port):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            current = _registry
+            if self.path.split("?")[0] != "/metrics" or current is None:
+                self.send_error(404)
+                return
+            body = current.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="shelter-metrics", daemon=True).start()
+    return server
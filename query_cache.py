@@ -0,0 +1,91 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# 既定の上限（件数・有効期限・合計サイズ）
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+# キャッシュする値のおおよそのサイズ(バイト)を返す関数
+def estimate_bytes(value):
+    if hasattr(value, 'memory_usage'):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+
+# 検索結果のキャッシュ。
+# 最後に使われてから古い順（LRU）に捨て、有効期限(TTL)と合計サイズの上限も守る。
+# 複数セッションのスレッドから同時に使われるため、操作はロックで保護する。
+class QueryCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 max_bytes=DEFAULT_MAX_BYTES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries = OrderedDict()  # キー -> (有効期限, サイズ, 値)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.total_bytes -= size
+
+    # キーに対応する値を返す（なければ None）
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    # 値を登録し、上限を超えた分を古い順に捨てる
+    def put(self, key, value):
+        size = estimate_bytes(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl_seconds, size, value)
+            self.total_bytes += size
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    # 全エントリーの (キー, 値) の一覧を返す（有効期限切れのものも含む）
+    def items(self):
+        with self._lock:
+            return [(key, entry[2]) for key, entry in self._entries.items()]
+
+    # mapping {旧キー: 新キー} に従ってキーを置き換える（新キーが None のエントリーは捨てる）。
+    # 並び順（LRU）と有効期限は引き継ぐ。mapping を作る間に消えたエントリーは無視し、
+    # 新キーのエントリーがすでにあればそちらを残す。
+    def rekey(self, mapping):
+        with self._lock:
+            entries = OrderedDict()
+            for key, entry in self._entries.items():
+                new_key = mapping.get(key, key)
+                if new_key is None or (new_key != key and new_key in self._entries):
+                    self.total_bytes -= entry[1]
+                    continue
+                entries[new_key] = entry
+            self._entries = entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
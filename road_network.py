@@ -0,0 +1,253 @@
+import argparse
+import bz2
+import gzip
+import heapq
+import math
+import sys
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+import metrics
+from shelter_index import GridIndex
+from shelter_search import DISTANCE_COLUMN, geodesic_km, haversine_km
+
+# 道のり（徒歩）距離の列名
+WALK_DISTANCE_COLUMN = '徒歩距離(km)'
+
+# 既定の道路グラフのファイル（build_road_graph の出力）
+DEFAULT_GRAPH_PATH = "roads_walk.npz"
+
+# 歩行者が通れる道路の種類（OSM の highway タグ）
+WALKABLE_HIGHWAYS = {
+    'trunk', 'trunk_link', 'primary', 'primary_link', 'secondary', 'secondary_link',
+    'tertiary', 'tertiary_link', 'unclassified', 'residential', 'living_street', 'service',
+    'pedestrian', 'footway', 'path', 'steps', 'track', 'cycleway', 'road',
+}
+
+# 歩行者が通れないことを表す foot / access タグの値
+NO_ACCESS_VALUES = {'no', 'private'}
+
+# 出発地点・避難所から最寄りノードまでの直線距離の上限(km)。
+# これより遠い地点（道路グラフの抽出範囲の外など）は道路につながらないものとし、道路でたどり着けないとする
+MAX_SNAP_KM = 0.5
+
+# 直線距離で上位 top_n × CANDIDATE_FACTOR 件を候補とし、道のり距離で並べ替える
+CANDIDATE_FACTOR = 4
+
+# 候補の直線距離の最大値のこの倍数まで道のりを探索し、届かない候補は「到達できない」とする
+MAX_DETOUR_FACTOR = 3.0
+
+
+# OSM の XML ファイル（.osm / .osm.bz2 / .osm.gz）を開く関数
+def _open_osm(path):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+# 歩行者が通れる way かどうかを判定する関数
+def _is_walkable(tags):
+    if tags.get('highway') not in WALKABLE_HIGHWAYS:
+        return False
+    if tags.get('foot') in NO_ACCESS_VALUES:
+        return False
+    return tags.get('access') not in NO_ACCESS_VALUES or tags.get('foot') in ('yes', 'designated')
+
+
+# 歩行者用の道路網のグラフ。
+# 交差点・道路の形状点をノードとし、隣り合うノード間の距離(km)を重みとする無向グラフを
+# CSR 形式（indptr / indices / weights）の配列で持つ。ノードの検索には GridIndex を使う。
+class RoadGraph:
+    def __init__(self, lats, lons, indptr, indices, weights):
+        self.lats = np.asarray(lats, dtype=float)
+        self.lons = np.asarray(lons, dtype=float)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+        self.index = GridIndex(self.lats, self.lons)
+        self._adjacency = None
+
+    def __len__(self):
+        return len(self.lats)
+
+    # 辺の一覧（両端のノード番号）からグラフを作る（辺は両方向に登録する）
+    @classmethod
+    def from_edges(cls, lats, lons, sources, targets):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+
+        weights = haversine_km(lats[sources], lons[sources], lats[targets], lons[targets])
+        sources, targets = np.concatenate([sources, targets]), np.concatenate([targets, sources])
+        weights = np.concatenate([weights, weights])
+
+        order = np.argsort(sources, kind='stable')
+        indptr = np.zeros(len(lats) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=len(lats)), out=indptr[1:])
+        return cls(lats, lons, indptr, targets[order], weights[order])
+
+    # OSM の XML から歩行者用の道路網を作る。
+    # 1回目の読み込みで歩行者が通れる way を集め、2回目でその way が使うノードの座標だけを読むため、
+    # 県全域の抽出データでも全ノードの座標をメモリに載せずに済む。
+    @classmethod
+    def from_osm(cls, path):
+        ways = []
+        with _open_osm(path) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag == 'way':
+                    tags = {tag.get('k'): tag.get('v') for tag in elem.iter('tag')}
+                    if _is_walkable(tags):
+                        ways.append([int(nd.get('ref')) for nd in elem.iter('nd')])
+                    elem.clear()
+                elif elem.tag in ('node', 'relation'):
+                    elem.clear()
+
+        node_ids = np.unique(np.fromiter((ref for way in ways for ref in way), dtype=np.int64))
+        lats = np.full(len(node_ids), np.nan)
+        lons = np.full(len(node_ids), np.nan)
+        with _open_osm(path) as f:
+            for _, elem in ET.iterparse(f):
+                if elem.tag == 'node':
+                    i = np.searchsorted(node_ids, int(elem.get('id')))
+                    if i < len(node_ids) and node_ids[i] == int(elem.get('id')):
+                        lats[i] = float(elem.get('lat'))
+                        lons[i] = float(elem.get('lon'))
+                    elem.clear()
+                elif elem.tag in ('way', 'relation'):
+                    elem.clear()
+
+        sources = []
+        targets = []
+        for way in ways:
+            refs = np.searchsorted(node_ids, way)
+            sources.append(refs[:-1])
+            targets.append(refs[1:])
+        sources = np.concatenate(sources) if sources else np.empty(0, dtype=np.int64)
+        targets = np.concatenate(targets) if targets else np.empty(0, dtype=np.int64)
+
+        # 抽出範囲の外にあって座標がないノードにつながる辺は除く
+        known = np.isfinite(lats[sources]) & np.isfinite(lats[targets]) & (sources != targets)
+        sources, targets = sources[known], targets[known]
+
+        # 辺を持たないノードは、出発地点・避難所の最寄りノードに選ばれないよう除く
+        used, renumbered = np.unique(np.concatenate([sources, targets]), return_inverse=True)
+        sources, targets = renumbered[:len(sources)], renumbered[len(sources):]
+        return cls.from_edges(lats[used], lons[used], sources, targets)
+
+    def save(self, path):
+        np.savez(path, lats=self.lats, lons=self.lons, indptr=self.indptr, indices=self.indices, weights=self.weights)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['lats'], data['lons'], data['indptr'], data['indices'], data['weights'])
+
+    # 各地点に最も近いノードと、そこまでの直線距離(km)を返す。
+    # 座標が欠損している地点や、max_snap_km 以内にノードがない地点は (-1, inf)。全地点をまとめて求める
+    def nearest_nodes(self, lats, lons, max_snap_km=MAX_SNAP_KM):
+        nodes, snap_km = self.index.nearest_within(lats, lons, max_snap_km)
+        return nodes.astype(np.int64), snap_km
+
+    # source から各 targets までの道のり(km)を返す（limit_km を超える・到達できない場合は inf）。
+    # 全ノードではなく、targets がすべて確定した時点で探索を打ち切る Dijkstra 法。
+    def shortest_distances(self, source, targets, limit_km=math.inf):
+        if self._adjacency is None:
+            # 1ノードずつ取り出すため、NumPy 配列より速い Python のリストにしておく
+            self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        indptr, indices, weights = self._adjacency
+
+        remaining = {int(target) for target in targets if target >= 0}
+        settled = {}
+        best = {source: 0.0}
+        heap = [(0.0, source)]
+        while heap and remaining:
+            dist, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if dist > limit_km:
+                break
+            settled[node] = dist
+            remaining.discard(node)
+            for k in range(indptr[node], indptr[node + 1]):
+                neighbor = indices[k]
+                candidate = dist + weights[k]
+                if candidate < best.get(neighbor, math.inf):
+                    best[neighbor] = candidate
+                    heapq.heappush(heap, (candidate, neighbor))
+
+        return np.array([settled.get(int(target), math.inf) for target in targets], dtype=float)
+
+
+# 避難所データセットと道路グラフを組み合わせ、道のり距離で避難所を並べ替えるもの。
+# 各避難所に最も近いノード（と、そこまでの距離）は構築時に1回だけ求めておく。
+class WalkingRouter:
+    def __init__(self, graph, dataset):
+        self.graph = graph
+        self.dataset = dataset
+        self.shelter_nodes, self.shelter_snap_km = graph.nearest_nodes(dataset.store['緯度'], dataset.store['経度'])
+
+    # 直線距離の上位候補を道のり距離で並べ替え、上位 top_n 件を返す。
+    # 結果には直線距離(距離(km))と道のり距離(徒歩距離(km))の両方の列を付け、
+    # 道路でたどり着けない候補（出発地点・避難所が道路から MAX_SNAP_KM より遠い場合を含む）は
+    # 徒歩距離を欠損として、直線距離の順に末尾に並べる。
+    def find_nearest(self, lat, lon, filter_column=None, filter_value=None, top_n=5,
+                     candidate_factor=CANDIDATE_FACTOR):
+        store = self.dataset.store
+        lats = np.asarray(store['緯度'], dtype=float)
+        lons = np.asarray(store['経度'], dtype=float)
+        index, mask = self.dataset.search_index(filter_column, filter_value)
+
+        count = top_n * candidate_factor
+        positions = index.nearest_candidates(lat, lon, count, mask=mask)
+        approx_km = haversine_km(lat, lon, lats[positions], lons[positions])
+        nearest = np.argsort(approx_km, kind='stable')[:count]
+        positions, approx_km = positions[nearest], approx_km[nearest]
+        if len(positions) == 0:
+            result = store.take(positions)
+            result[DISTANCE_COLUMN] = np.empty(0)
+            result[WALK_DISTANCE_COLUMN] = np.empty(0)
+            return result
+
+        origin_nodes, origin_snap_km = self.graph.nearest_nodes(lat, lon)
+        walk_km = np.full(len(positions), np.inf)
+        if origin_nodes[0] >= 0:
+            limit_km = MAX_DETOUR_FACTOR * float(approx_km.max())
+            targets = self.shelter_nodes[positions]
+            with metrics.span("walking_rerank", candidates=len(positions)):
+                network_km = self.graph.shortest_distances(int(origin_nodes[0]), targets, limit_km=limit_km)
+            walk_km = origin_snap_km[0] + network_km + self.shelter_snap_km[positions]
+
+        # 道のり距離の順に並べ、たどり着けない候補どうしは直線距離の順にする
+        order = np.lexsort((positions, approx_km, walk_km))[:top_n]
+        positions = positions[order]
+        walk_km = walk_km[order]
+
+        result = store.take(positions)
+        result[DISTANCE_COLUMN] = geodesic_km(lat, lon, lats[positions], lons[positions])
+        result[WALK_DISTANCE_COLUMN] = np.where(np.isfinite(walk_km), walk_km, np.nan)
+        return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OSM の抽出データから、徒歩距離の検索に使う道路グラフを作成します。")
+    parser.add_argument("osm", help="OSM の XML ファイル（.osm / .osm.bz2 / .osm.gz）")
+    parser.add_argument("--output", default=DEFAULT_GRAPH_PATH, help="出力する道路グラフ（.npz）")
+    args = parser.parse_args(argv)
+
+    try:
+        graph = RoadGraph.from_osm(args.osm)
+        graph.save(args.output)
+    except (OSError, ValueError, ET.ParseError) as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{args.output} を作成しました（ノード {len(graph)} 件, 辺 {len(graph.indices) // 2} 本）。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+
+from dataset_refresh import source_signature
+from shelter_dataset import ShelterDataset
+from shelter_index import GridIndex
+from shelter_store import ShelterStore
+
+# 公開中のバージョンを指すファイル名
+CURRENT_FILE = "CURRENT"
+
+# 公開処理の排他ロックのファイル名と、古いロックを無効とみなすまでの秒数
+LOCK_FILE = ".lock"
+LOCK_STALE_SECONDS = 600
+
+# 古いバージョンをいくつ残すか（切り替え直後も読み込み中のワーカーがいるため）
+KEEP_VERSIONS = 2
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+# 公開中のバージョン情報（{"version": ..., "source_key": ...}）を返す関数
+def read_current(directory):
+    try:
+        with open(os.path.join(directory, CURRENT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# データセットを構成する配列とメタデータを集める
+def _dataset_arrays(dataset):
+    meta = {"version": dataset.version, "partitions": []}
+    arrays = {}
+
+    meta["store"], store_arrays = dataset.store.to_arrays()
+    arrays.update({f"store.{name}": array for name, array in store_arrays.items()})
+
+    meta["index"], index_arrays = dataset.index.to_arrays()
+    arrays.update({f"index.{name}": array for name, array in index_arrays.items()})
+
+    for i, ((column, value), partition) in enumerate(dataset.partitions.items()):
+        partition_meta, partition_arrays = partition.to_arrays()
+        meta["partitions"].append({"column": column, "value": value, "index": partition_meta})
+        arrays.update({f"partition{i}.{name}": array for name, array in partition_arrays.items()})
+
+    meta["arrays"] = sorted(arrays)
+    return meta, arrays
+
+
+# 古いバージョンのディレクトリを削除する（使用中で消せない場合はそのまま残す）
+def _remove_old_versions(directory, current_version, keep):
+    versions = [
+        entry for entry in os.scandir(directory)
+        if entry.is_dir() and entry.name != current_version and ".tmp" not in entry.name
+    ]
+    versions.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[max(keep - 1, 0):]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+# データセットを directory/<バージョン>/ に .npy ファイルとして書き出し、公開中のバージョンを切り替える関数。
+# 書き出しは一時ディレクトリで行い、完成してから名前を変えるため、読み込み中のワーカーが
+# 書きかけのファイルを見ることはない。/dev/shm 以下を指定すれば共有メモリ上に置ける。
+def publish(dataset, directory, source_key=None, keep=KEEP_VERSIONS):
+    os.makedirs(directory, exist_ok=True)
+    version_dir = os.path.join(directory, dataset.version)
+
+    if not os.path.isdir(version_dir):
+        meta, arrays = _dataset_arrays(dataset)
+        tmp_dir = f"{version_dir}.{os.getpid()}.tmp"
+        os.makedirs(tmp_dir)
+        try:
+            for i, name in enumerate(meta["arrays"]):
+                np.save(os.path.join(tmp_dir, f"{i}.npy"), np.asarray(arrays[name]), allow_pickle=False)
+            _write_json(os.path.join(tmp_dir, "manifest.json"), meta)
+            os.replace(tmp_dir, version_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    _write_json(os.path.join(directory, CURRENT_FILE), {"version": dataset.version, "source_key": source_key})
+    _remove_old_versions(directory, dataset.version, keep)
+    return dataset.version
+
+
+# 書き出されたデータセットを読み取り専用のメモリマップで開く関数。
+# 配列はコピーされず、同じファイルを開いた全プロセスで OS のページキャッシュを共有する。
+def attach(directory, version=None):
+    if version is None:
+        current = read_current(directory)
+        if current is None:
+            raise FileNotFoundError(f"{directory} に公開済みのデータセットがありません")
+        version = current["version"]
+
+    version_dir = os.path.join(directory, version)
+    with open(os.path.join(version_dir, "manifest.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+
+    arrays = {
+        name: np.load(os.path.join(version_dir, f"{i}.npy"), mmap_mode="r", allow_pickle=False)
+        for i, name in enumerate(meta["arrays"])
+    }
+
+    def select(prefix):
+        return {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+
+    partitions = {
+        (partition["column"], partition["value"]): GridIndex.from_arrays(partition["index"], select(f"partition{i}."))
+        for i, partition in enumerate(meta["partitions"])
+    }
+    return ShelterDataset(
+        meta["version"],
+        ShelterStore.from_arrays(meta["store"], select("store.")),
+        GridIndex.from_arrays(meta["index"], select("index.")),
+        partitions,
+    )
+
+
+# ディレクトリ単位の排他ロック（OS に依存しないよう、ファイルの排他作成で実現する）
+class _DirectoryLock:
+    def __init__(self, directory, poll_seconds=0.1):
+        self.path = os.path.join(directory, LOCK_FILE)
+        self.poll_seconds = poll_seconds
+
+    def __enter__(self):
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return self
+            except FileExistsError:
+                # 異常終了したプロセスのロックが残っている場合は取り除く
+                try:
+                    if time.time() - os.path.getmtime(self.path) > LOCK_STALE_SECONDS:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue
+                time.sleep(self.poll_seconds)
+
+    def __exit__(self, *exc_info):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# 公開中のデータセットが入力ファイルと一致していればそのバージョンを、
+# そうでなければ（最初の1プロセスだけが）build() で構築して公開し、そのバージョンを返す関数
+def publish_if_stale(directory, source_key, build):
+    current = read_current(directory)
+    if current and current.get("source_key") == source_key:
+        return current["version"]
+
+    os.makedirs(directory, exist_ok=True)
+    with _DirectoryLock(directory):
+        # ロック待ちの間に他のプロセスが公開していればそれを使う
+        current = read_current(directory)
+        if current and current.get("source_key") == source_key:
+            return current["version"]
+        return publish(build(), directory, source_key=source_key)
+
+
+# プロセス内で開いているデータセット（ディレクトリ -> (バージョン, データセット)）
+_attached = {}
+_attached_lock = threading.Lock()
+
+
+# 指定したバージョンのデータセットを開く関数（プロセス内では開いたものを使い回す）
+def _attach_version(directory, version):
+    with _attached_lock:
+        attached = _attached.get(directory)
+        if attached is None or attached[0] != version:
+            attached = (version, attach(directory, version))
+            _attached[directory] = attached
+    return attached[1]
+
+
+# 共有データセットを開く関数。
+# 公開中のデータセットが入力ファイルと一致していなければ、構築して公開してから開く。
+def open_shared_dataset(directory, source_paths, build):
+    return _attach_version(directory, publish_if_stale(directory, source_signature(source_paths), build))
+
+
+# 公開中のバージョンのデータセットを開く関数。
+# 入力ファイルとの比較・構築はせず、公開中のバージョンを確認する（小さなファイルを1つ読むだけ）だけのため、
+# 他のプロセスが構築中でも待たずに、新しいバージョンが公開されていればそちらに切り替える。
+def attach_current(directory):
+    current = read_current(directory)
+    if current is None:
+        raise FileNotFoundError(f"{directory} に公開済みのデータセットがありません")
+    return _attach_version(directory, current["version"])
+
+
+def main(argv=None):
+    from build_dataset import DEFAULT_HAZARD_PATH, DEFAULT_OUTPUT_PATH, DEFAULT_SHELTER_PATH
+    from shelter_dataset import build_shelter_dataset
+
+    parser = argparse.ArgumentParser(description="結合済みの避難所データセットを共有ディレクトリに公開します。")
+    parser.add_argument("directory", help="公開先のディレクトリ（例: /dev/shm/hinanjo/merged）")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="災害別対応状況のCSV (DF2)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH, help="結合済みデータセットの Parquet ファイル")
+    args = parser.parse_args(argv)
+
+    def build():
+        return build_shelter_dataset(args.shelters, args.hazards, args.output)
+
+    try:
+        version = publish_if_stale(args.directory, source_signature([args.shelters, args.hazards]), build)
+    except (OSError, ValueError) as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        return 1
+
+    print(f"{args.directory} にバージョン {version} を公開しています。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,451 @@
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+from dataset_refresh import DatasetRefresher
+from query_cache import QueryCache
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+
+# 最も近い避難所の検索を HTTP/JSON で提供するサーバー（Streamlit を使わない外部システム向け）。
+#   GET  /nearest?lat=33.81&lon=132.77&top_n=5&type=指定避難所
+#   GET  /nearest?lat=33.81&lon=132.77&disaster=津波&status=O
+#   GET  /nearest/ranked?lat=33.81&lon=132.77&require=津波=O,土砂>=A&weights=洪水:0.5&elevation_weight=0.01
+#        複数の対応災害の条件・重みによる順位付けと、災害ごとの最も近い避難所（hazard_ranking.rank_shelters）
+#   POST /nearest/batch  {"points": [[33.81, 132.77], ...], "top_n": 5, "disaster": "津波", "status": "O"}
+#   GET  /health         読み込み状況・データセットのバージョン・キャッシュの状況
+#   GET  /metrics        計測が有効なとき（SHELTER_METRICS など）、Prometheus 形式の計測結果
+# 検索は避難所検索アプリと同じデータセット・空間インデックス・検索キャッシュの仕組みを使い、
+# 同じ条件の検索が同時に届いた場合は1回だけ計算して結果を共有する。
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+
+# 検索を行うスレッド数（イベントループを止めないよう、検索はスレッドプールで行う）
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+# 返す件数・一括検索の地点数・リクエストの本文の上限
+MAX_TOP_N = 50
+MAX_BATCH_POINTS = 10000
+MAX_BODY_BYTES = 4 * 1024 * 1024
+
+# 対応災害の指定（「津波」と「df2_津波」のどちらでもよい）と、絞込みに使う列
+DISASTER_COLUMNS = {column[len('df2_'):]: column for column in HAZARD_COLUMNS}
+DISASTER_COLUMNS.update({column: column for column in HAZARD_COLUMNS})
+
+HTTP_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+}
+
+
+# 要求の誤りを表す例外（400 などで返す）
+class RequestError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# 検索条件（種別・対応災害・対応状況）から、絞込みに使う (列, 値) を返す関数
+# （JSON の本文では文字列以外の値も送れるため、文字列かどうかを先に確かめる）
+def parse_filter(params):
+    for name in ("type", "disaster", "status"):
+        if params.get(name) is not None and not isinstance(params[name], str):
+            raise RequestError(f"{name} は文字列で指定してください")
+    shelter_type = params.get("type")
+    disaster = params.get("disaster")
+    if shelter_type and disaster:
+        raise RequestError("type と disaster は同時に指定できません")
+    if shelter_type:
+        if shelter_type not in SHELTER_TYPE_COLUMNS:
+            raise RequestError(f"type は {list(SHELTER_TYPE_COLUMNS)} のいずれかを指定してください")
+        return shelter_type, "O"
+    if disaster:
+        if disaster not in DISASTER_COLUMNS:
+            raise RequestError(f"disaster は {list(DISASTER_COLUMNS)[:len(HAZARD_COLUMNS)]} のいずれかを指定してください")
+        status = params.get("status", "O")
+        if status not in HAZARD_STATUSES:
+            raise RequestError(f"status は {HAZARD_STATUSES} のいずれかを指定してください")
+        return DISASTER_COLUMNS[disaster], status
+    return None, None
+
+
+def parse_top_n(value):
+    try:
+        top_n = int(value)
+    except (TypeError, ValueError):
+        raise RequestError("top_n は整数で指定してください") from None
+    if not 1 <= top_n <= MAX_TOP_N:
+        raise RequestError(f"top_n は 1 から {MAX_TOP_N} の範囲で指定してください")
+    return top_n
+
+
+def parse_coordinate(value, name, limit):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise RequestError(f"{name} は数値で指定してください") from None
+    if not (math.isfinite(number) and -limit <= number <= limit):
+        raise RequestError(f"{name} は -{limit} から {limit} の範囲で指定してください")
+    return number
+
+
+# 検索結果の DataFrame を、JSON にできる辞書のリストにする関数（欠損は null）
+def frame_records(frame):
+    columns = list(frame.columns)
+    records = []
+    for row in frame.itertuples(index=False, name=None):
+        records.append({
+            column: None if value is None or (isinstance(value, float) and math.isnan(value)) else value
+            for column, value in zip(columns, row)
+        })
+    return records
+
+
+def encode_json(payload):
+    return json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+
+
+# 検索の処理（データセットの参照・キャッシュ・同時に届いた同じ検索のまとめ）を行うもの
+class ShelterService:
+    def __init__(self, refresher, cache, workers=DEFAULT_WORKERS, cell_cache=None):
+        self.refresher = refresher
+        self.cache = cache
+        self.cell_cache = cell_cache
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shelter-api")
+        self._inflight = {}  # 検索キャッシュのキー -> 計算中の Future
+        self.coalesced = 0
+        self._matrix = None  # (データセットのバージョン, hazard_ranking.HazardMatrix)
+
+    # 読み込み済みの最新のデータセットを返す（読み込み中なら 503）
+    def dataset(self):
+        try:
+            return self.refresher.result(timeout=0)
+        except TimeoutError:
+            raise RequestError("避難所データを読み込んでいます", status=503) from None
+
+    def _search(self, dataset, lat, lon, filter_column, filter_value, top_n):
+        from shelter_dataset import find_nearest_cached
+
+        with metrics.span("api_search"):
+            result = find_nearest_cached(
+                dataset, self.cache, lat, lon, filter_column=filter_column, filter_value=filter_value, top_n=top_n,
+                cell_cache=self.cell_cache
+            )
+            return encode_json({"version": dataset.version, "results": frame_records(result)})
+
+    # 1地点の検索結果（JSON）を返す。
+    # 同じキーの検索が計算中なら新たに計算せず、その結果を待って共有する
+    async def nearest(self, lat, lon, filter_column=None, filter_value=None, top_n=5):
+        from shelter_dataset import QUERY_PRECISION
+
+        dataset = self.dataset()
+        key = (dataset.version, round(lat, QUERY_PRECISION), round(lon, QUERY_PRECISION), filter_column, filter_value, top_n)
+        future = self._inflight.get(key)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(
+                self.executor, self._search, dataset, lat, lon, filter_column, filter_value, top_n
+            )
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+            metrics.count("api_coalesce", "hit")
+        # 待っている要求の1つが切断されても、他の要求のための計算は取り消さない
+        return await asyncio.shield(future)
+
+    # 複数災害の順位付けに使う対応状況の行列（データセットのバージョンごとに1回だけ作る）
+    def _hazard_matrix(self, dataset):
+        from hazard_ranking import HazardMatrix
+
+        cached = self._matrix
+        if cached is None or cached[0] != dataset.version:
+            cached = self._matrix = (dataset.version, HazardMatrix.from_dataset(dataset))
+        return cached[1]
+
+    def _ranked(self, dataset, lat, lon, requirements, weights, elevation_weight, top_n):
+        from hazard_ranking import rank_shelters
+
+        with metrics.span("api_ranked"):
+            ranked, alternatives = rank_shelters(
+                dataset, lat, lon, requirements=requirements, weights=weights, elevation_weight=elevation_weight,
+                top_n=top_n, matrix=self._hazard_matrix(dataset),
+            )
+            return encode_json({
+                "version": dataset.version,
+                "results": frame_records(ranked),
+                "alternatives": {column[len('df2_'):]: frame_records(frame) for column, frame in alternatives.items()},
+            })
+
+    # 複数の対応災害の条件・重みで順位付けした結果（JSON）を返す
+    async def nearest_ranked(self, lat, lon, requirements, weights, elevation_weight=0.0, top_n=5):
+        dataset = self.dataset()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._ranked, dataset, lat, lon, requirements, weights, elevation_weight, top_n
+        )
+
+    def _batch(self, dataset, lats, lons, filter_column, filter_value, top_n):
+        import numpy as np
+
+        from batch_search import nearest_positions_batch
+        from shelter_search import DISTANCE_COLUMN
+
+        with metrics.span("api_batch", points=len(lats)):
+            origins, ranks, positions, distances = nearest_positions_batch(
+                dataset, lats, lons, top_n=top_n, filter_column=filter_column, filter_value=filter_value
+            )
+            shelters = dataset.store.take(positions)
+            shelters[DISTANCE_COLUMN] = distances
+            records = frame_records(shelters)
+
+            results = [[] for _ in range(len(lats))]
+            for origin, record in zip(np.asarray(origins).tolist(), records):
+                results[origin].append(record)
+            return encode_json({"version": dataset.version, "results": results})
+
+    # 複数地点の検索結果（JSON）を返す（地点ごとの結果のリスト）
+    async def nearest_batch(self, points, filter_column=None, filter_value=None, top_n=5):
+        if not isinstance(points, list) or not points:
+            raise RequestError("points に緯度・経度の組のリストを指定してください")
+        if len(points) > MAX_BATCH_POINTS:
+            raise RequestError(f"points は {MAX_BATCH_POINTS} 件以下にしてください", status=413)
+
+        lats = []
+        lons = []
+        for point in points:
+            if isinstance(point, dict):
+                point = (point.get("lat"), point.get("lon"))
+            if not isinstance(point, (list, tuple)) or len(point) != 2:
+                raise RequestError("points の各要素は [緯度, 経度] または {\"lat\": 緯度, \"lon\": 経度} にしてください")
+            lats.append(parse_coordinate(point[0], "lat", 90))
+            lons.append(parse_coordinate(point[1], "lon", 180))
+
+        dataset = self.dataset()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, self._batch, dataset, lats, lons, filter_column, filter_value, top_n
+        )
+
+    def health(self):
+        payload = {"status": "loading", "cache": {"entries": len(self.cache), "hits": self.cache.hits,
+                                                  "misses": self.cache.misses}, "coalesced": self.coalesced}
+        if self.cell_cache is not None:
+            payload["cell_cache"] = self.cell_cache.stats()
+        try:
+            dataset = self.refresher.result(timeout=0)
+        except TimeoutError:
+            return encode_json(payload)
+        except Exception as e:
+            payload.update(status="error", error=str(e))
+            return encode_json(payload)
+        payload.update(status="ok", version=dataset.version, rows=len(dataset) - dataset.removed_rows,
+                       refreshes=self.refresher.refreshes)
+        return encode_json(payload)
+
+    # 要求を処理して (ステータス, 本文, Content-Type) を返す
+    async def handle(self, method, target, body):
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == "/nearest":
+            if method != "GET":
+                raise RequestError("GET で要求してください", status=405)
+            lat = parse_coordinate(params.get("lat"), "lat", 90)
+            lon = parse_coordinate(params.get("lon"), "lon", 180)
+            filter_column, filter_value = parse_filter(params)
+            top_n = parse_top_n(params.get("top_n", 5))
+            return 200, await self.nearest(lat, lon, filter_column, filter_value, top_n), "application/json"
+
+        if url.path == "/nearest/batch":
+            if method != "POST":
+                raise RequestError("POST で要求してください", status=405)
+            try:
+                request = json.loads(body or b"{}")
+            except ValueError:
+                raise RequestError("本文を JSON として読めません") from None
+            if not isinstance(request, dict):
+                raise RequestError("本文は JSON のオブジェクトにしてください")
+            filter_column, filter_value = parse_filter(request)
+            top_n = parse_top_n(request.get("top_n", 5))
+            return 200, await self.nearest_batch(request.get("points"), filter_column, filter_value, top_n), \
+                "application/json"
+
+        if url.path == "/nearest/ranked":
+            from hazard_ranking import parse_requirements, parse_weights
+
+            if method != "GET":
+                raise RequestError("GET で要求してください", status=405)
+            lat = parse_coordinate(params.get("lat"), "lat", 90)
+            lon = parse_coordinate(params.get("lon"), "lon", 180)
+            top_n = parse_top_n(params.get("top_n", 5))
+            try:
+                requirements = parse_requirements(params.get("require", ""))
+                weights = parse_weights(params.get("weights", ""))
+            except ValueError as e:
+                raise RequestError(str(e)) from None
+            try:
+                elevation_weight = float(params.get("elevation_weight", 0))
+            except ValueError:
+                raise RequestError("elevation_weight は数値で指定してください") from None
+            return 200, await self.nearest_ranked(lat, lon, requirements, weights, elevation_weight, top_n), \
+                "application/json"
+
+        if url.path == "/health":
+            return 200, self.health(), "application/json"
+
+        if url.path == "/metrics" and metrics.registry() is not None:
+            return 200, metrics.registry().render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+
+        raise RequestError(f"{url.path} は見つかりません", status=404)
+
+
+# 1つの接続の要求を順に処理する（HTTP/1.1 の keep-alive に対応）
+async def _serve_connection(service, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, target, version = request_line.decode("latin-1").split()
+            except ValueError:
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            length = int(headers.get("content-length") or 0)
+            if length > MAX_BODY_BYTES:
+                status, body, content_type = 413, encode_json({"error": "本文が大きすぎます"}), "application/json"
+                keep_alive = False
+            else:
+                request_body = await reader.readexactly(length) if length else b""
+                try:
+                    with metrics.span("api_request", path=urlsplit(target).path):
+                        status, body, content_type = await service.handle(method, target, request_body)
+                except RequestError as e:
+                    status, body, content_type = e.status, encode_json({"error": str(e)}), "application/json"
+                except Exception as e:
+                    status, body, content_type = 500, encode_json({"error": f"予期せぬエラー: {e}"}), "application/json"
+
+            head = [
+                f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                f"Content-Type: {content_type}; charset=utf-8",
+                f"Content-Length: {len(body)}",
+                "Connection: " + ("keep-alive" if keep_alive else "close"),
+            ]
+            if status == 503:
+                head.append("Retry-After: 1")
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+# サーバーを起動する（reuse_port=True なら、同じポートで複数のプロセスを起動して負荷を分散できる）
+async def start_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, reuse_port=False):
+    return await asyncio.start_server(
+        lambda reader, writer: _serve_connection(service, reader, writer), host, port,
+        reuse_port=reuse_port or None, backlog=1024,
+    )
+
+
+# 避難所検索アプリと同じ方法でデータセットを読み込み、入力ファイルの更新を監視する
+# （shared_dir を指定すると、アプリの各ワーカーと同じ共有データセットを使う）
+def create_refresher(shelter_path, hazard_path, dataset_path, cache, shared_dir=None):
+    from build_dataset import ensure_merged_dataset
+
+    def build():
+        from shelter_dataset import build_shelter_dataset
+
+        return build_shelter_dataset(shelter_path, hazard_path, dataset_path)
+
+    if shared_dir:
+        from shared_dataset import open_shared_dataset
+
+        return DatasetRefresher(
+            lambda: open_shared_dataset(os.path.join(shared_dir, "merged"), [shelter_path, hazard_path], build),
+            update=lambda dataset: (
+                open_shared_dataset(os.path.join(shared_dir, "merged"), [shelter_path, hazard_path], build), None
+            ),
+            source_paths=[shelter_path, hazard_path],
+        )
+
+    def update(dataset):
+        from shelter_dataset import update_dataset
+
+        return update_dataset(dataset, ensure_merged_dataset(shelter_path, hazard_path, dataset_path))
+
+    def on_update(old, new, changes):
+        from shelter_dataset import carry_over_query_cache
+
+        carry_over_query_cache(cache, old, new, changes)
+
+    return DatasetRefresher(build, update=update, source_paths=[shelter_path, hazard_path], on_update=on_update)
+
+
+async def serve(args):
+    cache = QueryCache()
+    metrics.register_cache("query", cache)
+    refresher = create_refresher(args.shelters, args.hazards, args.dataset, cache, args.shared_dir)
+    cell_cache = None
+    if args.cell_deg:
+        from cell_cache import CellCandidateCache
+
+        cell_cache = CellCandidateCache(args.cell_deg)
+        metrics.register_cache("cell", cell_cache)
+    service = ShelterService(refresher, cache, workers=args.workers, cell_cache=cell_cache)
+    server = await start_server(service, args.host, args.port, reuse_port=args.reuse_port)
+    print(f"http://{args.host}:{args.port}/ で待ち受けています（データセットはバックグラウンドで読み込みます）。", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    from build_dataset import DEFAULT_HAZARD_PATH, DEFAULT_OUTPUT_PATH, DEFAULT_SHELTER_PATH
+
+    parser = argparse.ArgumentParser(description="最も近い避難所の検索を HTTP/JSON で提供します。")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="検索を行うスレッド数")
+    parser.add_argument("--cell-deg", type=float, default=float(os.environ.get("SHELTER_CELL_DEG") or 0),
+                        help="地点をこの大きさ(度)のセルにまとめて検索の候補をキャッシュする（既定は環境変数 SHELTER_CELL_DEG, 0 なら使わない）")
+    parser.add_argument("--reuse-port", action="store_true",
+                        help="同じポートで複数のプロセスを起動できるようにする（--shared-dir と併用）")
+    parser.add_argument("--shared-dir", default=os.environ.get("SHELTER_SHARED_DIR"),
+                        help="アプリと共有するデータセットのディレクトリ（既定は環境変数 SHELTER_SHARED_DIR）")
+    parser.add_argument("--shelters", default=DEFAULT_SHELTER_PATH, help="避難所一覧のCSV (DF1)")
+    parser.add_argument("--hazards", default=DEFAULT_HAZARD_PATH, help="災害別対応状況のCSV (DF2)")
+    parser.add_argument("--dataset", default=DEFAULT_OUTPUT_PATH, help="結合済みデータセットの Parquet ファイル")
+    args = parser.parse_args(argv)
+
+    metrics.configure_from_env()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"エラーが発生しました: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from shelter_index import build_index, build_partitioned_index
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+from shelter_search import DISTANCE_COLUMN, HAVERSINE_REL_TOL, find_nearest, haversine_km
+from shelter_store import KEY_COLUMN, ShelterStore
+
+# 検索キャッシュのキーにする緯度経度の小数点以下の桁数（6桁で約0.1m）
+QUERY_PRECISION = 6
+
+# 空間インデックスを分割する列（種別・災害種別）。災害種別は対応状況（HAZARD_STATUSES）ごとに分割する
+PARTITION_COLUMNS = list(SHELTER_TYPE_COLUMNS) + HAZARD_COLUMNS
+
+# 差分の反映で削除済みとして残した行が全体のこの割合を超えたら、データセットを作り直す
+MAX_REMOVED_RATIO = 0.25
+
+
+# DataFrame の行ごとのハッシュ値を返す関数（差分の検出に使う）
+def row_hashes(df):
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+
+# DataFrame の内容からデータセットのバージョン（指紋）を計算する関数
+def dataset_fingerprint(df, hashes=None):
+    digest = hashlib.sha1()
+    digest.update(','.join(map(str, df.columns)).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df.index).to_numpy().tobytes())
+    digest.update((row_hashes(df) if hashes is None else hashes).tobytes())
+    return digest.hexdigest()[:16]
+
+
+# 読み込み済みの避難所データと、その空間インデックス・バージョンをまとめたもの。
+# 読み込み時に1回だけ構築し、以降の検索では DataFrame のハッシュ計算やコピーを行わない。
+# データは型付き配列の ShelterStore に変換して持ち、元の DataFrame は保持しない。
+# 入力ファイルが更新されたときは、apply_changes で変わった行だけを反映した新しいデータセットを作る。
+class ShelterDataset:
+    def __init__(self, version, store, index, partitions, hashes=None, removed_rows=0):
+        self.version = version
+        self.store = store
+        self.index = index
+        self.partitions = partitions  # {(列名, 値): GridIndex}
+        self.hashes = hashes          # 行ごとのハッシュ値（削除済みの行は 0）。共有データセットでは None
+        self.removed_rows = removed_rows
+
+    # DataFrame からデータセットを構築する
+    @classmethod
+    def from_frame(cls, df, partition_columns=(), partition_values=()):
+        with metrics.span("build_dataset", rows=len(df)):
+            store = ShelterStore.from_frame(df)
+            hashes = row_hashes(df)
+            return cls(
+                dataset_fingerprint(df, hashes),
+                store,
+                build_index(store),
+                build_partitioned_index(store, partition_columns, partition_values),
+                hashes,
+            )
+
+    # 分割済みインデックスの (列の一覧, 値の一覧) を返す（作り直すときに同じ分割にするため）
+    def partition_spec(self):
+        columns = list(dict.fromkeys(column for column, _ in self.partitions))
+        values = list(dict.fromkeys(value for _, value in self.partitions))
+        return columns, values
+
+    # 行位置 removed の行を削除し、df の行を追加したデータセットを返す（元のデータセットは変更しない）。
+    # 既存の行の行位置は変えず、空間インデックスも変わった行だけを差し替えるため、
+    # 作り直すより速く、元のデータセットを使っている検索にも影響しない。
+    def apply_changes(self, removed, df, hashes):
+        removed = np.asarray(removed, dtype=np.intp)
+        with metrics.span("apply_changes", removed=len(removed), added=len(df)):
+            store = self.store.updated(removed, df)
+            added = np.arange(len(self.store), len(store))
+            lats = store['緯度']
+            lons = store['経度']
+
+            partitions = {
+                (column, value): partition.updated(removed, added[np.asarray(df[column]) == value], lats, lons)
+                for (column, value), partition in self.partitions.items()
+            }
+
+            new_hashes = np.concatenate([self.hashes, hashes])
+            new_hashes[removed] = 0
+
+            # バージョンは変更前のバージョンと変更内容から決める
+            # （同じ内容を作り直した場合とは異なるが、検索キャッシュのキーとしては一意であればよい）
+            digest = hashlib.sha1(self.version.encode('utf-8'))
+            digest.update(removed.astype(np.int64).tobytes())
+            digest.update(np.asarray(hashes).tobytes())
+
+            return ShelterDataset(
+                digest.hexdigest()[:16],
+                store,
+                self.index.updated(removed, added, lats, lons),
+                partitions,
+                new_hashes,
+                self.removed_rows + len(removed),
+            )
+
+    def __len__(self):
+        return len(self.store)
+
+    # 絞込み条件に使う空間インデックスと行の絞込み(mask)を返す。
+    # filter_column が filter_value の分割済みインデックスがあればそれを使う。
+    # なければ全体のインデックスと mask を返す（カテゴリ列は文字列に戻さずにコードで比べる）
+    def search_index(self, filter_column=None, filter_value=None):
+        if not (filter_column and filter_value):
+            return self.index, None
+
+        partition = self.partitions.get((filter_column, filter_value))
+        if partition is not None:
+            return partition, None
+
+        if filter_column in self.store.categories:
+            return self.index, self.store.category_mask(filter_column, filter_value)
+        return self.index, np.asarray(self.store[filter_column]) == filter_value
+
+    # 最も近い避難所を上位N件返す（filter_column が filter_value の避難所に限定できる）
+    def find_nearest(self, lat, lon, filter_column=None, filter_value=None, top_n=5):
+        index, mask = self.search_index(filter_column, filter_value)
+        return find_nearest(self.store, lat, lon, top_n=top_n, index=index, mask=mask)
+
+
+# 入力ファイルから結合済みデータ（dataset_path に保存）を用意し、
+# 種別・災害種別×対応状況ごとに分割した空間インデックスを持つデータセットを作る関数。
+# アプリ（hinanjo_app.py）・API（shelter_api.py）・共有データセットの公開（shared_dataset.py）で共通に使う
+def build_shelter_dataset(shelter_path, hazard_path, dataset_path):
+    from build_dataset import ensure_merged_dataset
+
+    return ShelterDataset.from_frame(
+        ensure_merged_dataset(shelter_path, hazard_path, dataset_path),
+        partition_columns=PARTITION_COLUMNS,
+        partition_values=HAZARD_STATUSES
+    )
+
+
+# 共通IDごとの行の組み合わせを表すハッシュ値を返す関数（戻り値は {共通ID: ハッシュ値} の Series）。
+# 同じ共通IDの行が複数ある場合もあるため、行の並び順によらない組み合わせのハッシュ値にする
+def _key_signatures(keys, hashes):
+    codes, uniques = pd.factorize(keys)
+    sums = np.zeros(len(uniques), dtype=np.uint64)
+    np.add.at(sums, codes, hashes)
+    counts = np.bincount(codes, minlength=len(uniques)).astype(np.uint64)
+    return pd.Series(sums ^ (counts * np.uint64(0x9E3779B97F4A7C15)), index=uniques)
+
+
+# データセットと新しい DataFrame を共通IDで比べ、(削除する行位置, 追加する df の行の真偽値配列, df の行のハッシュ値) を返す関数。
+# 共通IDの行が追加・削除・変更された場合は、その共通IDの行をすべて削除して追加し直す
+def find_changes(dataset, df):
+    hashes = row_hashes(df)
+    alive = np.flatnonzero(dataset.hashes != 0)
+    old_keys = np.asarray(dataset.store.take_column(KEY_COLUMN, alive))
+    new_keys = df[KEY_COLUMN].fillna('').astype(str).to_numpy(dtype=object)
+
+    old = _key_signatures(old_keys, dataset.hashes[alive])
+    new = _key_signatures(new_keys, hashes)
+    common = old.index.intersection(new.index)
+    changed = old.index.difference(new.index).union(new.index.difference(old.index))
+    changed = changed.union(common[old[common].to_numpy() != new[common].to_numpy()])
+
+    removed = alive[pd.Index(old_keys).isin(changed)]
+    added = pd.Index(new_keys).isin(changed)
+    return removed, added, hashes
+
+
+# 新しい DataFrame を反映したデータセットと、変更内容 (削除した行位置, 追加した行位置) を返す関数。
+# 変更がなければ元のデータセットをそのまま返す。行ごとのハッシュ値を持たないデータセットや、
+# 削除済みの行が MAX_REMOVED_RATIO を超える場合は作り直し、変更内容は None を返す。
+def update_dataset(dataset, df, max_removed_ratio=MAX_REMOVED_RATIO):
+    if dataset.hashes is None:
+        columns, values = dataset.partition_spec()
+        return ShelterDataset.from_frame(df, columns, values), None
+
+    removed, added, hashes = find_changes(dataset, df)
+    if len(removed) == 0 and not added.any():
+        return dataset, (removed, np.empty(0, dtype=np.intp))
+
+    if dataset.removed_rows + len(removed) > max_removed_ratio * len(df):
+        columns, values = dataset.partition_spec()
+        return ShelterDataset.from_frame(df, columns, values), None
+
+    updated = dataset.apply_changes(removed, df[added], hashes[added])
+    return updated, (removed, np.arange(len(dataset), len(updated)))
+
+
+# 検索結果を query_cache.QueryCache にキャッシュしながら最も近い避難所を返す関数。
+# キーは (データセットのバージョン, 丸めた緯度経度, 絞込み条件, 件数) で、
+# 同じキーの検索は丸めた緯度経度で計算した結果を共有する。
+# cell_cache（cell_cache.CellCandidateCache）を渡すと、キャッシュにない検索はセルごとの候補から行う。
+def find_nearest_cached(dataset, cache, lat, lon, filter_column=None, filter_value=None, top_n=5, cell_cache=None):
+    lat = round(lat, QUERY_PRECISION)
+    lon = round(lon, QUERY_PRECISION)
+    key = (dataset.version, lat, lon, filter_column, filter_value, top_n)
+
+    result = cache.get(key)
+    if result is None:
+        if cell_cache is None:
+            result = dataset.find_nearest(lat, lon, filter_column=filter_column, filter_value=filter_value, top_n=top_n)
+        else:
+            # 地点を含むセルの候補から検索する（結果は dataset.find_nearest と同じ）
+            result = cell_cache.find_nearest(dataset, lat, lon, filter_column=filter_column,
+                                             filter_value=filter_value, top_n=top_n)
+        cache.put(key, result)
+
+    # キャッシュ上の結果を呼び出し側で変更されないようにコピーを返す
+    return result.copy()
+
+
+# データセットの更新後、結果が変わらない検索キャッシュのエントリーを新しいバージョンのキーに移し、
+# 結果が変わりうるエントリーを捨てる関数。次の場合に結果が変わりうるとみなす。
+# - 結果の避難所が削除・変更された
+# - 追加・変更された避難所のうち絞込み条件に一致するものが、結果の最も遠い避難所より近くにある
+#   （結果が top_n 件に満たない場合は、条件に一致するものがあれば）
+# changes が None（作り直した場合）は、変更前のバージョンのエントリーをすべて捨てる。
+def carry_over_query_cache(cache, old_dataset, new_dataset, changes):
+    entries = [(key, result) for key, result in cache.items() if key[0] == old_dataset.version]
+    if changes is None:
+        cache.rekey({key: None for key, _ in entries})
+        return
+
+    removed, added = changes
+    store = new_dataset.store
+    added_lats = np.asarray(store['緯度'])[added]
+    added_lons = np.asarray(store['経度'])[added]
+    matches = {}
+
+    mapping = {}
+    for key, result in entries:
+        _, lat, lon, filter_column, filter_value, top_n = key
+        affected = bool(np.isin(result.index, removed).any())
+        if not affected and len(added):
+            condition = (filter_column, filter_value)
+            if condition not in matches:
+                matched = np.isfinite(added_lats) & np.isfinite(added_lons)
+                if filter_column and filter_value:
+                    matched &= np.asarray(store.take_column(filter_column, added)) == filter_value
+                matches[condition] = matched
+            matched = matches[condition]
+            if matched.any():
+                if len(result) < top_n:
+                    affected = True
+                else:
+                    # haversine と geodesic の誤差を見込み、少しでも入りうるものは影響ありとする
+                    limit_km = float(result[DISTANCE_COLUMN].max()) * (1 + HAVERSINE_REL_TOL)
+                    affected = bool(haversine_km(lat, lon, added_lats[matched], added_lons[matched]).min() <= limit_km)
+        mapping[key] = None if affected else (new_dataset.version,) + key[1:]
+
+    cache.rekey(mapping)
@@ -0,0 +1,340 @@
+import math
+
+import numpy as np
+
+from shelter_search import EARTH_RADIUS_KM, HAVERSINE_REL_TOL, haversine_km
+
+# 1セルあたりの平均的な避難所数の目安（セルの大きさの自動決定に使う）
+POINTS_PER_CELL = 8
+
+# セルの大きさ(度)の下限・上限
+MIN_CELL_DEG = 0.005
+MAX_CELL_DEG = 1.0
+
+# 探索するセル数が空でないセル数のこの倍数を超えたら、全件走査に切り替える
+FULL_SCAN_FACTOR = 4
+
+
+# セルの行・列から一意なキーを作る関数
+def _cell_key(rows, cols):
+    return np.asarray(rows, dtype=np.int64) * (1 << 32) + (np.asarray(cols, dtype=np.int64) + (1 << 31))
+
+
+# データの広がりと件数からセルの大きさ(度)を決める関数
+def _auto_cell_deg(lats, lons):
+    if len(lats) == 0:
+        return MAX_CELL_DEG
+    lat_span = max(float(np.ptp(lats)), MIN_CELL_DEG)
+    lon_span = max(float(np.ptp(lons)), MIN_CELL_DEG)
+    cell_deg = math.sqrt(lat_span * lon_span * POINTS_PER_CELL / len(lats))
+    return min(max(cell_deg, MIN_CELL_DEG), MAX_CELL_DEG)
+
+
+# 緯度経度の格子(グリッド)で避難所をまとめた空間インデックス。
+# 近いセルから順に探すため、全件を走査せずに上位N件・半径内の避難所を求められる。
+# 日付変更線(経度±180度)をまたぐデータは想定していない。
+class GridIndex:
+    def __init__(self, lats, lons, cell_deg=None):
+        lats = np.asarray(lats, dtype=float)
+        lons = np.asarray(lons, dtype=float)
+        valid = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+
+        self.size = len(lats)
+        self.cell_deg = cell_deg or _auto_cell_deg(lats[valid], lons[valid])
+
+        rows = np.floor(lats[valid] / self.cell_deg).astype(np.int64)
+        cols = np.floor(lons[valid] / self.cell_deg).astype(np.int64)
+        keys = _cell_key(rows, cols)
+        order = np.argsort(keys, kind='stable')
+
+        # セル順に並べ替えた避難所の元の行位置と座標
+        self._positions = valid[order]
+        self._lats = lats[self._positions]
+        self._lons = lons[self._positions]
+
+        # 空でないセルのキーと、各セルに属する避難所の範囲
+        self._keys, self._starts = np.unique(keys[order], return_index=True)
+        self._ends = np.append(self._starts[1:], len(order))
+
+        self._row_range = self._col_range = None
+        if len(valid):
+            self._row_range = (int(rows.min()), int(rows.max()))
+            self._col_range = (int(cols.min()), int(cols.max()))
+
+    # ファイルや共有メモリに書き出すためのメタデータと配列を返す
+    def to_arrays(self):
+        meta = {
+            'size': self.size,
+            'cell_deg': self.cell_deg,
+            'row_range': self._row_range,
+            'col_range': self._col_range,
+        }
+        arrays = {
+            'positions': self._positions,
+            'lats': self._lats,
+            'lons': self._lons,
+            'keys': self._keys,
+            'starts': self._starts,
+            'ends': self._ends,
+        }
+        return meta, arrays
+
+    # to_arrays の結果からインデックスを復元する（配列はコピーせずにそのまま使う）
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        index = cls.__new__(cls)
+        index.size = meta['size']
+        index.cell_deg = meta['cell_deg']
+        index._row_range = tuple(meta['row_range']) if meta['row_range'] else None
+        index._col_range = tuple(meta['col_range']) if meta['col_range'] else None
+        index._positions = arrays['positions']
+        index._lats = arrays['lats']
+        index._lons = arrays['lons']
+        index._keys = arrays['keys']
+        index._starts = arrays['starts']
+        index._ends = arrays['ends']
+        return index
+
+    # 行位置 removed を取り除き、added を追加したインデックスを返す（元のインデックスは変更しない）。
+    # lats / lons は追加後の全行の座標。セルの大きさは変えず、セル順に並んだ配列に差し込むため、
+    # 全体を並べ替え直すより速い。
+    def updated(self, removed, added, lats, lons):
+        keep = ~np.isin(self._positions, removed)
+        keys = np.repeat(self._keys, self._ends - self._starts)[keep]
+        positions = self._positions[keep]
+
+        added = np.asarray(added, dtype=np.intp)
+        added_lats = np.asarray(lats, dtype=float)[added]
+        added_lons = np.asarray(lons, dtype=float)[added]
+        valid = np.isfinite(added_lats) & np.isfinite(added_lons)
+        added, added_lats, added_lons = added[valid], added_lats[valid], added_lons[valid]
+        added_keys = _cell_key(
+            np.floor(added_lats / self.cell_deg).astype(np.int64), np.floor(added_lons / self.cell_deg).astype(np.int64)
+        )
+        order = np.argsort(added_keys, kind='stable')
+        insert_at = np.searchsorted(keys, added_keys[order], side='right')
+
+        index = GridIndex.__new__(GridIndex)
+        index.size = len(lats)
+        index.cell_deg = self.cell_deg
+        index._positions = np.insert(positions, insert_at, added[order])
+        index._lats = np.insert(self._lats[keep], insert_at, added_lats[order])
+        index._lons = np.insert(self._lons[keep], insert_at, added_lons[order])
+
+        keys = np.insert(keys, insert_at, added_keys[order])
+        index._starts = np.flatnonzero(np.diff(keys, prepend=keys[:1] - 1)) if len(keys) else np.empty(0, dtype=np.intp)
+        index._keys = keys[index._starts]
+        index._ends = np.append(index._starts[1:], len(keys))
+
+        index._row_range = index._col_range = None
+        if len(keys):
+            rows = index._keys >> 32
+            cols = (index._keys & 0xFFFFFFFF) - (1 << 31)
+            index._row_range = (int(rows.min()), int(rows.max()))
+            index._col_range = (int(cols.min()), int(cols.max()))
+        return index
+
+    # 指定したセル群に属する避難所の(並べ替え後の)位置を返す
+    def _slots_in_cells(self, rows, cols):
+        keys = _cell_key(rows, cols)
+        found = np.searchsorted(self._keys, keys)
+        in_range = found < len(self._keys)
+        found, keys = found[in_range], keys[in_range]
+        found = found[self._keys[found] == keys]
+
+        starts = self._starts[found]
+        lengths = self._ends[found] - starts
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+    # 中心セルから ring 番目の外周にあるセルの行・列を返す
+    @staticmethod
+    def _ring_cells(row, col, ring):
+        if ring == 0:
+            return np.array([row]), np.array([col])
+        span = np.arange(-ring, ring + 1)
+        side = np.arange(-ring + 1, ring)
+        rows = np.concatenate([np.full(len(span), row - ring), np.full(len(span), row + ring), row + side, row + side])
+        cols = np.concatenate([col + span, col + span, np.full(len(side), col - ring), np.full(len(side), col + ring)])
+        return rows, cols
+
+    # ring 番目の外周まで探したとき、取りこぼしがないと保証できる半径(km)を返す
+    def _covered_km(self, lat, lon, row, col, ring):
+        lat_margin = min(lat - (row - ring) * self.cell_deg, (row + ring + 1) * self.cell_deg - lat)
+        lon_margin = min(lon - (col - ring) * self.cell_deg, (col + ring + 1) * self.cell_deg - lon)
+
+        # 経度方向は子午線までの大円距離で評価する
+        lat_km = EARTH_RADIUS_KM * math.radians(lat_margin)
+        lon_km = EARTH_RADIUS_KM * math.asin(
+            min(1.0, math.cos(math.radians(lat)) * math.sin(math.radians(min(lon_margin, 90.0))))
+        )
+        return min(lat_km, lon_km)
+
+    # データ全体を覆うのに必要な外周の数を返す
+    def _max_ring(self, row, col):
+        return max(
+            abs(row - self._row_range[0]), abs(row - self._row_range[1]),
+            abs(col - self._col_range[0]), abs(col - self._col_range[1]),
+        )
+
+    # 全件を走査する（セルがまばらで外周探索が割に合わない場合）
+    def _all_slots(self, lat, lon, mask):
+        slots = np.arange(len(self._positions))
+        if mask is not None:
+            slots = slots[mask[self._positions]]
+        return slots, haversine_km(lat, lon, self._lats[slots], self._lons[slots])
+
+    # 上位 top_n 件の候補となる避難所の行位置を返す。
+    # 候補の範囲は shelter_search.select_candidates と同じ（haversine の誤差を見込んだ範囲）。
+    def nearest_candidates(self, lat, lon, top_n, mask=None):
+        if top_n <= 0 or len(self._positions) == 0:
+            return np.empty(0, dtype=np.intp)
+
+        row = math.floor(lat / self.cell_deg)
+        col = math.floor(lon / self.cell_deg)
+        max_ring = self._max_ring(row, col)
+        full_scan_cells = FULL_SCAN_FACTOR * len(self._keys)
+
+        slot_parts = []
+        dist_parts = []
+        count = 0
+        limit = math.inf
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > full_scan_cells:
+                slots, dists = self._all_slots(lat, lon, mask)
+                slot_parts, dist_parts = [slots], [dists]
+                count = len(slots)
+                if count > top_n:
+                    limit = np.partition(dists, top_n - 1)[top_n - 1] * (1 + HAVERSINE_REL_TOL) / (1 - HAVERSINE_REL_TOL)
+                break
+
+            slots = self._slots_in_cells(*self._ring_cells(row, col, ring))
+            if mask is not None:
+                slots = slots[mask[self._positions[slots]]]
+            if len(slots):
+                slot_parts.append(slots)
+                dist_parts.append(haversine_km(lat, lon, self._lats[slots], self._lons[slots]))
+                count += len(slots)
+
+            if count >= top_n:
+                dists = np.concatenate(dist_parts)
+                kth = np.partition(dists, top_n - 1)[top_n - 1]
+                limit = kth * (1 + HAVERSINE_REL_TOL) / (1 - HAVERSINE_REL_TOL)
+                if limit <= self._covered_km(lat, lon, row, col, ring):
+                    break
+            if ring >= max_ring:
+                break
+            ring += 1
+
+        if not slot_parts:
+            return np.empty(0, dtype=np.intp)
+        slots = np.concatenate(slot_parts)
+        dists = np.concatenate(dist_parts)
+        return np.sort(self._positions[slots[dists <= limit]])
+
+    # 半径 radius_km 以内（haversine 距離）の避難所の行位置と距離(km)を返す
+    def within_radius(self, lat, lon, radius_km, mask=None):
+        if len(self._positions) == 0:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=float)
+
+        row = math.floor(lat / self.cell_deg)
+        col = math.floor(lon / self.cell_deg)
+        max_ring = self._max_ring(row, col)
+
+        ring = 0
+        while ring < max_ring and self._covered_km(lat, lon, row, col, ring) < radius_km:
+            ring += 1
+
+        if (2 * ring + 1) ** 2 > FULL_SCAN_FACTOR * len(self._keys):
+            slots, dists = self._all_slots(lat, lon, mask)
+        else:
+            offsets = np.arange(-ring, ring + 1)
+            rows, cols = np.meshgrid(row + offsets, col + offsets, indexing='ij')
+            slots = self._slots_in_cells(rows.ravel(), cols.ravel())
+            if mask is not None:
+                slots = slots[mask[self._positions[slots]]]
+            dists = haversine_km(lat, lon, self._lats[slots], self._lons[slots])
+
+        inside = dists <= radius_km
+        positions = self._positions[slots[inside]]
+        order = np.argsort(positions)
+        return positions[order], dists[inside][order]
+
+
+    # 複数の地点それぞれについて、半径 radius_km 以内（haversine 距離）で最も近い点の行位置と距離(km)を返す。
+    # 半径内に点がない・座標が欠損している地点は (-1, inf)。距離が同じ場合は行位置の小さい点を選ぶ。
+    # 半径を覆うセルの範囲を地点によらず同じにし、セルの位置ごとに全地点をまとめて計算する。
+    def nearest_within(self, lats, lons, radius_km):
+        lats = np.atleast_1d(np.asarray(lats, dtype=float))
+        lons = np.atleast_1d(np.asarray(lons, dtype=float))
+        nearest = np.full(len(lats), -1, dtype=np.intp)
+        best_km = np.full(len(lats), np.inf)
+        points = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+        if len(self._positions) == 0 or len(points) == 0:
+            return nearest, best_km
+
+        # 半径を緯度・経度の幅(度)にし、地点のセルから何セル先まで探すかを決める
+        lat_deg = math.degrees(radius_km / EARTH_RADIUS_KM)
+        max_lat = min(float(np.abs(lats[points]).max()) + lat_deg, 89.9)
+        lon_deg = min(lat_deg / math.cos(math.radians(max_lat)), 180.0)
+        row_span = math.ceil(lat_deg / self.cell_deg)
+        col_span = math.ceil(lon_deg / self.cell_deg)
+        if (2 * row_span + 1) * (2 * col_span + 1) > FULL_SCAN_FACTOR * len(self._keys):
+            for i in points:
+                positions, dists = self.within_radius(lats[i], lons[i], radius_km)
+                if len(positions):
+                    best = int(np.argmin(dists))
+                    nearest[i], best_km[i] = positions[best], dists[best]
+            return nearest, best_km
+
+        point_lats, point_lons = lats[points], lons[points]
+        rows = np.floor(point_lats / self.cell_deg).astype(np.int64)
+        cols = np.floor(point_lons / self.cell_deg).astype(np.int64)
+        for row_offset in range(-row_span, row_span + 1):
+            for col_offset in range(-col_span, col_span + 1):
+                keys = _cell_key(rows + row_offset, cols + col_offset)
+                found = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+                owners = np.flatnonzero(self._keys[found] == keys)
+                if len(owners) == 0:
+                    continue
+                starts = self._starts[found[owners]]
+                lengths = self._ends[found[owners]] - starts
+                groups = np.cumsum(lengths) - lengths
+                slots = np.repeat(starts - groups, lengths) + np.arange(lengths.sum())
+                dists = haversine_km(np.repeat(point_lats[owners], lengths), np.repeat(point_lons[owners], lengths),
+                                     self._lats[slots], self._lons[slots])
+
+                # 地点ごとに（点は地点の順に並んでいる）、このセルで最も近い点を選んでこれまでの最良と比べる
+                closest = np.minimum.reduceat(dists, groups)
+                positions = np.where(dists == np.repeat(closest, lengths), self._positions[slots], np.iinfo(np.intp).max)
+                owners, dists, positions = points[owners], closest, np.minimum.reduceat(positions, groups)
+                better = (dists <= radius_km) & (
+                    (dists < best_km[owners]) | ((dists == best_km[owners]) & (positions < nearest[owners]))
+                )
+                nearest[owners[better]] = positions[better]
+                best_km[owners[better]] = dists[better]
+        return nearest, best_km
+
+# 避難所の DataFrame から空間インデックスを構築する関数。
+# mask を渡すと True の行だけを登録する（行位置は元の DataFrame のまま）。
+def build_index(df, mask=None, cell_deg=None):
+    lats = np.asarray(df['緯度'], dtype=float)
+    lons = np.asarray(df['経度'], dtype=float)
+    if mask is not None:
+        excluded = ~np.asarray(mask, dtype=bool)
+        lats = np.where(excluded, np.nan, lats)
+        lons = np.where(excluded, np.nan, lons)
+    return GridIndex(lats, lons, cell_deg=cell_deg)
+
+
+# 列と値の組み合わせごとに分割した空間インデックスを構築する関数。
+# 戻り値は {(列名, 値): GridIndex} で、該当する行がない組み合わせも空のインデックスとして含む。
+def build_partitioned_index(df, columns, values, cell_deg=None):
+    partitions = {}
+    for column in columns:
+        if column not in df.columns:
+            continue
+        column_values = np.asarray(df[column])
+        for value in values:
+            partitions[(column, value)] = build_index(df, mask=column_values == value, cell_deg=cell_deg)
+    return partitions
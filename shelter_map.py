@@ -0,0 +1,202 @@
+import html
+import json
+from collections import OrderedDict
+
+import folium
+import numpy as np
+
+import metrics
+from branca.element import Element
+from folium.plugins import MarkerCluster
+from folium.template import Template
+
+from shelter_search import DISTANCE_COLUMN
+
+# 地図のタイル（Googleマップ）
+TILES_URL = "https://mt1.google.com/vt/lyrs=m&x={x}&y={y}&z={z}"
+TILES_ATTR = "Google Maps"
+
+# ダウンロードする地図のファイル名
+MAP_FILE_NAME = "nearest_shelters_map.html"
+
+# 1セッションで使い回す地図の数
+MAP_CACHE_SIZE = 8
+
+# 全避難所の表示で使う、対応状況ごとの色（対応状況が無い・不明な場合は UNKNOWN_STATUS_COLOR）
+STATUS_COLORS = {'O': '#2e7d32', 'A': '#f9a825', 'X': '#c62828'}
+UNKNOWN_STATUS_COLOR = '#757575'
+
+
+# 距離に応じたマーカーの色を返す関数
+def marker_color(distance_km):
+    if distance_km < 0.5:
+        return "darkgreen"
+    elif distance_km < 1.0:
+        return "darkblue"
+    return "lightgray"
+
+
+# 全避難所の表示に使うデータ。
+# 避難所の座標・名前・対応状況を JSON の文字列にしたもので、データセットのバージョンごとに1回だけ作る。
+# 地図に載せるときはこの文字列をそのまま埋め込むだけなので、件数が多くても地図の生成は速い。
+class OverviewData:
+    def __init__(self, key, data_json, labels, count):
+        self.key = key              # 地図のキャッシュに使うキー（バージョン, 色分けに使う列）
+        self.data_json = data_json  # [[緯度, 経度, 名前, 対応状況の番号], ...]（番号 -1 は不明）
+        self.labels = labels        # 対応状況の番号 -> 表示名
+        self.count = count
+
+    # status_column を指定すると、その列（df2_津波 など）の対応状況で色分けする
+    @classmethod
+    def from_dataset(cls, dataset, status_column=None):
+        store = dataset.store
+        lats = np.asarray(store['緯度'], dtype=float)
+        lons = np.asarray(store['経度'], dtype=float)
+        names = store['施設・場所名']
+
+        if status_column is None:
+            labels = []
+            statuses = np.full(len(store), -1)
+        else:
+            status = store[status_column]
+            labels = [str(category) for category in status.categories]
+            statuses = status.codes
+
+        valid = np.flatnonzero(np.isfinite(lats) & np.isfinite(lons))
+        rows = [
+            [round(float(lats[i]), 6), round(float(lons[i]), 6), html.escape(str(names[i])), int(statuses[i])]
+            for i in valid
+        ]
+        data_json = json.dumps(rows, ensure_ascii=False, separators=(',', ':'))
+        return cls((dataset.version, status_column), data_json, labels, len(rows))
+
+
+# 文字列をそのまま出力する要素。
+# branca は描画したスクリプトを Jinja のテンプレートとして組み立て直すため、
+# 大きな JSON を通常の要素に埋め込むと、その解析だけで地図の生成が遅くなる。
+class _RawScript(Element):
+    def __init__(self, code):
+        super().__init__()
+        self.code = code
+
+    def render(self, **kwargs):
+        return self.code
+
+
+# 全避難所を対応状況ごとに色分けした点で表示し、ブラウザ側でクラスタリングするレイヤー。
+# folium.Marker を1件ずつ追加する代わりに、JSON をまとめて渡して Leaflet.markercluster に一括で登録する。
+class OverviewLayer(MarkerCluster):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function(){
+                var data = {{ this.get_name() }}_data;
+                var labels = {{ this.overview.labels|tojson }};
+                var colors = {{ this.colors|tojson }};
+                var cluster = L.markerClusterGroup({{ this.options|tojavascript }});
+                var markers = new Array(data.length);
+                for (var i = 0; i < data.length; i++) {
+                    var row = data[i];
+                    var color = row[3] >= 0 ? colors[row[3]] : {{ this.unknown_color|tojson }};
+                    var label = row[3] >= 0 ? row[2] + "（" + labels[row[3]] + "）" : row[2];
+                    markers[i] = L.circleMarker([row[0], row[1]], {
+                        radius: 6, color: color, weight: 1, fillColor: color, fillOpacity: 0.8
+                    }).bindTooltip(label);
+                }
+                cluster.addLayers(markers);
+                cluster.addTo({{ this._parent.get_name() }});
+                return cluster;
+            })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, overview, name="全避難所"):
+        super().__init__(name=name, chunked_loading=True)
+        self._name = "OverviewLayer"
+        self.overview = overview
+        self.colors = [STATUS_COLORS.get(label, UNKNOWN_STATUS_COLOR) for label in overview.labels]
+        self.unknown_color = UNKNOWN_STATUS_COLOR
+
+    def render(self, **kwargs):
+        # データはレイヤーのスクリプトより先に、テンプレートを通さずに書き出す
+        self.get_root().script.add_child(
+            _RawScript(f"var {self.get_name()}_data = {self.overview.data_json};"),
+            name=self.get_name() + "_data",
+        )
+        super().render(**kwargs)
+
+
+# 地図を生成する関数（overview を渡すと全避難所のレイヤーを重ねる）
+def plot_on_map(current_lat, current_lon, nearest_shelters, overview=None):
+    with metrics.span("plot_on_map", overview=overview is not None):
+        return _plot_on_map(current_lat, current_lon, nearest_shelters, overview)
+
+
+def _plot_on_map(current_lat, current_lon, nearest_shelters, overview):
+    m = folium.Map(location=[current_lat, current_lon], zoom_start=14, tiles=TILES_URL, attr=TILES_ATTR)
+
+    if overview is not None:
+        OverviewLayer(overview).add_to(m)
+
+    # 現在位置を赤いマーカーで表示
+    folium.Marker(
+        location=[current_lat, current_lon],
+        popup=folium.Popup("<b>現在位置</b>", max_width=300),
+        icon=folium.Icon(color="red", icon="home")
+    ).add_to(m)
+
+    # 避難所をマーカーで表示
+    for _, row in nearest_shelters.iterrows():
+        distance_km = row[DISTANCE_COLUMN]
+        popup_content = f"<b>{row['施設・場所名']}</b><br>距離: {distance_km:.1f} km<br>"
+        folium.Marker(
+            location=[row['緯度'], row['経度']],
+            popup=folium.Popup(popup_content, max_width=300),
+            icon=folium.Icon(color=marker_color(distance_km), icon="info-sign")
+        ).add_to(m)
+
+    return m
+
+
+# 地図の内容を決めるキー（現在位置と、表示する避難所のIDと位置、全避難所のレイヤー）を返す関数
+def map_key(current_lat, current_lon, nearest_shelters, overview=None):
+    id_column = '共通ID' if '共通ID' in nearest_shelters.columns else '施設・場所名'
+    shelters = tuple(zip(
+        nearest_shelters[id_column],
+        nearest_shelters['施設・場所名'],
+        nearest_shelters['緯度'],
+        nearest_shelters['経度'],
+    ))
+    return (current_lat, current_lon, shelters, None if overview is None else overview.key)
+
+
+# 同じ現在位置・同じ検索結果の地図は作り直さずに使い回す関数。
+# cache にはセッションごとの辞書（st.session_state の値など）を渡し、セッション間で地図を共有しない。
+def cached_map(cache, current_lat, current_lon, nearest_shelters, overview=None, max_entries=MAP_CACHE_SIZE):
+    key = map_key(current_lat, current_lon, nearest_shelters, overview)
+    map_object = cache.get(key)
+    if map_object is None:
+        metrics.count("map", "miss")
+        map_object = plot_on_map(current_lat, current_lon, nearest_shelters, overview)
+        cache[key] = map_object
+    else:
+        metrics.count("map", "hit")
+    cache.move_to_end(key)
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+    return map_object
+
+
+# セッションごとの地図キャッシュを返す関数
+def session_map_cache(session_state, name="map_cache"):
+    if name not in session_state:
+        session_state[name] = OrderedDict()
+    return session_state[name]
+
+
+# 地図のHTMLをメモリ上で生成する関数（ファイルには書き出さない）。
+# ダウンロードボタンが押されたときだけ呼ばれるよう、st.download_button の data に
+# lambda で渡して使う。表示中の地図オブジェクトとは別に作るため、他の処理と干渉しない。
+def map_html(current_lat, current_lon, nearest_shelters, overview=None):
+    map_object = plot_on_map(current_lat, current_lon, nearest_shelters, overview)
+    with metrics.span("map_html"):
+        return map_object.get_root().render().encode("utf-8")
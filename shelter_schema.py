@@ -0,0 +1,23 @@
+# 避難所データの列名・値の定義。
+# pandas などを読み込まずに参照できるよう、build_dataset.py から分けている
+# （build_dataset.py からも同じ名前で参照できる）。
+
+# 結合のキー
+KEY_COLUMN = '共通ID'
+
+# 避難所一覧(DF1)と災害別対応状況(DF2)で必要な列
+SHELTER_COLUMNS = ['施設・場所名', '住所', '緯度', '経度', KEY_COLUMN]
+HAZARD_COLUMNS = ['df2_地震', 'df2_津波', 'df2_高潮', 'df2_洪水', 'df2_土砂']
+
+# 災害別対応状況(DF2)の標高(m)の列（ない場合は欠損として扱う）
+ELEVATION_COLUMN = 'df2_z'
+
+# 対応状況の値（カテゴリ型のカテゴリ）
+HAZARD_STATUSES = ['O', 'A', 'X']
+
+# 元データに混じっている表記ゆれ（全角記号など）の読み替え
+STATUS_ALIASES = {'〇': 'O', '○': 'O', '×': 'X'}
+
+# 避難所の種別の列と、その種別から除外する共通IDの最後から2文字目。
+# 値は対象の避難所なら O、対象外なら X（対応状況と同じカテゴリ型）
+SHELTER_TYPE_COLUMNS = {'指定避難所': '2', '福祉避難所': '1'}
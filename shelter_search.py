@@ -0,0 +1,180 @@
+import numpy as np
+
+import metrics
+
+# 距離の列名（各アプリの表示・地図描画と共通）
+DISTANCE_COLUMN = '距離(km)'
+
+# haversine で使う地球の平均半径(km)
+EARTH_RADIUS_KM = 6371.0088
+
+# 球面(haversine)距離と楕円体(geodesic)距離の相対誤差の上限。
+# 球面近似の誤差は最大でも約0.56%なので、余裕を見て1%とする。
+# 上位N件目の haversine 距離にこの誤差を見込んだ範囲までを候補とし、
+# 候補のみ geodesic で再計算して並べ替えるため、
+# 並び順・距離(km)ともに全行を geodesic で計算した場合と一致する。
+HAVERSINE_REL_TOL = 0.01
+
+
+# 1地点から複数地点への haversine 距離(km)をまとめて計算する関数
+def haversine_km(lat, lon, lats, lons):
+    lat1 = np.radians(lat)
+    lon1 = np.radians(lon)
+    lat2 = np.radians(np.asarray(lats, dtype=float))
+    lon2 = np.radians(np.asarray(lons, dtype=float))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+# 1地点から複数地点への geodesic 距離(km)を計算する関数（候補の再計算用）
+def geodesic_km(lat, lon, lats, lons):
+    # geopy は起動を速くするため、初めて距離を計算するときに読み込む
+    from geopy.distance import geodesic
+
+    return np.array([geodesic((lat, lon), (la, lo)).km for la, lo in zip(lats, lons)], dtype=float)
+
+
+# WGS84 楕円体の長半径(km)と扁平率（geopy の geodesic と同じ）
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+
+# Vincenty 法の反復回数の上限と収束判定
+VINCENTY_MAX_ITER = 200
+VINCENTY_TOL = 1e-12
+
+
+# 複数の2地点間の楕円体距離(km)を Vincenty 法でまとめて計算する関数。
+# geopy の geodesic（Karney 法）との差は 1mm 未満で、大量の組み合わせを一括で計算する用途に使う。
+# 収束しない組（ほぼ地球の裏側同士）だけは geopy で計算する。
+def vincenty_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(value, dtype=float)) for value in (lat1, lon1, lat2, lon2))
+    )
+    a = WGS84_A_KM
+    f = WGS84_F
+    b = (1 - f) * a
+
+    u1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+    big_l = np.radians(lon2 - lon1)
+
+    lam = big_l.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(VINCENTY_MAX_ITER):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = big_l + (1 - c) * f * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) < VINCENTY_TOL
+            if converged.all():
+                break
+
+        u_sq = cos2_alpha * (a ** 2 - b ** 2) / b ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        distances = b * big_a * (sigma - delta_sigma)
+
+    retry = ~converged & np.isfinite(lat1) & np.isfinite(lon1) & np.isfinite(lat2) & np.isfinite(lon2)
+    for i in map(tuple, np.argwhere(retry)):
+        distances[i] = geodesic_km(lat1[i], lon1[i], [lat2[i]], [lon2[i]])[0]
+    return distances
+
+
+# haversine 距離から geodesic で再計算すべき候補の位置を返す関数
+def select_candidates(approx_km, top_n):
+    approx_km = np.asarray(approx_km, dtype=float)
+    valid = np.flatnonzero(np.isfinite(approx_km))
+    if top_n <= 0 or len(valid) == 0:
+        return np.empty(0, dtype=np.intp)
+    if len(valid) <= top_n:
+        return valid
+
+    kth = np.partition(approx_km[valid], top_n - 1)[top_n - 1]
+    limit = kth * (1 + HAVERSINE_REL_TOL) / (1 - HAVERSINE_REL_TOL)
+    return valid[approx_km[valid] <= limit]
+
+
+# 最も近い避難所を上位N件返す関数（入力の DataFrame は変更しない）。
+# df には DataFrame のほか shelter_store.ShelterStore も渡せる。
+# index（shelter_index.GridIndex）を渡すと全件を走査せずに候補を絞り込む。
+# mask を渡すと True の行だけを対象にする。
+def find_nearest(df, lat, lon, top_n=5, index=None, mask=None):
+    lats = np.asarray(df['緯度'], dtype=float)
+    lons = np.asarray(df['経度'], dtype=float)
+
+    with metrics.span("candidates"):
+        if index is not None:
+            positions = index.nearest_candidates(lat, lon, top_n, mask=mask)
+        else:
+            approx_km = haversine_km(lat, lon, lats, lons)
+            if mask is not None:
+                approx_km[~np.asarray(mask, dtype=bool)] = np.inf
+            positions = select_candidates(approx_km, top_n)
+
+    return _rank_candidates(df, lat, lon, lats, lons, positions, top_n)
+
+
+# 候補の行位置（昇順）を geodesic 距離で並べ替え、上位N件を返す関数。
+# 並べ替えは距離の配列で行い（同じ距離なら行位置の順）、上位N件の行だけを取り出す
+def _rank_candidates(df, lat, lon, lats, lons, positions, top_n):
+    with metrics.span("geodesic", candidates=len(positions)):
+        distances = geodesic_km(lat, lon, lats[positions], lons[positions])
+
+    with metrics.span("sort"):
+        order = np.argsort(distances, kind='stable')[:top_n]
+        result = df.take(positions[order])
+        result[DISTANCE_COLUMN] = distances[order]
+        return result
+
+
+# 候補の行位置 positions（昇順）の中から、最も近い避難所を上位N件返す関数。
+# positions が find_nearest の候補をすべて含んでいれば、find_nearest と同じ結果になる
+# （cell_cache.CellCandidateCache が、セルごとに求めておいた候補から検索するときに使う）。
+def find_nearest_among(df, lat, lon, positions, top_n=5):
+    lats = np.asarray(df['緯度'], dtype=float)
+    lons = np.asarray(df['経度'], dtype=float)
+    positions = np.asarray(positions, dtype=np.intp)
+
+    with metrics.span("candidates"):
+        positions = positions[select_candidates(haversine_km(lat, lon, lats[positions], lons[positions]), top_n)]
+
+    return _rank_candidates(df, lat, lon, lats, lons, positions, top_n)
+
+
+# 半径 radius_km 以内（geodesic 距離）の避難所を近い順に返す関数
+def find_within(df, lat, lon, radius_km, index=None, mask=None):
+    lats = np.asarray(df['緯度'], dtype=float)
+    lons = np.asarray(df['経度'], dtype=float)
+
+    # haversine の誤差を見込んで少し広めに候補を集める
+    approx_radius_km = radius_km * (1 + HAVERSINE_REL_TOL)
+    if index is not None:
+        positions, _ = index.within_radius(lat, lon, approx_radius_km, mask=mask)
+    else:
+        approx_km = haversine_km(lat, lon, lats, lons)
+        if mask is not None:
+            approx_km[~np.asarray(mask, dtype=bool)] = np.inf
+        positions = np.flatnonzero(approx_km <= approx_radius_km)
+
+    distances = geodesic_km(lat, lon, lats[positions], lons[positions])
+    inside = distances <= radius_km
+
+    result = df.take(positions[inside])
+    result[DISTANCE_COLUMN] = distances[inside]
+    return result.sort_values(by=DISTANCE_COLUMN, kind='mergesort')
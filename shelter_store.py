@@ -0,0 +1,268 @@
+import numpy as np
+import pandas as pd
+
+# 固定長バイト列で持つキー列
+KEY_COLUMN = '共通ID'
+
+
+# 文字列の一覧を、重複を除いた UTF-8 のバッファ＋オフセットと、各行の参照番号で持つ表。
+# Python の str オブジェクトを行ごとに持つより大幅に小さい。
+class StringTable:
+    def __init__(self, codes, offsets, buffer):
+        self.codes = codes      # 各行の参照番号（-1 は欠損）。全行が一意で出現順なら None
+        self.offsets = offsets  # i 番目の文字列は buffer[offsets[i]:offsets[i + 1]]
+        self.buffer = buffer
+
+    @classmethod
+    def from_values(cls, values):
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        encoded = [str(value).encode('utf-8') for value in uniques]
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+        offset_dtype = np.int32 if len(buffer) < np.iinfo(np.int32).max else np.int64
+        offsets = np.zeros(len(encoded) + 1, dtype=offset_dtype)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+        # 施設名・住所のように全行が異なる列は参照番号を持たない
+        if len(uniques) == len(codes):
+            codes = None
+        else:
+            codes = codes.astype(np.int32)
+        return cls(codes, offsets, buffer)
+
+    def __len__(self):
+        return len(self.offsets) - 1 if self.codes is None else len(self.codes)
+
+    # removed の行を欠損にし、values の行を末尾に追加した表を返す（元の表は変更しない）。
+    # 削除した行の文字列はバッファに残る（データセットを作り直すときに詰める）
+    def updated(self, removed, values):
+        codes = np.arange(len(self), dtype=np.int32) if self.codes is None else self.codes
+        added = StringTable.from_values(values)
+        added_codes = np.arange(len(added), dtype=np.int32) if added.codes is None else added.codes
+        added_codes = np.where(added_codes >= 0, added_codes + (len(self.offsets) - 1), -1)
+
+        codes = np.concatenate([codes, added_codes]).astype(np.int32)
+        codes[np.asarray(removed, dtype=np.intp)] = -1
+
+        buffer = np.concatenate([self.buffer, added.buffer])
+        offsets = np.concatenate([self.offsets.astype(np.int64), added.offsets[1:].astype(np.int64) + int(self.offsets[-1])])
+        if len(buffer) < np.iinfo(np.int32).max:
+            offsets = offsets.astype(np.int32)
+        return StringTable(codes, offsets, buffer)
+
+    def to_arrays(self):
+        arrays = {'offsets': self.offsets, 'buffer': self.buffer}
+        if self.codes is not None:
+            arrays['codes'] = self.codes
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays.get('codes'), arrays['offsets'], arrays['buffer'])
+
+    @property
+    def nbytes(self):
+        codes_nbytes = 0 if self.codes is None else self.codes.nbytes
+        return codes_nbytes + self.offsets.nbytes + self.buffer.nbytes
+
+    def _decode(self, code):
+        if code < 0:
+            return None
+        return self.buffer[self.offsets[code]:self.offsets[code + 1]].tobytes().decode('utf-8')
+
+    # 指定した行の文字列を返す
+    def take(self, positions):
+        if self.codes is not None:
+            codes = self.codes[positions]
+        elif isinstance(positions, slice):
+            codes = np.arange(len(self))[positions]
+        else:
+            codes = np.asarray(positions)
+        return np.array([self._decode(code) for code in codes], dtype=object)
+
+
+# 避難所データを列ごとの型付き配列で持つストア。
+# - 数値列（緯度・経度など）: NumPy 配列のまま
+# - カテゴリ列（対応状況 O/A/X など）: int8 のコード行列（-1 は欠損）
+# - 共通ID: 固定長バイト列
+# - その他の文字列列（施設名・住所など）: StringTable
+# DataFrame と同じく store['緯度'] で列を取り出し、store.take(行位置) で DataFrame に戻せる。
+class ShelterStore:
+    def __init__(self, columns, numeric, strings, keys, categorical_columns, codes, categories, labels=None):
+        self.columns = list(columns)
+        self._numeric = numeric                          # 列名 -> NumPy 配列
+        self._strings = strings                          # 列名 -> StringTable
+        self._keys = keys                                # 列名 -> 固定長バイト列の配列
+        self._categorical_columns = list(categorical_columns)
+        self.codes = codes                               # (行数, カテゴリ列数) の int8 行列
+        self.categories = categories                     # 列名 -> カテゴリの一覧
+        self.labels = labels                             # 元の DataFrame の行ラベル（連番なら None）
+        # 取り出すたびにカテゴリの一覧を検証しないよう、列ごとの型を作っておく
+        self._dtypes = {column: pd.CategoricalDtype(categories[column]) for column in self._categorical_columns}
+
+    @classmethod
+    def from_frame(cls, df, key_column=KEY_COLUMN):
+        numeric = {}
+        strings = {}
+        keys = {}
+        categorical_columns = []
+        codes = []
+        categories = {}
+
+        for column in df.columns:
+            series = df[column]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                categorical_columns.append(column)
+                codes.append(series.cat.codes.to_numpy(dtype=np.int8))
+                categories[column] = list(series.cat.categories)
+            elif column == key_column:
+                keys[column] = np.array(
+                    [b'' if pd.isna(value) else str(value).encode('utf-8') for value in series], dtype=bytes
+                )
+            elif pd.api.types.is_numeric_dtype(series.dtype) and not pd.api.types.is_bool_dtype(series.dtype):
+                numeric[column] = series.to_numpy()
+            else:
+                strings[column] = StringTable.from_values(series.to_numpy(dtype=object))
+
+        code_matrix = np.column_stack(codes) if codes else np.empty((len(df), 0), dtype=np.int8)
+
+        labels = None
+        if not df.index.equals(pd.RangeIndex(len(df))):
+            labels = df.index.to_numpy()
+
+        return cls(df.columns, numeric, strings, keys, categorical_columns, code_matrix, categories, labels)
+
+    # removed の行を欠損にし、df の行を末尾に追加したストアを返す（元のストアは変更しない）。
+    # 削除した行も行位置を変えないよう残すため、既存の行位置（空間インデックス・検索結果の行番号）はそのまま使える。
+    # 数値列（座標）は NaN、カテゴリ列は欠損、キー列は空になるため、検索・絞込みの対象にならない。
+    def updated(self, removed, df):
+        missing_columns = [column for column in self.columns if column not in df.columns]
+        if missing_columns:
+            raise ValueError(f"追加する行に次の列が見つかりません: {missing_columns}")
+        removed = np.asarray(removed, dtype=np.intp)
+
+        numeric = {}
+        for column, array in self._numeric.items():
+            values = np.concatenate([array, df[column].to_numpy(dtype=array.dtype)])
+            if values.dtype.kind == 'f':
+                values[removed] = np.nan
+            numeric[column] = values
+
+        keys = {}
+        for column, array in self._keys.items():
+            added = np.array([b'' if pd.isna(value) else str(value).encode('utf-8') for value in df[column]], dtype=bytes)
+            values = np.concatenate([array, added])
+            values[removed] = b''
+            keys[column] = values
+
+        strings = {
+            column: table.updated(removed, df[column].to_numpy(dtype=object)) for column, table in self._strings.items()
+        }
+
+        added_codes = [
+            pd.Categorical(df[column], categories=self.categories[column]).codes.astype(np.int8)
+            for column in self._categorical_columns
+        ]
+        added_codes = np.column_stack(added_codes) if added_codes else np.empty((len(df), 0), dtype=np.int8)
+        codes = np.concatenate([self.codes, added_codes])
+        codes[removed] = -1
+
+        labels = self.labels
+        if labels is not None:
+            labels = np.concatenate([labels, np.arange(len(self), len(self) + len(df))])
+
+        return ShelterStore(
+            self.columns, numeric, strings, keys, self._categorical_columns, codes, self.categories, labels
+        )
+
+    def __len__(self):
+        return len(self.codes)
+
+    # ファイルや共有メモリに書き出すためのメタデータと配列を返す
+    def to_arrays(self):
+        meta = {
+            'columns': self.columns,
+            'numeric': list(self._numeric),
+            'strings': list(self._strings),
+            'keys': list(self._keys),
+            'categorical_columns': self._categorical_columns,
+            'categories': self.categories,
+            'has_labels': self.labels is not None,
+        }
+        arrays = {'codes': self.codes}
+        for i, column in enumerate(self._numeric):
+            arrays[f'numeric{i}'] = self._numeric[column]
+        for i, column in enumerate(self._keys):
+            arrays[f'keys{i}'] = self._keys[column]
+        for i, column in enumerate(self._strings):
+            for name, array in self._strings[column].to_arrays().items():
+                arrays[f'strings{i}.{name}'] = array
+        if self.labels is not None:
+            arrays['labels'] = self.labels
+        return meta, arrays
+
+    # to_arrays の結果からストアを復元する（配列はコピーせずにそのまま使う）
+    @classmethod
+    def from_arrays(cls, meta, arrays):
+        numeric = {column: arrays[f'numeric{i}'] for i, column in enumerate(meta['numeric'])}
+        keys = {column: arrays[f'keys{i}'] for i, column in enumerate(meta['keys'])}
+        strings = {}
+        for i, column in enumerate(meta['strings']):
+            prefix = f'strings{i}.'
+            strings[column] = StringTable.from_arrays(
+                {name[len(prefix):]: array for name, array in arrays.items() if name.startswith(prefix)}
+            )
+        return cls(
+            meta['columns'], numeric, strings, keys, meta['categorical_columns'], arrays['codes'],
+            meta['categories'], arrays['labels'] if meta['has_labels'] else None,
+        )
+
+    # 使用しているメモリ量(バイト)
+    @property
+    def nbytes(self):
+        total = self.codes.nbytes
+        total += sum(array.nbytes for array in self._numeric.values())
+        total += sum(table.nbytes for table in self._strings.values())
+        total += sum(array.nbytes for array in self._keys.values())
+        if self.labels is not None:
+            total += self.labels.nbytes
+        return total
+
+    def _column(self, column, positions):
+        if column in self._numeric:
+            return self._numeric[column][positions]
+        if column in self._strings:
+            return self._strings[column].take(positions)
+        if column in self._keys:
+            return np.array([value.decode('utf-8') for value in self._keys[column][positions]], dtype=object)
+        index = self._categorical_columns.index(column)
+        return pd.Categorical.from_codes(self.codes[positions, index], dtype=self._dtypes[column])
+
+    # 列全体を取り出す（数値列はコピーせずに返す）
+    def __getitem__(self, column):
+        if column not in self.columns:
+            raise KeyError(column)
+        if column in self._numeric:
+            return self._numeric[column]
+        return self._column(column, slice(None))
+
+    # 指定した行位置の1列を取り出す
+    def take_column(self, column, positions):
+        if column not in self.columns:
+            raise KeyError(column)
+        return self._column(column, np.asarray(positions, dtype=np.intp))
+
+    # カテゴリ列が value に一致する行の真偽値配列を返す
+    def category_mask(self, column, value):
+        index = self._categorical_columns.index(column)
+        categories = self.categories[column]
+        if value not in categories:
+            return np.zeros(len(self), dtype=bool)
+        return self.codes[:, index] == categories.index(value)
+
+    # 指定した行位置の行を DataFrame として返す（DataFrame.take と同じ使い方）
+    def take(self, positions):
+        positions = np.asarray(positions, dtype=np.intp)
+        data = {column: self._column(column, positions) for column in self.columns}
+        index = positions if self.labels is None else self.labels[positions]
+        return pd.DataFrame(data, index=index, columns=self.columns)
@@ -0,0 +1,44 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_search import RANK_COLUMN, SHELTER_PREFIX, find_nearest_batch
+from build_dataset import normalize_status
+from shelter_dataset import ShelterDataset
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES
+from shelter_search import DISTANCE_COLUMN
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    rng = np.random.default_rng(0)
+    n = 300
+    df = pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(n)],
+        '緯度': rng.uniform(33.4, 34.0, n),
+        '経度': rng.uniform(132.4, 133.0, n),
+        **{column: normalize_status(rng.choice(HAZARD_STATUSES, n)) for column in HAZARD_COLUMNS},
+    })
+    return ShelterDataset.from_frame(df, partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES)
+
+
+# 緯度・経度が数値でない・空欄の地点も、順位・避難所の列を空にした1行として入力の順に残ること
+@pytest.mark.parametrize("chunk_size", [1, 2, 100])
+def test_invalid_origins_are_kept(dataset, chunk_size):
+    origins = pd.read_csv(io.StringIO("名前,緯度,経度\na,33.8,132.8\nb,x,132.5\nc,33.5,132.5\nd,,132.6\n"))
+    results = find_nearest_batch(dataset, origins, top_n=3, chunk_size=chunk_size)
+
+    assert list(results['名前']) == ['a', 'a', 'a', 'b', 'c', 'c', 'c', 'd']
+    missing = results[results['名前'].isin(['b', 'd'])]
+    assert missing[RANK_COLUMN].isna().all()
+    assert missing[SHELTER_PREFIX + '施設・場所名'].isna().all()
+    assert missing[DISTANCE_COLUMN].isna().all()
+
+    for name, lat, lon in [('a', 33.8, 132.8), ('c', 33.5, 132.5)]:
+        found = results[results['名前'] == name]
+        expected = dataset.find_nearest(lat, lon, top_n=3)
+        assert list(found[RANK_COLUMN]) == [1, 2, 3]
+        assert list(found[SHELTER_PREFIX + '施設・場所名']) == list(expected['施設・場所名'])
+        np.testing.assert_allclose(found[DISTANCE_COLUMN], expected[DISTANCE_COLUMN], rtol=1e-9)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from build_dataset import normalize_status
+from cell_cache import CellCandidateCache
+from shelter_dataset import ShelterDataset
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES
+
+LAT_RANGE = (33.4, 34.0)
+LON_RANGE = (132.4, 133.0)
+
+
+# 地区ごとに集まった避難所（同じ座標の重複・座標の欠損を含む）の合成データセット
+@pytest.fixture(scope="module")
+def dataset():
+    rng = np.random.default_rng(0)
+    n = 800
+    centres = np.column_stack([rng.uniform(*LAT_RANGE, 20), rng.uniform(*LON_RANGE, 20)])
+    points = centres[rng.integers(0, 20, n)] + rng.normal(0, 0.02, (n, 2))
+    points[1::40] = points[0::40]
+    points[::97, 0] = np.nan
+    df = pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(n)],
+        '緯度': points[:, 0],
+        '経度': points[:, 1],
+        **{column: normalize_status(rng.choice(HAZARD_STATUSES, n, p=[0.6, 0.3, 0.1])) for column in HAZARD_COLUMNS},
+    })
+    return ShelterDataset.from_frame(df, partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES)
+
+
+# 検索地点。同じセルに複数の地点が入るよう、一部は近くに集める
+@pytest.fixture(scope="module")
+def origins():
+    rng = np.random.default_rng(1)
+    spread = np.column_stack([rng.uniform(*LAT_RANGE, 20), rng.uniform(*LON_RANGE, 20)])
+    return np.concatenate([spread, spread[:5] + rng.uniform(-0.003, 0.003, (5, 2))])
+
+
+# セルごとの候補から求めた結果が、セルの大きさ・絞込み条件によらず ShelterDataset.find_nearest と同じになること
+@pytest.mark.parametrize("cell_deg", [0.002, 0.01, 0.05])
+@pytest.mark.parametrize("filter_column, filter_value", [(None, None), ('df2_津波', 'O'), ('df2_土砂', 'X')])
+@pytest.mark.parametrize("top_n", [1, 5])
+def test_matches_find_nearest(dataset, origins, cell_deg, filter_column, filter_value, top_n):
+    cache = CellCandidateCache(cell_deg)
+    for _ in range(2):
+        for lat, lon in origins:
+            expected = dataset.find_nearest(lat, lon, filter_column, filter_value, top_n=top_n)
+            actual = cache.find_nearest(dataset, lat, lon, filter_column, filter_value, top_n=top_n)
+            pd.testing.assert_frame_equal(actual, expected)
+    assert cache.hits > 0
+
+
+def test_rejects_non_positive_cell_size():
+    with pytest.raises(ValueError):
+        CellCandidateCache(0)
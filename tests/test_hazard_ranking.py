@@ -0,0 +1,117 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from build_dataset import normalize_status
+from hazard_ranking import SCORE_COLUMN, STATUS_LEVELS, HazardMatrix, rank_shelters
+from shelter_dataset import ShelterDataset
+from shelter_schema import ELEVATION_COLUMN, HAZARD_COLUMNS, HAZARD_STATUSES
+from shelter_search import DISTANCE_COLUMN, geodesic_km
+
+# 避難所・検索地点を配置する範囲（愛媛県付近）
+LAT_RANGE = (33.4, 34.0)
+LON_RANGE = (132.4, 133.0)
+
+
+# 対応状況（build_dataset と同じカテゴリ列。一部は欠損）・標高（一部は欠損）を持つ合成データ。
+# 津波の標高による並べ替えを確かめるため、同じ座標の避難所を標高だけ変えて含める
+@pytest.fixture(scope="module")
+def shelters():
+    rng = np.random.default_rng(0)
+    n = 300
+    lats = rng.uniform(*LAT_RANGE, n)
+    lons = rng.uniform(*LON_RANGE, n)
+    lats[1::6], lons[1::6] = lats[0::6], lons[0::6]
+    lats[::51] = np.nan
+    choices = np.array(HAZARD_STATUSES + [None], dtype=object)
+    statuses = {column: normalize_status(rng.choice(choices, n, p=[0.5, 0.25, 0.15, 0.1])) for column in HAZARD_COLUMNS}
+    elevations = rng.choice([0.0, 2.5, 10.0, 30.0, np.nan], n)
+    return pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(n)],
+        '緯度': lats,
+        '経度': lons,
+        **statuses,
+        ELEVATION_COLUMN: elevations,
+    })
+
+
+@pytest.fixture(scope="module")
+def dataset(shelters):
+    return ShelterDataset.from_frame(shelters, partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES)
+
+
+@pytest.fixture(scope="module")
+def origins():
+    rng = np.random.default_rng(1)
+    return np.column_stack([rng.uniform(*LAT_RANGE, 8), rng.uniform(*LON_RANGE, 8)])
+
+
+# 全行の geodesic 距離から、スコア・（tie_break なら）標高の高い順・行位置の順に並べた上位 top_n 件の
+# (行位置, 距離, スコア) を返す関数
+def brute_force(df, lat, lon, eligible, bonus, tie_break, top_n):
+    rows = np.flatnonzero(eligible & np.isfinite(df['緯度']) & np.isfinite(df['経度']))
+    km = geodesic_km(lat, lon, df['緯度'].to_numpy()[rows], df['経度'].to_numpy()[rows])
+    scores = km - bonus[rows]
+    elevations = df[ELEVATION_COLUMN].to_numpy()[rows]
+    keys = [rows, np.where(np.isnan(elevations), np.inf, -elevations)] if tie_break else [rows]
+    order = np.lexsort(keys + [scores])[:top_n]
+    return rows[order], km[order], scores[order]
+
+
+def status_levels(df, column):
+    return df[column].astype(object).map(STATUS_LEVELS).fillna(-1).to_numpy()
+
+
+@pytest.mark.parametrize("requirements, weights, elevation_weight", [
+    ({}, {}, 0.0),
+    ({'df2_津波': 'O'}, {}, 0.0),
+    ({'df2_洪水': 'A', 'df2_土砂': 'O'}, {}, 0.0),
+    ({'df2_地震': 'A'}, {'df2_津波': 0.5, 'df2_高潮': 0.2}, 0.0),
+    ({}, {'df2_土砂': 1.0}, 0.05),
+])
+def test_rank_shelters_matches_brute_force(shelters, dataset, origins, requirements, weights, elevation_weight):
+    matrix = HazardMatrix.from_dataset(dataset)
+    eligible = np.ones(len(shelters), dtype=bool)
+    for column, status in requirements.items():
+        eligible &= status_levels(shelters, column) >= STATUS_LEVELS[status]
+    bonus = np.zeros(len(shelters))
+    for column, weight in weights.items():
+        bonus += weight * np.maximum(status_levels(shelters, column), 0)
+    bonus += elevation_weight * np.nan_to_num(shelters[ELEVATION_COLUMN].to_numpy())
+    tie_break = 'df2_津波' in requirements or 'df2_津波' in weights
+
+    for lat, lon in origins:
+        result, alternatives = rank_shelters(dataset, lat, lon, requirements, weights, elevation_weight,
+                                             top_n=5, alternatives_n=2, matrix=matrix)
+        rows, km, scores = brute_force(shelters, lat, lon, eligible, bonus, tie_break, 5)
+        np.testing.assert_array_equal(result.index.to_numpy(), rows)
+        np.testing.assert_allclose(result[DISTANCE_COLUMN].to_numpy(), km, rtol=0, atol=1e-12)
+        np.testing.assert_allclose(result[SCORE_COLUMN].to_numpy(), scores, rtol=0, atol=1e-12)
+
+        # 災害ごとの候補は、その災害が O の避難所を距離（津波は同じ距離なら標高の高い順）で並べたもの
+        for column in HAZARD_COLUMNS:
+            best = (shelters[column].astype(object) == HAZARD_STATUSES[0]).to_numpy()
+            rows, km, _ = brute_force(shelters, lat, lon, best, np.zeros(len(shelters)), column == 'df2_津波', 2)
+            np.testing.assert_array_equal(alternatives[column].index.to_numpy(), rows)
+            np.testing.assert_allclose(alternatives[column][DISTANCE_COLUMN].to_numpy(), km, rtol=0, atol=1e-12)
+
+
+# 津波を条件に含む場合、同じ座標・同じスコアの避難所は標高の高い順（欠損は最後）に並ぶこと
+def test_tsunami_elevation_tie_break():
+    df = pd.DataFrame({
+        '施設・場所名': ["低い", "欠損", "高い", "中間"],
+        '緯度': [33.8] * 4,
+        '経度': [132.8] * 4,
+        **{column: normalize_status(['O'] * 4) for column in HAZARD_COLUMNS},
+        ELEVATION_COLUMN: [1.0, np.nan, 20.0, 5.0],
+    })
+    dataset = ShelterDataset.from_frame(df, partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES)
+
+    result, alternatives = rank_shelters(dataset, 33.7, 132.7, {'df2_津波': 'O'}, top_n=4, alternatives_n=4)
+    assert list(result['施設・場所名']) == ["高い", "中間", "低い", "欠損"]
+    assert list(alternatives['df2_津波']['施設・場所名']) == ["高い", "中間", "低い", "欠損"]
+
+    # 津波を含まない場合は行の順
+    result, alternatives = rank_shelters(dataset, 33.7, 132.7, {'df2_洪水': 'O'}, top_n=4, alternatives_n=4)
+    assert list(result['施設・場所名']) == ["低い", "欠損", "高い", "中間"]
+    assert list(alternatives['df2_洪水']['施設・場所名']) == ["低い", "欠損", "高い", "中間"]
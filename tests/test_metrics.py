@@ -0,0 +1,33 @@
+import os
+import socket
+
+import metrics
+
+
+# 他のプロセスが使用中のポートを指定しても、例外にせず計測を有効にすること
+def test_configure_with_port_in_use():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        s.listen()
+        try:
+            assert metrics.configure(port=s.getsockname()[1], log=False) is not None
+        finally:
+            metrics.disable()
+
+
+# 環境変数の出力ファイルはプロセスごとに分け、系列には pid のラベルを付けること
+def test_configure_from_env_is_per_process(tmp_path):
+    path = str(tmp_path / "shelter.prom")
+    try:
+        registry = metrics.configure_from_env({"SHELTER_METRICS_FILE": path})
+        with metrics.span("search"):
+            pass
+        metrics.flush(force=True)
+    finally:
+        metrics.disable()
+
+    written = tmp_path / f"shelter.{os.getpid()}.prom"
+    assert not os.path.exists(path)
+    assert written.exists()
+    assert f'shelter_stage_seconds_count{{pid="{os.getpid()}",stage="search"}} 1' in written.read_text(encoding="utf-8")
+    assert registry.labels == {"pid": os.getpid()}
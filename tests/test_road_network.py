@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from road_network import MAX_SNAP_KM, WALK_DISTANCE_COLUMN, RoadGraph, WalkingRouter
+from shelter_dataset import ShelterDataset
+from shelter_search import DISTANCE_COLUMN, haversine_km
+
+# 格子の間隔(度)（約0.55km）
+SPACING_DEG = 0.005
+
+
+# 西の島（列 0〜4）と東の本土（列 6〜19）に分かれた格子状の道路網。島と本土はつながっていない
+@pytest.fixture(scope="module")
+def graph():
+    rows, cols = 10, 20
+    lats, lons = np.meshgrid(33.5 + SPACING_DEG * np.arange(rows), 132.5 + SPACING_DEG * np.arange(cols), indexing='ij')
+    node_ids = np.arange(rows * cols).reshape(rows, cols)
+    sources = np.concatenate([node_ids[:, :-1].ravel(), node_ids[:-1, :].ravel()])
+    targets = np.concatenate([node_ids[:, 1:].ravel(), node_ids[1:, :].ravel()])
+    island = node_ids[:, :5].ravel()
+    mainland = node_ids[:, 6:].ravel()
+    keep = (np.isin(sources, island) & np.isin(targets, island)) | (np.isin(sources, mainland) & np.isin(targets, mainland))
+    return RoadGraph.from_edges(lats.ravel(), lons.ravel(), sources[keep], targets[keep])
+
+
+def make_router(graph, points):
+    df = pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(len(points))],
+        '緯度': [lat for lat, _ in points],
+        '経度': [lon for _, lon in points],
+    })
+    return WalkingRouter(graph, ShelterDataset.from_frame(df))
+
+
+# まとめて求めた最寄りノードが、全ノードとの距離から求めたものと一致し、MAX_SNAP_KM より遠い地点は -1 になること
+def test_nearest_nodes_matches_brute_force(graph):
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(33.45, 33.6, 500)
+    lons = rng.uniform(132.45, 132.65, 500)
+    lats[::50] = np.nan
+    nodes, snap_km = graph.nearest_nodes(lats, lons)
+
+    for lat, lon, node, km in zip(lats, lons, nodes, snap_km):
+        if not np.isfinite(lat):
+            assert node == -1 and km == np.inf
+            continue
+        dists = haversine_km(lat, lon, graph.lats, graph.lons)
+        if dists.min() > MAX_SNAP_KM:
+            assert node == -1 and km == np.inf
+        else:
+            assert node == np.argmin(dists) and km == dists.min()
+
+
+# 島から検索すると、本土の避難所は道路でたどり着けず、直線距離の順に末尾に並ぶこと
+def test_unreachable_shelters_are_ordered_by_straight_distance(graph):
+    router = make_router(graph, [(33.52, 132.56), (33.52, 132.515), (33.51, 132.53), (33.5, 132.58), (33.51, 132.505)])
+    result = router.find_nearest(33.52, 132.51, top_n=5)
+
+    assert set(result['施設・場所名'].iloc[:2]) == {"避難所1", "避難所4"}
+    assert np.isfinite(result[WALK_DISTANCE_COLUMN].iloc[:2]).all()
+    unreachable = result[result[WALK_DISTANCE_COLUMN].isna()]
+    assert len(unreachable) == 3
+    assert unreachable[DISTANCE_COLUMN].is_monotonic_increasing
+
+
+# 道路から MAX_SNAP_KM より遠い避難所は、直線距離が近くても道路でたどり着けないとすること
+def test_shelter_far_from_roads_is_unreachable(graph):
+    router = make_router(graph, [(33.5 - 0.02, 132.56), (33.53, 132.58)])
+    result = router.find_nearest(33.51, 132.56, top_n=2)
+
+    assert list(result['施設・場所名']) == ["避難所1", "避難所0"]
+    assert np.isnan(result[WALK_DISTANCE_COLUMN].iloc[1])
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from shared_dataset import attach_current, open_shared_dataset
+from shelter_dataset import ShelterDataset
+
+
+def make_dataset(n):
+    rng = np.random.default_rng(n)
+    return ShelterDataset.from_frame(pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(n)],
+        '緯度': rng.uniform(33.0, 34.0, n),
+        '経度': rng.uniform(132.0, 133.0, n),
+    }))
+
+
+# 入力ファイルが変わっても、attach_current は構築せずに公開中のバージョンを返し、
+# open_shared_dataset が新しいバージョンを公開した後はそちらに切り替わること
+def test_attach_current_does_not_build(tmp_path):
+    source = tmp_path / "shelters.csv"
+    source.write_text("v1")
+    directory = str(tmp_path / "merged")
+    builds = []
+
+    def build(n):
+        builds.append(n)
+        return make_dataset(n)
+
+    first = open_shared_dataset(directory, [str(source)], lambda: build(10))
+    assert attach_current(directory).version == first.version
+
+    source.write_text("v2 (changed)")
+    assert attach_current(directory).version == first.version
+    assert builds == [10]
+
+    second = open_shared_dataset(directory, [str(source)], lambda: build(20))
+    assert builds == [10, 20]
+    assert second.version != first.version
+    assert attach_current(directory).version == second.version
+    assert len(attach_current(directory).store) == 20
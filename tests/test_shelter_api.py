@@ -0,0 +1,65 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from dataset_refresh import DatasetRefresher
+from query_cache import QueryCache
+from shelter_api import RequestError, ShelterService, parse_filter
+from shelter_dataset import ShelterDataset
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES, SHELTER_TYPE_COLUMNS
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# 合成データ（benchmarks.synthetic）のデータセットで検索するサービス
+@pytest.fixture(scope="module")
+def service():
+    from benchmarks.synthetic import make_merged_dataset
+
+    df = make_merged_dataset(200, source_path=os.path.join(ROOT, "ehime_hinan.csv"))
+    refresher = DatasetRefresher(lambda: ShelterDataset.from_frame(
+        df, partition_columns=list(SHELTER_TYPE_COLUMNS) + HAZARD_COLUMNS, partition_values=HAZARD_STATUSES
+    ))
+    refresher.result()
+    service = ShelterService(refresher, QueryCache(), workers=1)
+    yield service
+    service.executor.shutdown()
+
+
+def post_batch(service, request):
+    return asyncio.run(service.handle("POST", "/nearest/batch", json.dumps(request).encode("utf-8")))
+
+
+@pytest.mark.parametrize("value", [["津波"], {"name": "津波"}, 1, True])
+@pytest.mark.parametrize("name", ["type", "disaster", "status"])
+def test_parse_filter_rejects_non_string(name, value):
+    params = {"disaster": "津波", name: value}
+    with pytest.raises(RequestError) as error:
+        parse_filter(params)
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize("request_body", [
+    {"points": [[33.8, 132.8]], "type": ["指定避難所"]},
+    {"points": [[33.8, 132.8]], "disaster": {"name": "津波"}},
+    {"points": [[33.8, 132.8]], "disaster": "津波", "status": ["O"]},
+    {"points": [[33.8, 132.8]], "top_n": [5]},
+    {"points": [[33.8, "x"]]},
+    {"points": [[33.8]]},
+    {"points": "33.8,132.8"},
+])
+def test_malformed_batch_body_is_bad_request(service, request_body):
+    with pytest.raises(RequestError) as error:
+        post_batch(service, request_body)
+    assert error.value.status == 400
+
+
+def test_batch_search(service):
+    status, body, _ = post_batch(service, {"points": [[33.8, 132.8], {"lat": 33.5, "lon": 132.5}],
+                                           "disaster": "津波", "top_n": 3})
+    results = json.loads(body)["results"]
+    assert status == 200
+    assert [len(shelters) for shelters in results] == [3, 3]
+    assert all(shelter["df2_津波"] == "O" for shelters in results for shelter in shelters)
@@ -0,0 +1,152 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from build_dataset import normalize_status
+from query_cache import QueryCache
+from shelter_dataset import ShelterDataset, carry_over_query_cache, find_nearest_cached, update_dataset
+from shelter_index import GridIndex
+from shelter_schema import HAZARD_COLUMNS, HAZARD_STATUSES
+from shelter_search import DISTANCE_COLUMN
+
+LAT_RANGE = (33.4, 34.0)
+LON_RANGE = (132.4, 133.0)
+
+# 比べる絞込み条件（なし・分割済みインデックスのある条件）
+FILTERS = [(None, None), ('df2_津波', 'O'), ('df2_洪水', 'X')]
+
+
+def make_frame(rng, ids):
+    n = len(ids)
+    return pd.DataFrame({
+        '共通ID': ids,
+        '施設・場所名': [f"避難所{i}" for i in ids],
+        '緯度': rng.uniform(*LAT_RANGE, n),
+        '経度': rng.uniform(*LON_RANGE, n),
+        **{column: normalize_status(rng.choice(HAZARD_STATUSES, n)) for column in HAZARD_COLUMNS},
+    })
+
+
+def build(df):
+    return ShelterDataset.from_frame(df, partition_columns=HAZARD_COLUMNS, partition_values=HAZARD_STATUSES)
+
+
+# 入力ファイルの更新（座標・対応状況の変更、削除、追加）を模した変更前後の DataFrame
+@pytest.fixture(scope="module")
+def frames():
+    rng = np.random.default_rng(0)
+    old = make_frame(rng, [f"E{i:06d}" for i in range(400)])
+
+    new = old.copy()
+    moved = rng.choice(len(new), 20, replace=False)
+    new.loc[moved, '緯度'] = rng.uniform(*LAT_RANGE, len(moved))
+    new.loc[moved, '経度'] = rng.uniform(*LON_RANGE, len(moved))
+    relabelled = rng.choice(len(new), 20, replace=False)
+    new['df2_津波'] = normalize_status(np.where(np.isin(np.arange(len(new)), relabelled), 'X', new['df2_津波'].astype(str)))
+    new = new.drop(index=rng.choice(len(new), 15, replace=False))
+    new = pd.concat([new, make_frame(rng, [f"N{i:06d}" for i in range(25)])], ignore_index=True)
+    return old, new
+
+
+@pytest.fixture(scope="module")
+def origins():
+    rng = np.random.default_rng(1)
+    return np.column_stack([rng.uniform(*LAT_RANGE, 30), rng.uniform(*LON_RANGE, 30)])
+
+
+def comparable(result):
+    return result.drop(columns=DISTANCE_COLUMN).reset_index(drop=True), result[DISTANCE_COLUMN].to_numpy()
+
+
+# 変わった行だけを反映したデータセットの検索結果が、作り直したデータセットと同じになること
+def test_update_matches_rebuild(frames, origins):
+    old, new = frames
+    updated, changes = update_dataset(build(old), new)
+    rebuilt = build(new)
+    assert changes is not None
+    assert updated.version != build(old).version
+
+    for lat, lon in origins:
+        for column, value in FILTERS:
+            expected, expected_km = comparable(rebuilt.find_nearest(lat, lon, column, value, top_n=5))
+            actual, actual_km = comparable(updated.find_nearest(lat, lon, column, value, top_n=5))
+            pd.testing.assert_frame_equal(actual, expected)
+            np.testing.assert_array_equal(actual_km, expected_km)
+
+
+def test_update_without_changes_returns_same_dataset(frames):
+    old, _ = frames
+    dataset = build(old)
+    updated, (removed, added) = update_dataset(dataset, old.copy())
+    assert updated is dataset
+    assert len(removed) == 0 and len(added) == 0
+
+
+# 分割済みインデックスがない条件は、全体のインデックスと条件に一致する行の mask で検索すること
+def test_search_index_without_partition(frames):
+    old, _ = frames
+    dataset = ShelterDataset.from_frame(old)
+    for column, value in [('df2_津波', 'O'), ('df2_洪水', 'X'), ('df2_土砂', 'Z'), ('施設・場所名', '避難所E000003')]:
+        index, mask = dataset.search_index(column, value)
+        assert index is dataset.index
+        np.testing.assert_array_equal(mask, (old[column].astype(object) == value).to_numpy())
+
+
+# 差し込みで更新したインデックスが、同じセルの大きさで作り直したものと同じ配列になること
+def test_grid_index_updated_matches_rebuild():
+    rng = np.random.default_rng(2)
+    lats = rng.uniform(*LAT_RANGE, 300)
+    lons = rng.uniform(*LON_RANGE, 300)
+    lats[::37] = np.nan
+    index = GridIndex(lats, lons)
+
+    removed = rng.choice(300, 30, replace=False)
+    new_lats = np.concatenate([lats, rng.uniform(*LAT_RANGE, 40)])
+    new_lons = np.concatenate([lons, rng.uniform(*LON_RANGE, 40)])
+    new_lats[removed] = np.nan
+    updated = index.updated(removed, np.arange(300, 340), new_lats, new_lons)
+
+    expected_meta, expected = GridIndex(new_lats, new_lons, cell_deg=index.cell_deg).to_arrays()
+    actual_meta, actual = updated.to_arrays()
+    assert actual_meta == expected_meta
+    for name in expected:
+        np.testing.assert_array_equal(actual[name], expected[name])
+
+
+# 引き継いだ検索キャッシュの結果が更新後の検索結果と同じで、結果が変わった検索は引き継がないこと
+def test_carry_over_query_cache(frames, origins):
+    old, new = frames
+    dataset = build(old)
+    updated, changes = update_dataset(dataset, new)
+    cache = QueryCache()
+    for lat, lon in origins:
+        for column, value in FILTERS:
+            find_nearest_cached(dataset, cache, lat, lon, column, value, top_n=5)
+
+    before = dict(cache.items())
+    carry_over_query_cache(cache, dataset, updated, changes)
+    after = dict(cache.items())
+    assert all(key[0] == updated.version for key in after)
+
+    carried = changed = 0
+    for key, result in before.items():
+        _, lat, lon, column, value, top_n = key
+        fresh = updated.find_nearest(lat, lon, column, value, top_n=top_n)
+        new_key = (updated.version,) + key[1:]
+        if new_key in after:
+            carried += 1
+            pd.testing.assert_frame_equal(after[new_key], fresh)
+        changed += not result.equals(fresh)
+    assert carried > 0 and changed > 0
+    assert carried + changed <= len(before)
+
+
+# 作り直した場合（変更内容が None）は、変更前のバージョンのエントリーをすべて捨てること
+def test_carry_over_query_cache_after_rebuild(frames, origins):
+    old, new = frames
+    dataset = build(old)
+    cache = QueryCache()
+    lat, lon = origins[0]
+    find_nearest_cached(dataset, cache, lat, lon, top_n=5)
+    carry_over_query_cache(cache, dataset, build(new), None)
+    assert len(cache) == 0
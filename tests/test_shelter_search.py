@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from shelter_index import build_index
+from shelter_search import DISTANCE_COLUMN, find_nearest, geodesic_km
+
+# 避難所・検索地点を配置する範囲（愛媛県付近）
+LAT_RANGE = (32.9, 34.4)
+LON_RANGE = (132.0, 133.7)
+
+
+# 座標（一部は欠損・同じ座標の重複あり）と絞込み用の列を持つ合成データ
+@pytest.fixture(scope="module")
+def shelters():
+    rng = np.random.default_rng(0)
+    n = 500
+    lats = rng.uniform(*LAT_RANGE, n)
+    lons = rng.uniform(*LON_RANGE, n)
+    lats[::97] = np.nan
+    lats[1::50], lons[1::50] = lats[0::50][:len(lats[1::50])], lons[0::50][:len(lons[1::50])]
+    return pd.DataFrame({
+        '施設・場所名': [f"避難所{i}" for i in range(n)],
+        '緯度': lats,
+        '経度': lons,
+        'df2_津波': rng.choice(['O', 'A', 'X'], n),
+    })
+
+
+@pytest.fixture(scope="module")
+def origins():
+    rng = np.random.default_rng(1)
+    return np.column_stack([rng.uniform(*LAT_RANGE, 20), rng.uniform(*LON_RANGE, 20)])
+
+
+# 全行の geodesic 距離を計算して並べた、上位N件の (行ラベル, 距離) を返す関数
+def brute_force(df, lat, lon, top_n, mask=None):
+    rows = df[np.isfinite(df['緯度']) & np.isfinite(df['経度'])]
+    if mask is not None:
+        rows = rows[mask[rows.index]]
+    distances = geodesic_km(lat, lon, rows['緯度'], rows['経度'])
+    order = np.argsort(distances, kind='stable')[:top_n]
+    return rows.index[order].to_numpy(), distances[order]
+
+
+# haversine による候補の絞込みと geodesic での再計算の結果が、全行を geodesic で並べた結果と一致すること
+# （空間インデックス・絞込み条件の有無を問わない）
+@pytest.mark.parametrize("use_index", [False, True])
+@pytest.mark.parametrize("status", [None, 'O', 'X'])
+@pytest.mark.parametrize("top_n", [1, 5])
+def test_find_nearest_matches_brute_force(shelters, origins, use_index, status, top_n):
+    mask = None if status is None else (shelters['df2_津波'] == status).to_numpy()
+    index = build_index(shelters) if use_index else None
+
+    for lat, lon in origins:
+        result = find_nearest(shelters, lat, lon, top_n=top_n, index=index, mask=mask)
+        expected_rows, expected_km = brute_force(shelters, lat, lon, top_n, mask)
+        np.testing.assert_array_equal(result.index.to_numpy(), expected_rows)
+        np.testing.assert_array_equal(result[DISTANCE_COLUMN].to_numpy(), expected_km)
+
+
+def test_find_nearest_does_not_modify_input(shelters):
+    before = shelters.copy()
+    find_nearest(shelters, 33.8, 132.8, top_n=5)
+    pd.testing.assert_frame_equal(shelters, before)